@@ -0,0 +1,13 @@
+import subprocess
+from typing import Optional
+
+
+def git_commit() -> Optional[str]:
+    """The commit we're benchmarking, to record with the results."""
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'],
+                              capture_output=True,
+                              text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
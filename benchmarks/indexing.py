@@ -0,0 +1,240 @@
+"""
+Micro-benchmarks for the parsing and indexing code paths.
+
+The benchmarks run against the HTML documents in tests/documents, and
+against copies of them whose content we repeat to make bigger pages.
+They don't need Redis or the network.
+
+Run them from the root of the repository:
+
+    python -m benchmarks.indexing --output before.json
+    python -m benchmarks.indexing --output after.json --compare before.json
+"""
+import copy
+import datetime
+import json
+import os
+import platform
+import statistics
+import time
+from types import SimpleNamespace
+from typing import Callable, Dict, List, Optional, Tuple
+from unittest import mock
+
+import click
+from bs4 import BeautifulSoup, element
+
+from benchmarks import git_commit
+from sitesearch.config import AppConfiguration
+from sitesearch.errors import ParseError
+from sitesearch.indexer import DocumentParser, Indexer, safe_url
+from sitesearch.models import SearchDocument
+from sitesearch.sites.redis_labs import DOCS_PROD
+from sitesearch.transformer import transform_documents
+
+DOCS_DIR = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), "tests", "documents")
+BENCHMARK_URL = f"{DOCS_PROD.url}/benchmarks"
+DEFAULT_SCALES = "1,10"
+DEFAULT_ROUNDS = 5
+
+Corpus = List[Tuple[str, str]]
+
+
+def load_corpus() -> Corpus:
+    """Get a URL and the HTML for each document we can parse."""
+    parser = DocumentParser(DOCS_PROD.url, (), DOCS_PROD.content_classes)
+    corpus = []
+
+    for filename in sorted(os.listdir(DOCS_DIR)):
+        if not filename.endswith(".html"):
+            continue
+        with open(os.path.join(DOCS_DIR, filename), encoding='utf-8') as f:
+            html = f.read()
+        url = f"{BENCHMARK_URL}/{filename[:-len('.html')]}/"
+        try:
+            parser.prepare_document(url, html)
+        except ParseError:
+            continue
+        corpus.append((url, html))
+
+    return corpus
+
+
+def enlarge(html: str, scale: int) -> str:
+    """
+    Make a page bigger by repeating its main content `scale` times.
+    Each copy gets its own section titles, so that every copy of an H2
+    becomes a separate section document.
+    """
+    if scale == 1:
+        return html
+
+    soup = BeautifulSoup(html, 'html.parser')
+    content = soup.body or soup
+    for content_class in DOCS_PROD.content_classes:
+        found = soup.select(content_class)
+        if found:
+            content = found[0]
+            break
+
+    children = list(content.children)
+    for i in range(1, scale):
+        for child in children:
+            child = copy.copy(child)
+            if isinstance(child, element.Tag):
+                headers = child.find_all(['h2', 'h3'])
+                if child.name in ('h2', 'h3'):
+                    headers.append(child)
+                for header in headers:
+                    if header.string:
+                        header.string = f"{header.string} ({i})"
+            content.append(child)
+
+    return str(soup)
+
+
+def make_indexer() -> Indexer:
+    search_client = mock.MagicMock()
+    return Indexer(DOCS_PROD, AppConfiguration(), search_client)
+
+
+def make_benchmarks(corpus: Corpus) -> Dict[str, Tuple[Callable, int]]:
+    """
+    Set up the benchmarks for a corpus. Returns a map of benchmark names
+    to a function that runs the benchmark once over the whole corpus and
+    the number of items the function processes.
+    """
+    parser = DocumentParser(DOCS_PROD.url, (), DOCS_PROD.content_classes)
+    indexer = make_indexer()
+
+    pages = []
+    docs: List[SearchDocument] = []
+    for url, html in corpus:
+        soup = BeautifulSoup(html, 'html.parser')
+        content = soup.select(DOCS_PROD.content_classes[0])
+        content = content[0] if content else soup
+        h2s = content.find_all('h2') or content.find_all('h3')
+        page_docs = parser.prepare_document(url, html)
+        pages.append((page_docs[0], content, h2s))
+        docs += page_docs
+
+    indexer.seen_urls[BENCHMARK_URL] = "Benchmarks"
+    for doc in docs:
+        indexer.seen_urls[safe_url(doc.url)] = doc.title
+
+    results = []
+    for doc in docs:
+        fields = indexer.document_to_dict(doc)
+        fields['hierarchy'] = json.dumps(indexer.build_hierarchy(doc))
+        results.append(SimpleNamespace(**fields))
+
+    def prepare_document():
+        for url, html in corpus:
+            parser.prepare_document(url, html)
+
+    def extract_parts():
+        # extract_parts() used to find the text of each section itself.
+        # extract_text() does that now, so we time both, to compare with
+        # results from before the change.
+        for doc, content, h2s in pages:
+            _, section_texts = parser.extract_text(content, h2s)
+            parser.extract_parts(doc, h2s, section_texts)
+
+    def document_to_dict():
+        for doc in docs:
+            indexer.document_to_dict(doc)
+
+    def build_hierarchy():
+        for doc in docs:
+            indexer.build_hierarchy(doc)
+
+    def transform():
+        transform_documents(results, DOCS_PROD, "redis")
+
+    return {
+        "DocumentParser.prepare_document": (prepare_document, len(corpus)),
+        "DocumentParser.extract_parts": (extract_parts, len(pages)),
+        "Indexer.document_to_dict": (document_to_dict, len(docs)),
+        "Indexer.build_hierarchy": (build_hierarchy, len(docs)),
+        "transform_documents": (transform, len(results)),
+    }
+
+
+def run_benchmark(fn: Callable, items: int, rounds: int) -> Dict[str, float]:
+    """Time `rounds` runs of a benchmark, after one to warm up."""
+    fn()
+    timings = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+
+    return {
+        "items": items,
+        "rounds": rounds,
+        "min": min(timings),
+        "median": statistics.median(timings),
+        "mean": statistics.mean(timings),
+        "min_per_item": min(timings) / items if items else 0.0,
+    }
+
+
+def compare(results: Dict, baseline: Dict):
+    """Print how much faster or slower each benchmark got."""
+    click.echo(f"\n{'benchmark':<50} {'baseline':>10} {'current':>10} {'change':>8}")
+    for name, current in results['benchmarks'].items():
+        previous = baseline['benchmarks'].get(name)
+        if not previous:
+            continue
+        change = (current['min'] - previous['min']) / previous['min'] * 100
+        click.echo(f"{name:<50} {previous['min'] * 1000:>8.2f}ms "
+                   f"{current['min'] * 1000:>8.2f}ms {change:>+7.1f}%")
+
+
+@click.option('--compare',
+              'baseline_path',
+              default=None,
+              help="Compare the results to a JSON file from an earlier run.")
+@click.option('--output',
+              default=None,
+              help="Save the results to this JSON file.")
+@click.option('--rounds',
+              default=DEFAULT_ROUNDS,
+              help="How many times to run each benchmark.")
+@click.option('--scales',
+              default=DEFAULT_SCALES,
+              help="Comma-separated factors to enlarge the documents by.")
+@click.command()
+def benchmark(scales: str, rounds: int, output: Optional[str],
+              baseline_path: Optional[str]):
+    """Benchmark parsing and indexing documents."""
+    corpus = load_corpus()
+    results = {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "created_at": datetime.datetime.now().isoformat(),
+        "benchmarks": {},
+    }
+
+    for scale in (int(s) for s in scales.split(",")):
+        scaled = [(url, enlarge(html, scale)) for url, html in corpus]
+        for name, (fn, items) in make_benchmarks(scaled).items():
+            name = f"{name}[x{scale}]"
+            result = run_benchmark(fn, items, rounds)
+            result['scale'] = scale
+            results['benchmarks'][name] = result
+            click.echo(f"{name:<50} {result['min'] * 1000:>8.2f}ms "
+                       f"({result['items']} items)")
+
+    if output:
+        with open(output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if baseline_path:
+        with open(baseline_path) as f:
+            compare(results, json.load(f))
+
+
+if __name__ == '__main__':
+    benchmark()
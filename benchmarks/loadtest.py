@@ -0,0 +1,209 @@
+"""
+Replay a sample of real searches against the search API and measure
+throughput, latency and errors.
+
+The API records a sample of searches in Redis if you set
+QUERY_LOG_SAMPLE_RATE. Export them to a file in production:
+
+    python -m benchmarks.loadtest export --output queries.jsonl
+
+Then replay them against a running app, or against the app in this
+process with Falcon's test client if you don't give a URL:
+
+    python -m benchmarks.loadtest replay queries.jsonl --url http://localhost:8080 --concurrency 20
+    python -m benchmarks.loadtest replay queries.jsonl --output after.json --compare before.json
+"""
+import datetime
+import json
+import logging
+import math
+import platform
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple
+from urllib.error import HTTPError
+from urllib.parse import urlencode
+from urllib.request import urlopen
+
+import click
+from falcon import testing
+
+from benchmarks import git_commit
+from sitesearch.api.app import create_app
+from sitesearch.config import AppConfiguration
+from sitesearch.connections import get_redis_connection
+from sitesearch.keys import Keys
+
+log = logging.getLogger(__name__)
+
+DEFAULT_CONCURRENCY = 10
+DEFAULT_TIMEOUT = 10
+# The status we record for a request that got no response at all.
+NO_RESPONSE = 0
+
+Query = Dict[str, str]
+# Sends a search and returns the status code of the response.
+Sender = Callable[[Query], int]
+
+
+def load_queries(path: str) -> List[Query]:
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def http_sender(url: str, timeout: float = DEFAULT_TIMEOUT) -> Sender:
+    """Send searches to a running app."""
+    search_url = f"{url.rstrip('/')}/search"
+
+    def send(query: Query) -> int:
+        try:
+            with urlopen(f"{search_url}?{urlencode(query)}",
+                         timeout=timeout) as response:
+                response.read()
+                return response.status
+        except HTTPError as e:
+            return e.code
+
+    return send
+
+
+def app_sender(app_config: AppConfiguration) -> Sender:
+    """Send searches to the app in this process."""
+    client = testing.TestClient(create_app(app_config))
+
+    def send(query: Query) -> int:
+        return client.simulate_get('/search', params=query).status_code
+
+    return send
+
+
+def timed(send: Sender, query: Query) -> Tuple[float, int]:
+    start = time.perf_counter()
+    try:
+        status = send(query)
+    except Exception as e:  # Count anything that goes wrong as an error.
+        log.error("Search failed: %s, %s", e, query)
+        status = NO_RESPONSE
+    return time.perf_counter() - start, status
+
+
+def percentile(latencies: List[float], p: float) -> float:
+    """The nearest-rank percentile of sorted latencies."""
+    return latencies[max(math.ceil(p / 100 * len(latencies)) - 1, 0)]
+
+
+def run_load_test(send: Sender, queries: List[Query], concurrency: int,
+                  repeat: int = 1) -> Dict:
+    """Send every query `repeat` times, `concurrency` at a time."""
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        timings = list(
+            pool.map(lambda query: timed(send, query), queries * repeat))
+    duration = time.perf_counter() - start
+
+    latencies = sorted(seconds * 1000 for seconds, _ in timings)
+    status_codes: Dict[str, int] = {}
+    for _, status in timings:
+        status_codes[str(status)] = status_codes.get(str(status), 0) + 1
+    errors = sum(1 for _, status in timings
+                 if status == NO_RESPONSE or status >= 400)
+
+    return {
+        "requests": len(timings),
+        "concurrency": concurrency,
+        "duration_s": duration,
+        "throughput_rps": len(timings) / duration if duration else 0,
+        "latency_ms": {
+            "p50": percentile(latencies, 50),
+            "p95": percentile(latencies, 95),
+            "p99": percentile(latencies, 99),
+            "mean": sum(latencies) / len(latencies),
+            "max": latencies[-1],
+        } if latencies else {},
+        "errors": errors,
+        "error_rate": errors / len(timings) if timings else 0,
+        "status_codes": status_codes,
+    }
+
+
+def compare(results: Dict, baseline: Dict):
+    click.echo(f"\n{'metric':<20} {'baseline':>12} {'current':>12} {'change':>8}",
+               err=True)
+    rows = [('throughput_rps', results['throughput_rps'],
+             baseline['throughput_rps'])]
+    rows += [(f"{name}_ms", value, baseline['latency_ms'].get(name))
+             for name, value in results['latency_ms'].items()]
+    rows.append(('error_rate', results['error_rate'], baseline['error_rate']))
+    for name, current, previous in rows:
+        if previous is None:
+            continue
+        change = (f"{(current - previous) / previous * 100:+.1f}%"
+                  if previous else "")
+        click.echo(f"{name:<20} {previous:>12.2f} {current:>12.2f} {change:>8}",
+                   err=True)
+
+
+@click.group()
+def loadtest():
+    """Record and replay searches to load test the search API."""
+
+
+@click.option('--output',
+              default="-",
+              help="Write the queries to this file instead of stdout.")
+@loadtest.command()
+def export(output: str):
+    """Export the queries the API sampled into its query log."""
+    keys = Keys(AppConfiguration().key_prefix)
+    # The log is newest first, and we replay oldest first.
+    entries = reversed(get_redis_connection().lrange(keys.query_log(), 0, -1))
+    with click.open_file(output, 'w') as f:
+        for entry in entries:
+            f.write(f"{entry}\n")
+
+
+@click.option('--compare',
+              'baseline_path',
+              default=None,
+              help="Compare the results to a JSON file from an earlier run.")
+@click.option('--output',
+              default=None,
+              help="Save the results to this JSON file instead of printing them.")
+@click.option('--repeat',
+              default=1,
+              help="How many times to send each query.")
+@click.option('--concurrency',
+              default=DEFAULT_CONCURRENCY,
+              help="How many searches to send at once.")
+@click.option('--url',
+              default=None,
+              help="The base URL of a running app. If not given, we search "
+              "the app in this process.")
+@click.argument('queries_path')
+@loadtest.command()
+def replay(queries_path: str, url: Optional[str], concurrency: int,
+           repeat: int, output: Optional[str], baseline_path: Optional[str]):
+    """Replay the queries in QUERIES_PATH and report how the API did."""
+    queries = load_queries(queries_path)
+    send = http_sender(url) if url else app_sender(AppConfiguration())
+    results = {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "created_at": datetime.datetime.now().isoformat(),
+        "target": url or "in-process",
+        **run_load_test(send, queries, concurrency, repeat),
+    }
+
+    if output:
+        with open(output, 'w') as f:
+            json.dump(results, f, indent=2)
+    else:
+        click.echo(json.dumps(results, indent=2))
+
+    if baseline_path:
+        with open(baseline_path) as f:
+            compare(results, json.load(f))
+
+
+if __name__ == '__main__':
+    loadtest()
@@ -0,0 +1,96 @@
+"""
+Measure how long a new API worker takes to import the WSGI app, and how
+much memory it holds once it has.
+
+Every gunicorn worker imports the app, so we keep a budget for both and
+check that the worker doesn't load the crawler, which only the indexer
+needs. Each round runs in a fresh Python process. The API reads its
+settings at import time, so run this with the same environment (or .env
+file) as the API:
+
+    python -m benchmarks.startup
+"""
+import json
+import statistics
+import subprocess
+import sys
+from typing import Dict
+
+import click
+
+API_MODULE = 'sitesearch.api.wsgi'
+DEFAULT_ROUNDS = 5
+
+# Budgets for importing the API. Before we kept Scrapy out of it,
+# importing the API took about 0.85s and 103 MB; afterward, about 0.5s
+# and 50 MB.
+MAX_IMPORT_SECONDS = 0.75
+MAX_RSS_MB = 75
+
+# Modules that only crawling and indexing need.
+INDEXING_MODULES = ('scrapy', 'twisted', 'bs4', 'lxml', 'ipdb')
+
+MEASURE = """
+import json, resource, sys, time
+start = time.perf_counter()
+import {module}
+seconds = time.perf_counter() - start
+try:
+    # ru_maxrss would include the peak of the process that started us,
+    # because Linux keeps it across exec.
+    with open('/proc/self/status') as f:
+        rss_kb = next(int(line.split()[1]) for line in f
+                      if line.startswith('VmHWM:'))
+except OSError:
+    # macOS reports bytes.
+    rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+rss_mb = rss_kb / 1024
+print(json.dumps({{
+    "seconds": seconds,
+    "rss_mb": rss_mb,
+    "modules": len(sys.modules),
+    "indexing_modules": sorted(m for m in {indexing_modules!r} if m in sys.modules),
+}}))
+"""
+
+
+def measure_startup(module: str = API_MODULE) -> Dict:
+    """Import a module in a new Python process and measure the cost."""
+    code = MEASURE.format(module=module, indexing_modules=INDEXING_MODULES)
+    output = subprocess.run([sys.executable, '-c', code],
+                            check=True,
+                            capture_output=True,
+                            text=True).stdout
+    return json.loads(output)
+
+
+@click.option('--rounds',
+              default=DEFAULT_ROUNDS,
+              help="How many times to start a new process and import the API.")
+@click.command()
+def startup(rounds: int):
+    """Benchmark importing the API and check it against our budget."""
+    results = [measure_startup() for _ in range(rounds)]
+    seconds = statistics.median(r['seconds'] for r in results)
+    rss_mb = max(r['rss_mb'] for r in results)
+    indexing_modules = results[-1]['indexing_modules']
+
+    click.echo(f"{'import time (median)':<30} {seconds * 1000:>8.1f}ms "
+               f"(budget {MAX_IMPORT_SECONDS * 1000:.0f}ms)")
+    click.echo(f"{'max RSS':<30} {rss_mb:>8.1f}MB (budget {MAX_RSS_MB}MB)")
+    click.echo(f"{'modules':<30} {results[-1]['modules']:>8}")
+
+    errors = []
+    if seconds > MAX_IMPORT_SECONDS:
+        errors.append("Importing the API took longer than our budget.")
+    if rss_mb > MAX_RSS_MB:
+        errors.append("The API used more memory than our budget.")
+    if indexing_modules:
+        errors.append("The API imported modules that only the indexer needs: "
+                      f"{', '.join(indexing_modules)}")
+    if errors:
+        raise click.ClickException(" ".join(errors))
+
+
+if __name__ == '__main__':
+    startup()
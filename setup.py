@@ -22,6 +22,8 @@ setuptools.setup(
     entry_points={
         'console_scripts': [
             'index=sitesearch.commands.index:index',
+            'replay=sitesearch.commands.replay:replay',
+            'crawler=sitesearch.commands.crawler:crawler',
             'search=sitesearch.commands.search:search',
             'drop_index=sitesearch.commands.drop_index:drop_index',
             'clear_old_indexes=sitesearch.commands.clear_indexes:clear_indexes'
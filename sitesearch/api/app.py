@@ -3,26 +3,35 @@ from falcon_cors import CORS
 
 from sitesearch.config import AppConfiguration
 from .search import SearchResource
+from .search_batch import SearchBatchResource
+from .suggest import SuggestResource
 from .indexer import IndexerResource
 from .job import JobResource
 from .health import HealthCheckResource
+from .metrics import MetricsResource
+
+
+CORS_ORIGINS = [
+    'https://docs.redislabs.com',
+    'https://developer.redislabs.com',
+    'http://localhost:3000',
+    'http://localhost:1313',
+    'http://localhost:8000',
+]
 
 
 def create_app(config=None):
     config = config or AppConfiguration()
 
-    cors = CORS(allow_origins_list=[
-        'https://docs.redislabs.com',
-        'https://developer.redislabs.com',
-        'http://localhost:3000',
-        'http://localhost:1313',
-        'http://localhost:8000',
-    ], allow_all_headers=True)
+    cors = CORS(allow_origins_list=CORS_ORIGINS, allow_all_headers=True)
 
     api = falcon.API(middleware=[cors.middleware])
     api.add_route('/search', SearchResource(config))
+    api.add_route('/search/batch', SearchBatchResource(config))
+    api.add_route('/suggest', SuggestResource(config))
     api.add_route('/indexer', IndexerResource(config))
     api.add_route('/jobs/{job_id}', JobResource(config))
     api.add_route('/health', HealthCheckResource(config))
+    api.add_route('/metrics', MetricsResource(config))
 
     return api
@@ -0,0 +1,332 @@
+import asyncio
+import json
+import logging
+import time
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qsl
+
+import aioredis
+import falcon
+from newrelic import agent
+
+from sitesearch.api.app import CORS_ORIGINS
+from sitesearch.api.search import (SearchParams, SearchResource,
+                                   SearchResponse, etag, search_result)
+from sitesearch.config import AppConfiguration
+from sitesearch.connections import (REDIS_HOST, REDIS_MAX_CONNECTIONS,
+                                    REDIS_PASSWORD, REDIS_PORT)
+from sitesearch.metrics import (CONTENT_TYPE, SEARCH_CACHE_HITS,
+                                SEARCH_COALESCED, SEARCH_STAGE_SECONDS, render)
+from sitesearch.search_cache import AsyncSearchCache, generation_index
+from sitesearch.single_flight import AsyncSingleFlight
+
+log = logging.getLogger(__name__)
+
+SEARCH_CMD = 'FT.SEARCH'
+
+Headers = List[Tuple[bytes, bytes]]
+
+
+def parse_etags(header: str) -> List[str]:
+    """The ETags in an If-None-Match header, without quotes or "W/"."""
+    tags = (tag.strip() for tag in header.split(','))
+    return [(tag[2:] if tag.startswith('W/') else tag).strip('"')
+            for tag in tags]
+
+
+class AsyncSearchApp:
+    """
+    An ASGI version of the search API.
+
+    The WSGI app runs on gevent workers, which patch redis-py's sockets so
+    that requests can wait on Redis concurrently. This app sends the same
+    RediSearch commands through aioredis instead. It shares request
+    parsing, query building and rendering with SearchResource, so the two
+    apps return the same results for the same request.
+
+    Unlike SearchResource, this app sends every command to the primary:
+    it doesn't read from REDIS_READ_REPLICAS. It does sample searches
+    into the query log the same way.
+
+    Besides /search, the app serves /health and /metrics. Run it with an ASGI server,
+    e.g.:
+
+        gunicorn -k uvicorn.workers.UvicornWorker sitesearch.api.asgi:app
+    """
+    def __init__(self, app_config: AppConfiguration):
+        self.app_config = app_config
+        self.search_resource = SearchResource(app_config)
+        self.keys = self.search_resource.keys
+        # We send metrics to Redis through aioredis, rather than block the
+        # event loop with the synchronous client.
+        self.metrics = self.search_resource.metrics
+        self.metrics.autoflush = False
+        self.in_flight = AsyncSingleFlight()
+        self.redis = None
+        self.cache: Optional[AsyncSearchCache] = None
+        self.connecting: Optional[asyncio.Future] = None
+
+    async def connect(self):
+        self.redis = await aioredis.create_redis_pool(
+            (REDIS_HOST, int(REDIS_PORT)),
+            password=REDIS_PASSWORD,
+            maxsize=REDIS_MAX_CONNECTIONS,
+            encoding='utf-8')
+        self.cache = AsyncSearchCache(self.redis, self.keys,
+                                      self.app_config.search_cache_size)
+
+    async def connection(self):
+        """
+        Get the Redis client, connecting the first time we need it. If
+        connecting fails, the next request tries again.
+        """
+        if self.redis is None:
+            if self.connecting is None:
+                self.connecting = asyncio.ensure_future(self.connect())
+            connecting = self.connecting
+            try:
+                await connecting
+            except Exception:
+                if self.connecting is connecting:
+                    self.connecting = None
+                raise
+        return self.redis
+
+    async def search_cache(self) -> AsyncSearchCache:
+        """Get the search cache, connecting the first time we need it."""
+        await self.connection()
+        if self.cache is None:
+            raise RuntimeError("Connected to Redis without a search cache")
+        return self.cache
+
+    async def close(self):
+        if self.redis is not None:
+            self.redis.close()
+            await self.redis.wait_closed()
+
+    async def generation(self, params: SearchParams) -> Optional[str]:
+        """The generation of the index a search runs against."""
+        cache = await self.search_cache()
+        search_site = self.app_config.sites[params.site_url]
+        return await cache.generation(
+            self.keys.index_alias(search_site.url))
+
+    async def search(self, params: SearchParams,
+                     generation: Optional[str]) -> SearchResponse:
+        """
+        Run a search against the given generation of the site's index,
+        using the cached results if we've run the same search before, or
+        the results of the same search if it's already in flight.
+        """
+        cache = await self.search_cache()
+        search_site = self.app_config.sites[params.site_url]
+        index_alias = self.keys.index_alias(search_site.url)
+
+        if generation:
+            body = await cache.get(index_alias, generation, params)
+            if body is not None:
+                agent.record_custom_metric('search/cache_hits', 1)
+                self.metrics.increment(SEARCH_CACHE_HITS)
+                return SearchResponse(body, generation)
+
+        response, shared = await self.in_flight.do(
+            (index_alias, generation, *params),
+            lambda: self.run_search(params, index_alias, generation))
+        if shared:
+            self.metrics.increment(SEARCH_COALESCED)
+        return response
+
+    async def run_search(self, params: SearchParams, index_alias: str,
+                         generation: Optional[str]) -> SearchResponse:
+        redis_client = await self.connection()
+        q = self.search_resource.build_query(params)
+        # Like SearchResource, search the generation we cache results
+        # under rather than the alias, which may have moved since.
+        index = generation_index(generation) if generation else index_alias
+
+        start = time.perf_counter()
+        try:
+            res = await redis_client.execute(SEARCH_CMD, index, *q.get_args())
+        except (aioredis.ReplyError, UnicodeDecodeError) as e:
+            log.error("Search query failed: %s", e)
+            total = 0
+            docs = []
+            generation = None  # Don't cache a failed search.
+        else:
+            result = search_result(res, q,
+                                   (time.perf_counter() - start) * 1000.0)
+            docs = result.docs
+            total = result.total
+        duration = time.perf_counter() - start
+        agent.record_custom_metric('search/query_ms', duration * 1000.0)
+        self.metrics.observe(SEARCH_STAGE_SECONDS, duration, stage='search')
+
+        body = self.search_resource.render(params, q, docs, total)
+
+        if generation:
+            cache = await self.search_cache()
+            await cache.set(index_alias, generation, params, body)
+
+        return SearchResponse(body, generation)
+
+    async def flush_metrics(self):
+        """Send the metrics we've recorded to Redis, if it's time to."""
+        if not self.metrics.flush_due():
+            return
+        updates = self.metrics.drain()
+        if not updates:
+            return
+        redis_client = await self.connection()
+        key = self.keys.metrics()
+        pipeline = redis_client.pipeline()
+        for command, field, value in updates:
+            getattr(pipeline, command)(key, field, value)
+        try:
+            await pipeline.execute()
+        except aioredis.RedisError as e:
+            log.error("Could not record metrics: %s", e)
+
+    async def log_query(self, params: Dict[str, str]):
+        """Record a sample of searches in the query log, like SearchResource."""
+        entry = self.search_resource.query_log_entry(params)
+        if entry is None:
+            return
+        redis_client = await self.connection()
+        key = self.keys.query_log()
+        pipeline = redis_client.pipeline()
+        pipeline.lpush(key, entry)
+        pipeline.ltrim(key, 0, self.app_config.query_log_size - 1)
+        try:
+            await pipeline.execute()
+        except aioredis.RedisError as e:
+            log.error("Could not record query: %s", e)
+
+    async def metrics_text(self) -> Tuple[int, str]:
+        redis_client = await self.connection()
+        return 200, render(await redis_client.hgetall(self.keys.metrics()))
+
+    async def health(self) -> Tuple[int, str]:
+        """
+        This service is considered unhealthy if we can't reach Redis.
+        The response includes the state of the connection pool.
+        """
+        try:
+            redis_client = await self.connection()
+            await redis_client.ping()
+        except (aioredis.RedisError, OSError) as e:
+            log.error("Health check failed: %s", e)
+            return 503, json.dumps({"redis_pool": None})
+
+        pool = redis_client.connection
+        return 200, json.dumps({
+            "redis_pool": {
+                "max_connections": pool.maxsize,
+                "connections": pool.size,
+                "in_use": pool.size - pool.freesize,
+                "idle": pool.freesize,
+            }
+        })
+
+    def cache_headers(self, params: SearchParams, generation: str) -> Headers:
+        return [(name.lower().encode('latin-1'), value.encode('latin-1'))
+                for name, value in self.search_resource.cache_headers(
+                    params, generation).items()]
+
+    async def respond(self, scope,
+                      request_headers: dict) -> Tuple[int, str, Headers]:
+        """The status, body and any extra headers of the response."""
+        path = scope['path']
+
+        if scope['method'] != 'GET':
+            return 405, json.dumps({"title": "405 Method Not Allowed"}), []
+
+        if path == '/health':
+            return (*await self.health(), [])
+
+        if path == '/metrics':
+            return (*await self.metrics_text(), [])
+
+        if path != '/search':
+            return 404, json.dumps({"title": "404 Not Found"}), []
+
+        query_params = dict(parse_qsl(scope['query_string'].decode('latin-1')))
+        try:
+            with self.metrics.time(SEARCH_STAGE_SECONDS, stage='params'):
+                params = self.search_resource.search_params(query_params)
+        except falcon.HTTPError as e:
+            return int(e.status.split()[0]), json.dumps(e.to_dict()), []
+        await self.log_query(query_params)
+
+        generation = await self.generation(params)
+        if_none_match = request_headers.get(b'if-none-match')
+
+        if generation and if_none_match:
+            tag = etag(generation, params)
+            if any(t in (tag, '*')
+                   for t in parse_etags(if_none_match.decode('latin-1'))):
+                return 304, '', self.cache_headers(params, generation)
+
+        response = await self.search(params, generation)
+        await self.flush_metrics()
+        headers = []
+        if response.generation:
+            headers = self.cache_headers(params, response.generation)
+        return 200, response.body, headers
+
+    def cors_headers(self, request_headers: dict) -> Headers:
+        origin = request_headers.get(b'origin', b'')
+        if origin.decode('latin-1') not in CORS_ORIGINS:
+            return []
+        headers = [(b'access-control-allow-origin', origin), (b'vary', b'Origin')]
+        requested_headers = request_headers.get(b'access-control-request-headers')
+        if requested_headers:
+            headers.append((b'access-control-allow-headers', requested_headers))
+        return headers
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await self.connection()
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await self.close()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+            return
+
+        request_headers = dict(scope['headers'])
+        headers = self.cors_headers(request_headers)
+
+        if scope['method'] == 'OPTIONS':
+            status, body = 200, b''
+        else:
+            status, text, extra_headers = await self.respond(
+                scope, request_headers)
+            body = text.encode('utf-8')
+            # The CORS headers may already vary by origin.
+            headers.extend(header for header in extra_headers
+                           if header not in headers)
+            if status != 304:
+                content_type = (CONTENT_TYPE if scope['path'] == '/metrics'
+                                else 'application/json')
+                headers.append(
+                    (b'content-type', content_type.encode('latin-1')))
+
+        if status != 304:
+            headers.append(
+                (b'content-length', str(len(body)).encode('latin-1')))
+        await send({
+            'type': 'http.response.start',
+            'status': status,
+            'headers': headers
+        })
+        await send({'type': 'http.response.body', 'body': body})
+
+
+def create_asgi_app(config=None):
+    return AsyncSearchApp(config or AppConfiguration())
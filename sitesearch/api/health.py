@@ -1,3 +1,4 @@
+import json
 import logging
 
 from falcon.status_codes import HTTP_503
@@ -5,11 +6,10 @@ from newrelic import agent
 from redis.exceptions import ResponseError
 
 from sitesearch.config import AppConfiguration
-from sitesearch.connections import get_redis_connection
+from sitesearch.connections import get_shared_redis_connection, shared_connections
 from .resource import Resource
 
 config = AppConfiguration()
-redis_client = get_redis_connection()
 log = logging.getLogger(__name__)
 
 
@@ -17,11 +17,15 @@ class HealthCheckResource(Resource):
     def on_get(self, req, resp):
         """
         This service is considered unhealthy if the default search index is unavailable.
+
+        The response includes the state of this process's Redis connection pool.
         """
         agent.ignore_transaction(flag=True)
         try:
-            redis_client.ping()
+            get_shared_redis_connection().ping()
         except ResponseError as e:
             # Connection to Redis is probably down, so this node isn't healthy.
             log.error("Response error: %s", e)
             resp.status = HTTP_503
+
+        resp.body = json.dumps({"redis_pool": shared_connections.stats()})
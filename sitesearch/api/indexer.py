@@ -3,24 +3,29 @@ import logging
 import os
 
 from falcon.errors import HTTPUnauthorized
-from rq.registry import StartedJobRegistry
 
-from sitesearch import tasks
 from sitesearch.connections import get_rq_redis_client
 from sitesearch.cluster_aware_rq import ClusterAwareQueue
+from sitesearch.jobs import (CRAWLER_QUEUE, DISTRIBUTED_INDEX_TASK,
+                             INDEX_TASK, INDEXING_TIMEOUT)
 from sitesearch.api.resource import Resource
 
-redis_client = get_rq_redis_client()
 log = logging.getLogger(__name__)
-queue = ClusterAwareQueue(connection=redis_client)
-registry = StartedJobRegistry('default', connection=redis_client)
 
 API_KEY = os.environ['API_KEY']
-JOB_QUEUED = 'queued'
 
 
 class IndexerResource(Resource):
     """Start indexing jobs."""
+    def __init__(self, app_config):
+        super().__init__(app_config)
+        self.queue = ClusterAwareQueue(connection=get_rq_redis_client())
+        # The crawler service takes `index` jobs from a queue of its own.
+        self.index_queue = self.queue
+        if app_config.crawler_service:
+            self.index_queue = ClusterAwareQueue(
+                CRAWLER_QUEUE, connection=get_rq_redis_client())
+
     def on_post(self, req, resp):
         """Start indexing jobs for all configured sites."""
         token = req.get_header('Authorization')
@@ -33,12 +38,22 @@ class IndexerResource(Resource):
             raise HTTPUnauthorized('Auth token required', description, challenges)
 
         for site in self.app_config.sites.values():
-            job = queue.enqueue(tasks.index,
-                                args=[site],
-                                kwargs={
-                                    "force": True
-                                },
-                                job_timeout=tasks.INDEXING_TIMEOUT)
+            if self.app_config.crawl_shards > 1:
+                # This job starts the crawl, then enqueues a job per shard.
+                job = self.queue.enqueue(DISTRIBUTED_INDEX_TASK,
+                                         args=[site],
+                                         kwargs={
+                                             "force": True,
+                                             "shards":
+                                             self.app_config.crawl_shards
+                                         })
+            else:
+                job = self.index_queue.enqueue(INDEX_TASK,
+                                               args=[site],
+                                               kwargs={
+                                                   "force": True
+                                               },
+                                               job_timeout=INDEXING_TIMEOUT)
             jobs.append(job.id)
 
         resp.body = json.dumps({"jobs": jobs})
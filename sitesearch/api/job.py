@@ -4,24 +4,22 @@ import os
 
 from falcon.errors import HTTPNotFound, HTTPUnauthorized
 from rq.exceptions import NoSuchJobError
-from rq.registry import StartedJobRegistry
-from rq.serializers import JSONSerializer
 
-from sitesearch import tasks
 from sitesearch.connections import get_rq_redis_client
 from sitesearch.cluster_aware_rq import ClusterAwareJob
 from sitesearch.api.resource import Resource
 
-redis_client = get_rq_redis_client()
 log = logging.getLogger(__name__)
-registry = StartedJobRegistry('default', connection=redis_client)
 
 API_KEY = os.environ['API_KEY']
-JOB_QUEUED = 'queued'
 
 
 class JobResource(Resource):
     """Get indexing jobs."""
+    def __init__(self, app_config):
+        super().__init__(app_config)
+        self.redis_client = get_rq_redis_client()
+
     def on_get(self, req, resp, job_id):
         """Get the status of a job by its ID."""
         token = req.get_header('Authorization')
@@ -32,7 +30,7 @@ class JobResource(Resource):
             raise HTTPUnauthorized('Auth token required', description, challenges)
 
         try:
-            job = ClusterAwareJob.fetch(job_id, connection=redis_client)
+            job = ClusterAwareJob.fetch(job_id, connection=self.redis_client)
         except NoSuchJobError as e:
             raise HTTPNotFound from e
 
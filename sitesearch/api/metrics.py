@@ -0,0 +1,19 @@
+from newrelic import agent
+
+from sitesearch.connections import get_shared_redis_connection
+from sitesearch.metrics import CONTENT_TYPE, render
+from .resource import Resource
+
+
+class MetricsResource(Resource):
+    """Metrics in the Prometheus text format.
+
+    Every API worker and indexer records its metrics in Redis, so this
+    reports them for all of them, whichever worker serves the request.
+    Workers send their metrics to Redis about once a second.
+    """
+    def on_get(self, req, resp):
+        agent.ignore_transaction(flag=True)
+        values = get_shared_redis_connection().hgetall(self.keys.metrics())
+        resp.content_type = CONTENT_TYPE
+        resp.body = render(values)
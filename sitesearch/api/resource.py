@@ -1,3 +1,6 @@
+from typing import Optional
+
+import falcon
 
 from sitesearch.keys import Keys
 from sitesearch.config import AppConfiguration
@@ -8,3 +11,19 @@ class Resource:
     def __init__(self, app_config: AppConfiguration):
         self.app_config = app_config
         self.keys = Keys(self.app_config.key_prefix)
+
+    def site_url(self, site_url: Optional[str]) -> str:
+        """
+        The URL of the site a request asked for, or of the default search
+        site if the request didn't ask for one.
+        """
+        # Return an error if a site URL was given but it's invalid.
+        if site_url and site_url not in self.app_config.sites:
+            raise falcon.HTTPBadRequest(
+                "Invalid site", "You must specify a valid search site.")
+
+        # Use the default search site if no site URL was given.
+        if not site_url:
+            site_url = self.app_config.default_search_site.url
+
+        return site_url
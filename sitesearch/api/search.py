@@ -1,22 +1,33 @@
+import hashlib
 import json
 import logging
+import random
 import time
+from typing import Any, Dict, List, Mapping, NamedTuple, Optional
 
 import falcon
 import newrelic
 import redis
+from redisearch import Query, Result
 
 from sitesearch.transformer import transform_documents
-from sitesearch.connections import get_search_connection, get_redis_connection
+from sitesearch.connections import (get_shared_redis_connection,
+                                    get_shared_search_connection,
+                                    read_from_replicas)
 from sitesearch.query_parser import parse
-from sitesearch import indexer
 from sitesearch.api.resource import Resource
+from sitesearch.metrics import (SEARCH_CACHE_HITS, SEARCH_COALESCED,
+                                SEARCH_STAGE_SECONDS, Metrics)
+from sitesearch.search_cache import SearchCache, generation_index
+from sitesearch.sections import get_section
+from sitesearch.single_flight import SingleFlight
 
-redis_client = get_redis_connection()
 log = logging.getLogger(__name__)
 
 DEFAULT_NUM = 30
 MAX_NUM = 100
+# The parameters of a search that we record in the query log.
+QUERY_LOG_PARAMS = ('q', 'from_url', 'site', 'start', 'num')
 
 # Until we can get MINPREFIX set to 1 on Redis Cluster, map
 # single-character queries to two-character queries. Use a
@@ -51,6 +62,44 @@ SINGLE_CHAR_MAP = {
 }
 
 
+def search_result(reply: List[Any], q: Query, duration_ms: float) -> Result:
+    """
+    Parse the reply to an FT.SEARCH command that we sent ourselves, the
+    way redisearch's Client.search() parses it.
+    """
+    return Result(reply,
+                  not q._no_content,
+                  duration=duration_ms,
+                  has_payload=q._with_payloads,
+                  with_scores=q._with_scores)
+
+
+class SearchParams(NamedTuple):
+    site_url: str
+    query: str
+    section: str
+    start: int
+    num: int
+
+
+class SearchResponse(NamedTuple):
+    body: str
+    # The generation of the index the results came from, or None if
+    # they can't be cached, e.g. because the search failed.
+    generation: Optional[str]
+
+
+def etag(generation: str, params: SearchParams) -> str:
+    """
+    The ETag of a search's results.
+
+    Results only change when the site's alias points to a new index, so
+    the name of the index and the search's parameters identify them.
+    """
+    key = json.dumps([generation, *params]).encode('utf-8')
+    return hashlib.sha1(key).hexdigest()
+
+
 class SearchResource(Resource):
     """The Sitesearch Search API.
 
@@ -73,12 +122,24 @@ class SearchResource(Resource):
                   If this isn't specified, the query searches the default site specified in
                   AppConfiguration. E.g. https://example.com/search?q=python&site_url=https://docs.redislabs.com
     """
-    def on_get(self, req, resp):
-        """Run a search."""
-        query = req.get_param('q', default='')
-        from_url = req.get_param('from_url', default='')
-        start = int(req.get_param('start', default=0))
-        site_url = req.get_param('site', default=None)
+    def __init__(self, app_config):
+        super().__init__(app_config)
+        self.cache = SearchCache(get_shared_redis_connection(), self.keys,
+                                 app_config.search_cache_size,
+                                 read=read_from_replicas)
+        self.metrics = Metrics(get_shared_redis_connection(), self.keys)
+        self.in_flight = SingleFlight()
+
+    def search_params(self, params: Mapping[str, str]) -> SearchParams:
+        """
+        Get the parameters of a search from a request's query string
+        parameters, normalized so that equivalent searches have equal
+        parameters.
+        """
+        query = params.get('q', '')
+        from_url = params.get('from_url', '')
+        start = int(params.get('start', 0))
+        site_url = params.get('site', None)
         query_len = len(query)
 
         if query_len == 2 and query[1] == '*':
@@ -86,39 +147,165 @@ class SearchResource(Resource):
             if char in SINGLE_CHAR_MAP:
                 query = f"{SINGLE_CHAR_MAP[query[0]]}*"
 
-        # Return an error if a site URL was given but it's invalid.
-        if site_url and site_url not in self.app_config.sites:
-            raise falcon.HTTPBadRequest(
-                "Invalid site", "You must specify a valid search site.")
-
-        # Use the default search site if no site URL was given.
-        if not site_url:
-            site_url = self.app_config.default_search_site.url
-
-        search_site = self.app_config.sites.get(site_url)
-        section = indexer.get_section(site_url, from_url)
+        site_url = self.site_url(site_url)
+        section = get_section(site_url, from_url)
 
         try:
-            num = min(int(req.get_param('num', default=DEFAULT_NUM)), MAX_NUM)
+            num = min(int(params.get('num', DEFAULT_NUM)), MAX_NUM)
         except ValueError:
             num = DEFAULT_NUM
 
+        return SearchParams(site_url, query, section, start, num)
+
+    def generation(self, params: SearchParams) -> Optional[str]:
+        """The generation of the index a search runs against."""
+        search_site = self.app_config.sites[params.site_url]
+        return self.cache.generation(self.keys.index_alias(search_site.url))
+
+    def search(self, params: SearchParams) -> str:
+        """
+        Run a search and return the JSON response body, from the cache if
+        we've run the same search against the current index.
+        """
+        return self.search_response(params, self.generation(params)).body
+
+    def search_response(self, params: SearchParams,
+                        generation: Optional[str]) -> SearchResponse:
+        """
+        Run a search against the given generation of the site's index.
+
+        If this process is already running the same search against the
+        same generation, we wait for its results instead of running the
+        search again.
+        """
+        search_site = self.app_config.sites[params.site_url]
         index_alias = self.keys.index_alias(search_site.url)
-        search_client = get_search_connection(index_alias)
-        q = parse(query, section, search_site).paging(start, num)
 
-        start = time.time()
+        if generation:
+            body = self.cache.get(index_alias, generation, params)
+            if body is not None:
+                newrelic.agent.record_custom_metric('search/cache_hits', 1)
+                self.metrics.increment(SEARCH_CACHE_HITS)
+                return SearchResponse(body, generation)
+
+        response, shared = self.in_flight.do(
+            (index_alias, generation, *params),
+            lambda: self.run_search(params, index_alias, generation))
+        if shared:
+            self.metrics.increment(SEARCH_COALESCED)
+        return response
+
+    def run_search(self, params: SearchParams, index_alias: str,
+                   generation: Optional[str]) -> SearchResponse:
+        q = self.build_query(params)
+        # Search the generation itself rather than the alias, so that a
+        # replica that hasn't seen the indexer swap the alias yet still
+        # gives us results from the generation we cache them under.
+        index = generation_index(generation) if generation else index_alias
+
+        start = time.perf_counter()
         try:
-            res = search_client.search(q)
+            res = read_from_replicas(lambda server: get_shared_search_connection(
+                index, server).search(q))
         except (redis.exceptions.ResponseError, UnicodeDecodeError) as e:
             log.error("Search query failed: %s", e)
             total = 0
             docs = []
+            generation = None  # Don't cache a failed search.
         else:
             docs = res.docs
             total = res.total
-        end = time.time()
-        newrelic.agent.record_custom_metric('search/query_ms', end - start)
+        duration = time.perf_counter() - start
+        newrelic.agent.record_custom_metric('search/query_ms', duration * 1000.0)
+        self.metrics.observe(SEARCH_STAGE_SECONDS, duration, stage='search')
+
+        body = self.render(params, q, docs, total)
+
+        if generation:
+            self.cache.set(index_alias, generation, params, body)
+
+        return SearchResponse(body, generation)
+
+    def build_query(self, params: SearchParams) -> Query:
+        search_site = self.app_config.sites[params.site_url]
+        with self.metrics.time(SEARCH_STAGE_SECONDS, stage='parse'):
+            return parse(params.query, params.section,
+                         search_site).paging(params.start, params.num)
+
+    def render(self, params: SearchParams, q: Query, docs: List[Any],
+               total: int) -> str:
+        """The JSON response body for the documents a search found."""
+        search_site = self.app_config.sites[params.site_url]
+        with self.metrics.time(SEARCH_STAGE_SECONDS, stage='transform'):
+            docs = transform_documents(docs, search_site, q.query_string())
+        with self.metrics.time(SEARCH_STAGE_SECONDS, stage='encode'):
+            return json.dumps({"total": total, "results": docs})
+
+    def query_log_entry(self, params: Mapping[str, str]) -> Optional[str]:
+        """
+        The query log entry for a search, as the client sent it, or None
+        if this search isn't in the sample we log.
+        """
+        if random.random() >= self.app_config.query_log_sample_rate:
+            return None
+        return json.dumps(
+            {name: params[name] for name in QUERY_LOG_PARAMS if name in params})
+
+    def log_query(self, params: Mapping[str, str]):
+        """
+        Record a sample of searches, as the client sent them, so that load
+        tests can replay real traffic.
+        """
+        entry = self.query_log_entry(params)
+        if entry is None:
+            return
+        key = self.keys.query_log()
+        pipeline = get_shared_redis_connection().pipeline(transaction=False)
+        pipeline.lpush(key, entry)
+        pipeline.ltrim(key, 0, self.app_config.query_log_size - 1)
+        try:
+            pipeline.execute()
+        except redis.exceptions.RedisError as e:
+            log.error("Could not record query: %s", e)
+
+    def cache_headers(self, params: SearchParams,
+                      generation: str) -> Dict[str, str]:
+        """The headers that let clients and CDNs cache a search's results."""
+        headers = {
+            'ETag': f'"{etag(generation, params)}"',
+            # We only allow some origins, so caches must not give one
+            # origin the CORS headers we sent another.
+            'Vary': 'Origin',
+        }
+        cache_control = self.app_config.sites[params.site_url].cache_control
+        if cache_control:
+            headers['Cache-Control'] = cache_control
+        return headers
+
+    def on_get(self, req, resp):
+        """
+        Run a search.
+
+        Responses have an ETag, and if the client already has the results
+        for the current index, we answer 304 Not Modified without
+        searching.
+        """
+        query_params = {name: req.get_param(name) for name in req.params}
+        with self.metrics.time(SEARCH_STAGE_SECONDS, stage='params'):
+            params = self.search_params(query_params)
+        self.log_query(query_params)
+        generation = self.generation(params)
+
+        if generation and req.if_none_match:
+            # Compare ETags weakly, as RFC 7232 requires for If-None-Match:
+            # Falcon gives us them without quotes or "W/".
+            tag = etag(generation, params)
+            if any(t in (tag, '*') for t in req.if_none_match):
+                resp.set_headers(self.cache_headers(params, generation))
+                resp.status = falcon.HTTP_NOT_MODIFIED
+                return
 
-        docs = transform_documents(docs, search_site, q.query_string())
-        resp.body = json.dumps({"total": total, "results": docs})
+        response = self.search_response(params, generation)
+        if response.generation:
+            resp.set_headers(self.cache_headers(params, response.generation))
+        resp.body = response.body
@@ -0,0 +1,166 @@
+import json
+import logging
+import time
+from typing import Any, Dict, List, Optional
+
+import falcon
+import newrelic
+import redis
+
+from sitesearch.api.search import SearchParams, SearchResource, search_result
+from sitesearch.connections import (get_shared_redis_connection,
+                                    read_from_replicas)
+from sitesearch.metrics import SEARCH_CACHE_HITS, SEARCH_STAGE_SECONDS
+from sitesearch.search_cache import generation_index
+
+log = logging.getLogger(__name__)
+
+MAX_BATCH_SIZE = 10
+SEARCH_CMD = 'FT.SEARCH'
+
+
+class SearchBatchResource(SearchResource):
+    """Run several searches in one request.
+
+    POST a JSON object with a list of searches, each with the same
+    parameters as a GET to /search:
+
+        {"queries": [{"q": "redis"}, {"q": "re*", "from_url": "https://docs.redislabs.com/latest/rs/"}]}
+
+    The response has a result for each search, in the same order, that
+    is either what /search would return for it or an error:
+
+        {"results": [{"total": 10, "results": [...]}, {"error": {"title": "Invalid site", ...}}]}
+
+    We send all the searches to RediSearch in one pipeline.
+    """
+    def parse_queries(self, req) -> List[Any]:
+        media = req.media
+        queries = media.get('queries') if isinstance(media, dict) else None
+        if not isinstance(queries, list):
+            raise falcon.HTTPBadRequest(
+                "Invalid batch", "The request body must have a list of queries.")
+        if len(queries) > MAX_BATCH_SIZE:
+            raise falcon.HTTPBadRequest(
+                "Invalid batch",
+                f"A batch may have at most {MAX_BATCH_SIZE} queries.")
+        return queries
+
+    def batch_params(self, spec: Any) -> SearchParams:
+        if not isinstance(spec, dict):
+            raise falcon.HTTPBadRequest("Invalid query",
+                                        "Each query must be an object.")
+        for name, value in spec.items():
+            # A GET to /search only has strings, and numbers are safe to
+            # turn into them. Anything else would become query text like
+            # "None" or "True".
+            if isinstance(value, bool) or not isinstance(
+                    value, (str, int, float)):
+                raise falcon.HTTPBadRequest(
+                    "Invalid query",
+                    f"The value of '{name}' must be a string or a number.")
+        try:
+            return self.search_params(
+                {name: str(value) for name, value in spec.items()})
+        except ValueError as e:
+            raise falcon.HTTPBadRequest("Invalid query", str(e)) from e
+
+    def search_batch(self, all_params: List[SearchParams]) -> List[str]:
+        """
+        Run several searches and return their JSON response bodies, using
+        cached results where we can.
+        """
+        aliases = [
+            self.keys.index_alias(self.app_config.sites[p.site_url].url)
+            for p in all_params
+        ]
+        index_aliases = sorted(set(aliases))
+        generations = dict(
+            zip(index_aliases, self.cache.generations(index_aliases)))
+
+        # The response body of each search we've run, by its position.
+        bodies: Dict[int, str] = {}
+        cacheable = [i for i, alias in enumerate(aliases) if generations[alias]]
+        cached = self.cache.get_many([(aliases[i], generations[aliases[i]],
+                                       all_params[i]) for i in cacheable])
+        for i, body in zip(cacheable, cached):
+            if body is not None:
+                bodies[i] = body
+
+        misses = [i for i in range(len(all_params)) if i not in bodies]
+        if len(misses) < len(all_params):
+            newrelic.agent.record_custom_metric(
+                'search/cache_hits', len(all_params) - len(misses))
+            self.metrics.increment(SEARCH_CACHE_HITS,
+                                   len(all_params) - len(misses))
+        if not misses:
+            return [bodies[i] for i in range(len(all_params))]
+
+        queries = {i: self.build_query(all_params[i]) for i in misses}
+
+        def run(server):
+            pipeline = get_shared_redis_connection(server).pipeline(
+                transaction=False)
+            for i in misses:
+                # Like /search, search the generation rather than the alias.
+                generation = generations[aliases[i]]
+                index = generation_index(generation) if generation else aliases[i]
+                pipeline.execute_command(SEARCH_CMD, index,
+                                         *queries[i].get_args())
+            return pipeline.execute(raise_on_error=False)
+
+        start = time.perf_counter()
+        try:
+            replies = read_from_replicas(run)
+        except UnicodeDecodeError as e:
+            # We can't tell which search this came from, so run them
+            # one at a time.
+            log.error("Batch search failed: %s", e)
+            for i in misses:
+                bodies[i] = self.search(all_params[i])
+            return [bodies[i] for i in range(len(all_params))]
+        duration = time.perf_counter() - start
+        duration_ms = duration * 1000.0
+        newrelic.agent.record_custom_metric('search/batch_query_ms', duration_ms)
+        self.metrics.observe(SEARCH_STAGE_SECONDS, duration, stage='batch_search')
+
+        to_cache = []
+        for i, reply in zip(misses, replies):
+            q = queries[i]
+            if isinstance(reply, redis.exceptions.ResponseError):
+                log.error("Search query failed: %s", reply)
+                bodies[i] = self.render(all_params[i], q, [], 0)
+                continue
+            result = search_result(reply, q, duration_ms)
+            bodies[i] = self.render(all_params[i], q, result.docs, result.total)
+            generation = generations[aliases[i]]
+            if generation:
+                to_cache.append(
+                    (aliases[i], generation, all_params[i], bodies[i]))
+
+        self.cache.set_many(to_cache)
+        return [bodies[i] for i in range(len(all_params))]
+
+    def on_get(self, req, resp):
+        """Only POST runs a batch. Don't answer GETs as /search would."""
+        raise falcon.HTTPMethodNotAllowed(['POST'])
+
+    def on_post(self, req, resp):
+        """Run a batch of searches."""
+        queries = self.parse_queries(req)
+        results: List[Optional[str]] = [None] * len(queries)
+        valid: Dict[int, SearchParams] = {}
+
+        with self.metrics.time(SEARCH_STAGE_SECONDS, stage='params'):
+            for i, spec in enumerate(queries):
+                try:
+                    valid[i] = self.batch_params(spec)
+                except falcon.HTTPError as e:
+                    results[i] = json.dumps({"error": e.to_dict()})
+
+        for i, body in zip(valid, self.search_batch(list(valid.values()))):
+            results[i] = body
+
+        # The results are already JSON, so we join them rather than
+        # decoding and encoding them again.
+        resp.body = '{"results": [' + ', '.join(results) + ']}'
@@ -0,0 +1,83 @@
+import json
+import logging
+
+import redis
+from redisearch import AutoCompleter
+
+from sitesearch.api.resource import Resource
+from sitesearch.connections import (get_shared_redis_connection,
+                                    read_from_replicas)
+from sitesearch.search_cache import generation_index
+
+log = logging.getLogger(__name__)
+
+DEFAULT_NUM = 10
+MAX_NUM = 20
+
+
+class SuggestResource(Resource):
+    """Autocomplete suggestions for a search.
+
+    The indexer builds a dictionary of page titles, section titles and
+    synonyms for each index, and this API completes a prefix from the
+    dictionary for the index the site's alias currently points to.
+
+    GET params:
+
+        q: The prefix to complete. E.g. https://example.com/suggest?q=pers
+
+        num: The most suggestions to return. Defaults to 10.
+
+        site: The site to get suggestions for. Defaults to the default
+              search site specified in AppConfiguration.
+
+    Each suggestion includes the URL of the page it came from:
+
+        {"suggestions": [{"text": "Persistence", "url": "https://..."}]}
+    """
+    def on_get(self, req, resp):
+        """Get suggestions."""
+        prefix = req.get_param('q', default='').strip()
+        site_url = self.site_url(req.get_param('site', default=None))
+
+        try:
+            num = min(int(req.get_param('num', default=DEFAULT_NUM)), MAX_NUM)
+        except ValueError:
+            num = DEFAULT_NUM
+
+        suggestions = []
+        if prefix:
+            suggestions = self.suggest(site_url, prefix, num)
+
+        resp.body = json.dumps({"suggestions": suggestions})
+
+    def suggest(self, site_url: str, prefix: str, num: int):
+        search_site = self.app_config.sites[site_url]
+        index_alias = self.keys.index_alias(search_site.url)
+        return read_from_replicas(
+            lambda server: self.read_suggestions(
+                get_shared_redis_connection(server), index_alias, prefix, num))
+
+    def read_suggestions(self, redis_client, index_alias: str, prefix: str,
+                         num: int):
+        # Read the generation and its dictionary from the same server, so
+        # a lagging replica can't give us a dictionary it doesn't have.
+        generation = redis_client.get(self.keys.index_generation(index_alias))
+        if not generation:
+            return []
+
+        completer = AutoCompleter(self.keys.suggestions(
+            index_alias, generation_index(generation)),
+                                  conn=redis_client)
+        try:
+            suggestions = completer.get_suggestions(prefix,
+                                                    num=num,
+                                                    with_payloads=True)
+        except redis.exceptions.ResponseError as e:
+            log.error("Suggestion query failed: %s", e)
+            return []
+
+        return [{
+            "text": suggestion.string,
+            "url": suggestion.payload
+        } for suggestion in suggestions]
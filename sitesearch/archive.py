@@ -0,0 +1,47 @@
+import base64
+import gzip
+import json
+from typing import IO, Iterator, Optional
+
+from scrapy.http import HtmlResponse, Request
+
+
+class CrawlArchive:
+    """
+    CrawlArchive records the pages a crawl fetched to a gzipped file of
+    JSON lines -- one line per page, with its URL, status, headers and
+    body -- so that we can rebuild a site's index from the file later
+    without crawling the site again.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self.file: Optional[IO[str]] = None
+
+    def open(self):
+        self.file = gzip.open(self.path, 'wt', encoding='utf-8')
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def record(self, response: HtmlResponse):
+        if self.file is None:
+            raise ValueError(f"Open the crawl archive {self.path} to record to it")
+        self.file.write(
+            json.dumps({
+                'url': response.url,
+                'status': response.status,
+                'headers': dict(response.headers.to_unicode_dict()),
+                'body': base64.b64encode(response.body).decode('ascii')
+            }) + '\n')
+
+    def __iter__(self) -> Iterator[HtmlResponse]:
+        with gzip.open(self.path, 'rt', encoding='utf-8') as f:
+            for line in f:
+                page = json.loads(line)
+                yield HtmlResponse(page['url'],
+                                   status=page['status'],
+                                   headers=page['headers'],
+                                   body=base64.b64decode(page['body']),
+                                   request=Request(page['url']))
@@ -0,0 +1,164 @@
+import time
+from threading import Lock
+from typing import Dict, NamedTuple, Optional, Set
+
+from redis import Redis
+
+from sitesearch.keys import Keys
+
+# How often a crawl saves its progress. A crawl that stops without
+# finishing loses at most this much work.
+CHECKPOINT_INTERVAL = 30
+# If a crawl hasn't saved its progress for this long, we assume it
+# stopped, even if its indexing lock hasn't expired yet. A live crawl
+# saves from the reactor for as long as it runs, but a save can wait
+# behind downloads (Scrapy gives up on one after 180 seconds) and behind
+# the reactor's threads, so we leave plenty of room.
+ABANDONED_SECONDS = 60 * 15
+
+
+class Checkpoint(NamedTuple):
+    """The crawl a checkpoint belongs to."""
+    index_name: str
+    generation: str
+    in_place: bool
+    crawl_started: float
+    saved_at: float
+
+
+class CrawlCheckpoint:
+    """
+    CrawlCheckpoint saves the progress of a site's crawl to Redis as it
+    goes: every URL the crawler has requested, with the name of the
+    spider callback for it, the pages it has parsed and the titles of the
+    pages it has seen.
+
+    The indexer already records every URL whose documents it wrote, so
+    with these, a later run can resume a crawl that didn't finish -- e.g.
+    because its job timed out or its worker restarted. It skips the pages
+    the crawl both parsed and wrote the documents of, and requests the
+    rest of the URLs the crawl requested or indexed.
+
+    We save a parsed page together with the links we requested from it,
+    so a resumed crawl never skips a page whose links it doesn't know.
+
+    We buffer what the crawl does in memory, and the indexer saves it
+    every `interval` seconds, in one round trip, for as long as the crawl
+    runs -- including while it finishes. A crawl whose checkpoint hasn't
+    been saved for ABANDONED_SECONDS has stopped.
+    """
+    def __init__(self, redis_client: Redis, keys: Keys, index_alias: str,
+                 interval: float = CHECKPOINT_INTERVAL):
+        self.redis = redis_client
+        self.keys = keys
+        self.key = keys.crawl_checkpoint(index_alias)
+        self.interval = interval
+        self.lock = Lock()
+        # Held while we save or clear the checkpoint, so that we don't
+        # save a checkpoint back after we clear it.
+        self.saving = Lock()
+        self.index_name: Optional[str] = None
+        self.requests: Dict[str, str] = {}
+        self.parsed_urls: Set[str] = set()
+        self.titles: Dict[str, str] = {}
+
+    def load(self) -> Optional[Checkpoint]:
+        """The checkpoint of the site's last unfinished crawl, if any."""
+        data = self.redis.hgetall(self.key)
+        if 'index_name' not in data:
+            return None
+        return Checkpoint(index_name=data['index_name'],
+                          generation=data['generation'],
+                          in_place=data['in_place'] == '1',
+                          crawl_started=float(data['crawl_started']),
+                          saved_at=float(data['saved_at']))
+
+    def start(self, index_name: str, generation: str, in_place: bool,
+              crawl_started: float):
+        """Start saving the progress of a crawl that builds `index_name`."""
+        self.index_name = index_name
+        self.redis.hset(self.key,
+                        mapping={
+                            'index_name': index_name,
+                            'generation': generation,
+                            'in_place': int(in_place),
+                            'crawl_started': crawl_started,
+                            'saved_at': time.time()
+                        })
+
+    def join(self, index_name: str):
+        """
+        Save progress to the checkpoint of a crawl that another process
+        started, as one shard of a distributed crawl.
+        """
+        self.index_name = index_name
+
+    def requested(self, url: str, callback: str):
+        with self.lock:
+            self.requests[url] = callback
+
+    def parsed(self, url: str, requests: Dict[str, str]):
+        """
+        Record that we parsed the page at `url` and requested `requests`,
+        the links we followed from it, with the names of their callbacks.
+        """
+        with self.lock:
+            self.requests.update(requests)
+            self.parsed_urls.add(url)
+
+    def saw_title(self, url: str, title: str):
+        with self.lock:
+            self.titles[url] = title
+
+    def save(self):
+        """
+        Save what the crawl did since we last saved, and that it's still
+        running. Does nothing once the crawl is over.
+        """
+        with self.saving:
+            index_name = self.index_name
+            if index_name is None:
+                return
+            with self.lock:
+                requests, self.requests = self.requests, {}
+                parsed_urls, self.parsed_urls = self.parsed_urls, set()
+                titles, self.titles = self.titles, {}
+
+            # Save the pages we parsed and the links we requested from
+            # them all or not at all.
+            with self.redis.pipeline() as p:
+                if requests:
+                    p.hset(self.keys.crawl_requests(index_name),
+                           mapping=requests)
+                if parsed_urls:
+                    p.sadd(self.keys.crawl_parsed(index_name), *parsed_urls)
+                if titles:
+                    p.hset(self.keys.crawl_titles(index_name), mapping=titles)
+                p.execute()
+            self.redis.hset(self.key, 'saved_at', time.time())
+
+    def saved_requests(self, index_name: str) -> Dict[str, str]:
+        """Every URL a crawl requested, and the name of its callback."""
+        return self.redis.hgetall(self.keys.crawl_requests(index_name))
+
+    def saved_parsed(self, index_name: str) -> Set[str]:
+        """Every page a crawl parsed, whose links it saved."""
+        return self.redis.smembers(self.keys.crawl_parsed(index_name))
+
+    def saved_titles(self, index_name: str) -> Dict[str, str]:
+        return self.redis.hgetall(self.keys.crawl_titles(index_name))
+
+    def clear(self, index_name: str):
+        """Forget a crawl, because it finished or we can't resume it."""
+        with self.saving:
+            self.index_name = None
+            with self.redis.pipeline(transaction=False) as p:
+                p.delete(self.keys.crawl_requests(index_name),
+                         self.keys.crawl_parsed(index_name),
+                         self.keys.crawl_titles(index_name))
+                # A forced run may have started a crawl of another index
+                # since.
+                p.hget(self.key, 'index_name')
+                _, current = p.execute()
+            if current == index_name:
+                self.redis.delete(self.key)
@@ -0,0 +1,18 @@
+import logging
+
+import click
+
+from sitesearch.config import AppConfiguration
+from sitesearch.crawler_service import MAX_CRAWLS, CrawlerService
+
+
+config = AppConfiguration()
+log = logging.getLogger(__name__)
+
+
+@click.option('--crawls', default=MAX_CRAWLS,
+              help="The most sites to crawl at once.")
+@click.command()
+def crawler(crawls: int):
+    """Crawl and index sites for the jobs on the crawler queue."""
+    CrawlerService(config, max_crawls=crawls).run()
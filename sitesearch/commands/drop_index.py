@@ -17,19 +17,19 @@ log = logging.getLogger(__name__)
 @click.command()
 def drop_index(site: str):
     """Index the app's configured sites in RediSearch."""
-    site = config.sites.get(site)
+    search_site = config.sites.get(site)
 
-    if site is None:
+    if search_site is None:
         valid_sites = ", ".join(config.sites.keys())
         raise click.BadArgumentUsage(
             f"The site you gave does not exist. Valid sites: {valid_sites}")
 
-    redis_client = get_search_connection(site.index_alias)
+    redis_client = get_search_connection(search_site.index_alias)
 
     try:
-        redis_client.execute_command('FT.DROPINDEX', site.index_alias)
+        redis_client.execute_command('FT.DROPINDEX', search_site.index_alias)
     except ResponseError:
-        log.info("Search index does not exist: %s", site.index_alias)
+        log.info("Search index does not exist: %s", search_site.index_alias)
 
-    indexer = Indexer(site, config)
+    indexer = Indexer(search_site, config)
     redis_client.redis.srem(indexer.index_name)
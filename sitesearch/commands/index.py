@@ -10,15 +10,23 @@ config = AppConfiguration()
 log = logging.getLogger(__name__)
 
 
+@click.option('--record', 'archive_path', default=None,
+              help="Record the pages we crawl to this archive file.")
+@click.option('--shards', default=1,
+              help="Share the crawl between this many RQ workers.")
 @click.argument('site')
 @click.command()
-def index(site: str):
+def index(site: str, archive_path: str, shards: int):
     """Index the app's configured sites in RediSearch."""
-    site = config.sites.get(site)
+    search_site = config.sites.get(site)
 
-    if site is None:
+    if search_site is None:
         valid_sites = ", ".join(config.sites.keys())
         raise click.BadArgumentUsage(
             f"The site you gave does not exist. Valid sites: {valid_sites}")
 
-    tasks.index(site, force=True)
+    if shards > 1:
+        tasks.index_distributed(search_site, force=True, shards=shards)
+        return
+
+    tasks.index(search_site, force=True, archive_path=archive_path)
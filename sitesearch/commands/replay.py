@@ -0,0 +1,26 @@
+import logging
+
+import click
+
+from sitesearch.archive import CrawlArchive
+from sitesearch.config import AppConfiguration
+from sitesearch.indexer import Indexer
+
+
+config = AppConfiguration()
+log = logging.getLogger(__name__)
+
+
+@click.argument('archive_path')
+@click.argument('site')
+@click.command()
+def replay(site: str, archive_path: str):
+    """Index a site from a crawl archive recorded by `index --record`."""
+    search_site = config.sites.get(site)
+
+    if search_site is None:
+        valid_sites = ", ".join(config.sites.keys())
+        raise click.BadArgumentUsage(
+            f"The site you gave does not exist. Valid sites: {valid_sites}")
+
+    Indexer(search_site, config).replay(CrawlArchive(archive_path))
@@ -1,5 +1,5 @@
 import os
-from typing import Dict, Optional
+from typing import Dict
 
 from dotenv import load_dotenv
 
@@ -13,6 +13,20 @@ DEFAULT_PREFIX = "sitesearch:test"
 KEY_PREFIX = os.environ.get('KEY_PREFIX', DEFAULT_PREFIX)
 ENV = os.environ.get('ENV')
 IS_DEV = ENV in ('development', 'test')
+INCREMENTAL_CRAWL = os.environ.get('INCREMENTAL_CRAWL') == 'true'
+# Update the live index in place, rather than building a new one.
+IN_PLACE_INDEXING = os.environ.get('IN_PLACE_INDEXING') == 'true'
+PARSE_IN_PROCESS_POOL = os.environ.get('PARSE_IN_PROCESS_POOL') == 'true'
+# How many worker processes share the crawl of each site.
+CRAWL_SHARDS = int(os.environ.get('CRAWL_SHARDS', 1))
+# Send indexing jobs to the crawler service rather than to RQ workers.
+CRAWLER_SERVICE = os.environ.get('CRAWLER_SERVICE') == 'true'
+# How many search results each API process caches in memory.
+SEARCH_CACHE_SIZE = int(os.environ.get('SEARCH_CACHE_SIZE', 1000))
+# The fraction of searches we record in the query log, for load tests
+# to replay, and the most searches the log keeps.
+QUERY_LOG_SAMPLE_RATE = float(os.environ.get('QUERY_LOG_SAMPLE_RATE', 0))
+QUERY_LOG_SIZE = int(os.environ.get('QUERY_LOG_SIZE', 10000))
 
 # The front-end is currently querying with this URL. Temporarily allow it
 # as an alternate for the configured URL.
@@ -44,13 +58,29 @@ class AppConfiguration:
                  is_dev: bool = IS_DEV,
                  key_prefix: str = KEY_PREFIX,
                  env: str = ENV,
-                 sites: Optional[Dict[str, SiteConfiguration]] = DEV_SITES):
+                 sites: Dict[str, SiteConfiguration] = DEV_SITES,
+                 incremental_crawl: bool = INCREMENTAL_CRAWL,
+                 in_place_indexing: bool = IN_PLACE_INDEXING,
+                 parse_in_process_pool: bool = PARSE_IN_PROCESS_POOL,
+                 crawl_shards: int = CRAWL_SHARDS,
+                 crawler_service: bool = CRAWLER_SERVICE,
+                 search_cache_size: int = SEARCH_CACHE_SIZE,
+                 query_log_sample_rate: float = QUERY_LOG_SAMPLE_RATE,
+                 query_log_size: int = QUERY_LOG_SIZE):
 
         self.default_search_site = default_search_site
         self.is_dev = is_dev
         self.key_prefix = key_prefix
         self.sites = sites
         self.env = env
+        self.incremental_crawl = incremental_crawl
+        self.in_place_indexing = in_place_indexing
+        self.parse_in_process_pool = parse_in_process_pool
+        self.crawl_shards = crawl_shards
+        self.crawler_service = crawler_service
+        self.search_cache_size = search_cache_size
+        self.query_log_sample_rate = query_log_sample_rate
+        self.query_log_size = query_log_size
 
         if not IS_DEV:
             self.sites = PROD_SITES
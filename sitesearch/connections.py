@@ -1,8 +1,15 @@
+import itertools
 import os
 import logging
+import time
+from collections import OrderedDict
+from threading import Lock
+from typing import (Any, Callable, Dict, List, Optional, Sequence, Set,
+                    Tuple, TypeVar)
 
 from dotenv import load_dotenv
-from redis import Redis
+from redis import BlockingConnectionPool, Connection, Redis
+from redis.exceptions import ConnectionError, TimeoutError
 from redisearch import Client
 
 load_dotenv()
@@ -11,6 +18,23 @@ REDIS_PASSWORD = os.environ.get('REDIS_PASSWORD')
 REDIS_HOST = os.environ.get('REDIS_HOST')
 REDIS_PORT = os.environ.get('REDIS_PORT', 6379)
 RETRY_COUNT = 3
+# The most connections each process opens to Redis for searches, and
+# how long a search waits for one when they are all in use.
+REDIS_MAX_CONNECTIONS = int(os.environ.get('REDIS_MAX_CONNECTIONS', 50))
+REDIS_POOL_TIMEOUT = int(os.environ.get('REDIS_POOL_TIMEOUT', 5))
+# Ping connections that have been idle this many seconds before we use
+# them, so we notice connections that a failover left dead.
+HEALTH_CHECK_INTERVAL = 30
+# Read replicas for searches, as comma-separated host:port pairs, e.g.
+# "replica-1:6379,replica-2:6379". They use REDIS_PASSWORD.
+REDIS_READ_REPLICAS = os.environ.get('REDIS_READ_REPLICAS', '')
+# How long we stop reading from a replica after a read from it fails.
+REPLICA_RETRY_SECONDS = 30
+# How many RediSearch clients we keep for each server. Every generation
+# of an index gets its own client, so we drop the least recently used.
+MAX_SEARCH_CLIENTS = 32
+
+T = TypeVar('T')
 
 log = logging.getLogger(__name__)
 
@@ -37,3 +61,213 @@ def get_search_connection(index: str,
 def get_rq_redis_client():
     """The rq library expects to read raw strings."""
     return get_redis_connection(decode_responses=False)
+
+
+def parse_hosts(hosts: str) -> List[Tuple[str, int]]:
+    """Parse comma-separated host:port pairs. The port defaults to REDIS_PORT."""
+    parsed = []
+    for host in filter(None, (h.strip() for h in hosts.split(','))):
+        name, _, port = host.partition(':')
+        parsed.append((name, int(port or REDIS_PORT)))
+    return parsed
+
+
+class CountingConnectionPool(BlockingConnectionPool):
+    """A BlockingConnectionPool that counts its connections, for stats()."""
+    def reset(self):
+        super().reset()
+        self.counts_lock = Lock()
+        self.created = 0
+        self.in_use: Set[Connection] = set()
+
+    def make_connection(self):
+        connection = super().make_connection()
+        with self.counts_lock:
+            self.created += 1
+        return connection
+
+    def get_connection(self, command_name, *keys, **options):
+        connection = super().get_connection(command_name, *keys, **options)
+        with self.counts_lock:
+            self.in_use.add(connection)
+        return connection
+
+    def release(self, connection):
+        # get_connection() releases a connection that fails to connect
+        # before we count it, so we discard rather than subtract.
+        with self.counts_lock:
+            self.in_use.discard(connection)
+        super().release(connection)
+
+
+class RedisServer:
+    """A bounded connection pool to one Redis server, and the clients that use it."""
+    def __init__(self, host: Optional[str], port):
+        self.host = host
+        self.port = port
+        self.pool = CountingConnectionPool(
+            max_connections=REDIS_MAX_CONNECTIONS,
+            timeout=REDIS_POOL_TIMEOUT,
+            password=REDIS_PASSWORD,
+            host=host,
+            port=port,
+            decode_responses=True,
+            retry_on_timeout=True,
+            socket_keepalive=True,
+            health_check_interval=HEALTH_CHECK_INTERVAL)
+        self.redis = Redis(connection_pool=self.pool)
+        self.search_clients: OrderedDict = OrderedDict()
+        self.lock = Lock()
+        # Until when we send reads elsewhere, after a read here failed.
+        self.down_until = 0.0
+
+    def get_search_connection(self, index: str) -> Client:
+        with self.lock:
+            client = self.search_clients.get(index)
+            if client is None:
+                client = self.search_clients[index] = Client(index,
+                                                             conn=self.redis)
+                while len(self.search_clients) > MAX_SEARCH_CLIENTS:
+                    self.search_clients.popitem(last=False)
+            else:
+                self.search_clients.move_to_end(index)
+            return client
+
+    def stats(self) -> Dict[str, int]:
+        """How many connections the pool has open, and how many are in use."""
+        pool = self.pool
+        with pool.counts_lock:
+            connections, in_use = pool.created, len(pool.in_use)
+        return {
+            "max_connections": pool.max_connections,
+            "connections": connections,
+            "in_use": in_use,
+            "idle": connections - in_use,
+            "search_clients": len(self.search_clients),
+        }
+
+
+class SharedConnections:
+    """
+    One bounded connection pool per process to the primary, and one to
+    each read replica, and the Redis and RediSearch clients that use them.
+
+    gunicorn may fork worker processes after we create the pools, and a
+    socket shared between processes would interleave their commands, so
+    we start over with new pools whenever we find ourselves in a new
+    process.
+
+    After a failover, commands on the old connections fail with a
+    connection error. redis-py disconnects a connection when that happens
+    and connects again -- resolving the host again -- the next time the
+    pool hands the connection out.
+
+    Searches can read from replicas with read(), which takes turns among
+    the replicas and falls back to the primary when none are healthy.
+    Everything else -- and everything that writes -- uses the primary.
+    """
+    def __init__(self, replicas: Optional[Sequence[Tuple[str, int]]] = None):
+        self.lock = Lock()
+        self.pid: Optional[int] = None
+        self.replica_hosts = (parse_hosts(REDIS_READ_REPLICAS)
+                              if replicas is None else list(replicas))
+        self.primary: Optional[RedisServer] = None
+        self.replicas: List[RedisServer] = []
+        self.turns = itertools.count()
+
+    def _check_pid(self) -> RedisServer:
+        """Start over with new pools in a new process. Returns the primary."""
+        primary = self.primary
+        if primary is not None and self.pid == os.getpid():
+            return primary
+        with self.lock:
+            primary = self.primary
+            if primary is None or self.pid != os.getpid():
+                primary = self.primary = RedisServer(REDIS_HOST, REDIS_PORT)
+                self.replicas = [
+                    RedisServer(host, port) for host, port in self.replica_hosts
+                ]
+                self.pid = os.getpid()
+            return primary
+
+    @property
+    def pool(self) -> CountingConnectionPool:
+        return self._check_pid().pool
+
+    def get_redis_connection(self,
+                             server: Optional[RedisServer] = None) -> Redis:
+        primary = self._check_pid()
+        return (server or primary).redis
+
+    def get_search_connection(self, index: str,
+                              server: Optional[RedisServer] = None) -> Client:
+        primary = self._check_pid()
+        return (server or primary).get_search_connection(index)
+
+    def read_server(self) -> RedisServer:
+        """The next healthy replica, or the primary if there isn't one."""
+        primary = self._check_pid()
+        now = time.monotonic()
+        healthy = [r for r in self.replicas if r.down_until <= now]
+        if not healthy:
+            return primary
+        return healthy[next(self.turns) % len(healthy)]
+
+    def read(self, fn: Callable[[RedisServer], T]) -> T:
+        """
+        Call `fn` with a server to read from. If a replica can't answer,
+        we stop sending it reads for REPLICA_RETRY_SECONDS and call `fn`
+        again with the primary.
+
+        Replicas can lag behind the primary, so only read data that is
+        consistent on its own, like search results for one generation of
+        an index.
+        """
+        primary = self._check_pid()
+        server = self.read_server()
+        if server is primary:
+            return fn(server)
+        try:
+            return fn(server)
+        except (ConnectionError, TimeoutError) as e:
+            log.error("Read from replica %s:%s failed, using the primary: %s",
+                      server.host, server.port, e)
+            server.down_until = time.monotonic() + REPLICA_RETRY_SECONDS
+            return fn(primary)
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        How many connections the primary's pool has open and how many
+        are in use, and the same for each replica.
+        """
+        stats: Dict[str, Any] = self._check_pid().stats()
+        if self.replicas:
+            now = time.monotonic()
+            stats["replicas"] = [{
+                "host": f"{r.host}:{r.port}",
+                "healthy": r.down_until <= now,
+                **r.stats()
+            } for r in self.replicas]
+        return stats
+
+
+shared_connections = SharedConnections()
+
+
+def get_shared_redis_connection(server: Optional[RedisServer] = None) -> Redis:
+    """
+    A Redis client that uses this process's shared connection pool to the
+    primary, or to `server`.
+    """
+    return shared_connections.get_redis_connection(server)
+
+
+def get_shared_search_connection(index: str,
+                                 server: Optional[RedisServer] = None) -> Client:
+    """A RediSearch client for an index that uses the shared connection pool."""
+    return shared_connections.get_search_connection(index, server)
+
+
+def read_from_replicas(fn: Callable[[RedisServer], T]) -> T:
+    """Read with the shared connections, from a replica if we have any."""
+    return shared_connections.read(fn)
@@ -0,0 +1,226 @@
+import datetime
+import logging
+from typing import Optional
+
+from rq.defaults import DEFAULT_FAILURE_TTL, DEFAULT_RESULT_TTL
+from rq.exceptions import DequeueTimeout
+from rq.job import JobStatus
+from rq.registry import (FailedJobRegistry, FinishedJobRegistry,
+                         StartedJobRegistry)
+from scrapy.core.downloader.handlers.http11 import HTTP11DownloadHandler
+from scrapy.crawler import CrawlerRunner
+from twisted.internet import defer, reactor, task, threads
+
+from sitesearch.cluster_aware_rq import ClusterAwareJob, ClusterAwareQueue
+from sitesearch.config import AppConfiguration
+from sitesearch.connections import get_rq_redis_client
+from sitesearch.indexer import CRAWLER_SETTINGS, Indexer
+from sitesearch.jobs import CRAWLER_QUEUE, INDEX_TASK, INDEXING_TIMEOUT
+from sitesearch.keys import Keys
+
+# The most sites the service crawls at once.
+MAX_CRAWLS = 4
+# How long we wait for a job before we check whether we should stop.
+DEQUEUE_TIMEOUT = 5
+
+log = logging.getLogger(__name__)
+
+
+class SharedPoolDownloadHandler(HTTP11DownloadHandler):
+    """
+    An HTTP download handler that every crawl in the process shares one
+    connection pool through, so that a crawl reuses the connections that
+    earlier crawls of the same site kept open.
+
+    Scrapy gives each crawl its own download handler, whose pool it
+    closes when the crawl ends. We keep the first handler's pool open and
+    hand it to every handler after it.
+    """
+    pool = None
+
+    def __init__(self, settings, crawler=None):
+        super().__init__(settings, crawler)
+        if SharedPoolDownloadHandler.pool is None:
+            SharedPoolDownloadHandler.pool = self._pool
+        else:
+            self._pool = SharedPoolDownloadHandler.pool
+
+    def close(self):
+        # Later crawls still need the pool.
+        return defer.succeed(None)
+
+
+SERVICE_SETTINGS = {
+    **CRAWLER_SETTINGS,
+    'DOWNLOAD_HANDLERS': {
+        'http': 'sitesearch.crawler_service.SharedPoolDownloadHandler',
+        'https': 'sitesearch.crawler_service.SharedPoolDownloadHandler',
+    }
+}
+
+
+class CrawlerService:
+    """
+    CrawlerService is a long-running process that crawls and indexes
+    sites, as the `index` task would, for the jobs on the crawler queue.
+
+    The `index` task runs in a work-horse process that RQ forks for every
+    job, and Twisted's reactor can't restart, so each job imports Scrapy,
+    starts a reactor and opens connections all over again. The service
+    does that once: it keeps one reactor running and crawls up to
+    `max_crawls` sites on it at once.
+
+    We take jobs off the queue ourselves, rather than through an RQ
+    worker, and record their status the way a worker would, so that the
+    API can report on them.
+    """
+    def __init__(self,
+                 config: Optional[AppConfiguration] = None,
+                 max_crawls: int = MAX_CRAWLS,
+                 clock=reactor):
+        self.config = config or AppConfiguration()
+        self.keys = Keys(self.config.key_prefix)
+        self.redis = get_rq_redis_client()
+        self.queue = ClusterAwareQueue(CRAWLER_QUEUE, connection=self.redis)
+        self.runner = CrawlerRunner(SERVICE_SETTINGS)
+        self.slots = defer.DeferredSemaphore(max_crawls)
+        self.started = StartedJobRegistry(queue=self.queue,
+                                          job_class=ClusterAwareJob)
+        self.finished = FinishedJobRegistry(queue=self.queue,
+                                            job_class=ClusterAwareJob)
+        self.failed = FailedJobRegistry(queue=self.queue,
+                                        job_class=ClusterAwareJob)
+        self.running = False
+        # The job timeouts run on this clock, which tests replace.
+        self.clock = clock
+
+    def run(self):
+        """Take jobs off the queue and crawl until the reactor stops."""
+        reactor.suggestThreadPoolSize(
+            CRAWLER_SETTINGS['REACTOR_THREADPOOL_MAXSIZE'])
+        reactor.callWhenRunning(self.take_jobs)
+        reactor.addSystemEventTrigger('before', 'shutdown', self.stop)
+        log.info("Crawler service waiting for jobs on queue %s",
+                 self.queue.name)
+        reactor.run()
+
+    def stop(self):
+        """
+        Stop taking jobs. We don't wait for the crawls we're running:
+        they stop with the reactor, and the next crawl of each site
+        resumes from its checkpoint.
+        """
+        self.running = False
+
+    @defer.inlineCallbacks
+    def take_jobs(self):
+        self.running = True
+        while self.running:
+            yield self.slots.acquire()
+            try:
+                job = yield threads.deferToThread(self.dequeue)
+            except Exception:
+                log.exception("Could not take a job off the crawler queue")
+                job = None
+                yield task.deferLater(reactor, DEQUEUE_TIMEOUT, lambda: None)
+            if job is None:
+                self.slots.release()
+                continue
+            crawl = self.run_job(job)
+            crawl.addBoth(lambda _: self.slots.release())
+
+    def dequeue(self) -> Optional[ClusterAwareJob]:
+        try:
+            result = ClusterAwareQueue.dequeue_any([self.queue],
+                                                   DEQUEUE_TIMEOUT,
+                                                   connection=self.redis,
+                                                   job_class=ClusterAwareJob)
+        except DequeueTimeout:
+            return None
+        if result is None:
+            return None
+        job, _ = result
+        return job
+
+    @defer.inlineCallbacks
+    def run_job(self, job: ClusterAwareJob):
+        """
+        Run an `index` job, recording its status as an RQ worker would.
+
+        Like an RQ worker, we fail a job that runs for longer than its
+        timeout. We stop its crawl, and the next crawl of the site
+        resumes from its checkpoint.
+        """
+        yield threads.deferToThread(self.start_job, job)
+        timeout = job.timeout or INDEXING_TIMEOUT
+        work = self.index(job)
+        timer = self.clock.callLater(timeout, work.cancel) \
+            if timeout > 0 else None
+
+        def stop_timer(result):
+            if timer is not None and timer.active():
+                timer.cancel()
+            return result
+
+        work.addBoth(stop_timer)
+        try:
+            yield work
+        except defer.CancelledError:
+            log.error("Job %s timed out after %s seconds", job.id, timeout)
+            yield threads.deferToThread(
+                self.fail_job, job,
+                f"JobTimeoutException: Task exceeded maximum timeout value "
+                f"({timeout} seconds)")
+        except Exception as e:
+            log.exception("Job %s failed", job.id)
+            yield threads.deferToThread(self.fail_job, job, repr(e))
+        else:
+            yield threads.deferToThread(self.finish_job, job)
+
+    @defer.inlineCallbacks
+    def index(self, job: ClusterAwareJob):
+        """
+        Crawl and index the site of an `index` job. We only crawl on the
+        reactor, and talk to Redis before the crawl in threads.
+        """
+        if job.func_name != INDEX_TASK:
+            raise ValueError(f"The crawler service can't run {job.func_name}")
+        site = job.args[0]
+        config = job.kwargs.get('config') or self.config
+        indexer = yield threads.deferToThread(Indexer, site, config)
+        Spider = yield threads.deferToThread(indexer.prepare_crawl,
+                                             job.kwargs.get('force', False))
+        if Spider is None:
+            return
+        log.info("Crawling %s for job %s", site.url, job.id)
+        yield indexer.crawl_site(Spider, runner=self.runner)
+
+    def start_job(self, job: ClusterAwareJob):
+        with self.redis.pipeline() as p:
+            job.started_at = datetime.datetime.utcnow()
+            job.set_status(JobStatus.STARTED, pipeline=p)
+            job.save(pipeline=p)
+            self.started.add(job, INDEXING_TIMEOUT, pipeline=p)
+            p.execute()
+
+    def finish_job(self, job: ClusterAwareJob):
+        with self.redis.pipeline() as p:
+            job.ended_at = datetime.datetime.utcnow()
+            job.set_status(JobStatus.FINISHED, pipeline=p)
+            job.save(pipeline=p)
+            self.started.remove(job, pipeline=p)
+            self.finished.add(job, job.get_result_ttl(DEFAULT_RESULT_TTL),
+                              pipeline=p)
+            # Like the `index` task, forget the jobs we enqueued at startup.
+            p.srem(self.keys.startup_indexing_job_ids(), job.id)
+            p.execute()
+
+    def fail_job(self, job: ClusterAwareJob, error: str):
+        with self.redis.pipeline() as p:
+            job.ended_at = datetime.datetime.utcnow()
+            job.set_status(JobStatus.FAILED, pipeline=p)
+            job.save(pipeline=p)
+            self.started.remove(job, pipeline=p)
+            self.failed.add(job, job.failure_ttl or DEFAULT_FAILURE_TTL,
+                            exc_string=error, pipeline=p)
+            p.execute()
@@ -0,0 +1,243 @@
+import time
+from threading import Lock
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from redis import Redis
+from twisted.internet import defer, task
+from twisted.internet.defer import Deferred
+
+from sitesearch.keys import Keys
+
+# About as many requests as one crawler process makes at once. A shard
+# doesn't claim more URLs than this, so that it leaves the rest of the
+# frontier to the other shards.
+MAX_CLAIMS = 100
+# If a shard hasn't finished a URL it claimed after this long, we assume
+# the shard stopped and give the URL to another shard.
+CLAIM_TIMEOUT = 60 * 10
+# How often a shard tells the other shards that it's still crawling.
+HEARTBEAT_INTERVAL = 30
+# If a shard hasn't reported in for this long -- or hasn't started this
+# long after the crawl did -- we assume it stopped, and the other shards
+# finish the crawl without it.
+SHARD_TIMEOUT = CLAIM_TIMEOUT
+# Take up to ARGV[1] URLs off the frontier (KEYS[1]) and claim them in
+# the Sorted Set of claims (KEYS[2]) with the time ARGV[2], all at once,
+# so that a shard that stops in between can't lose the URLs.
+CLAIM_SCRIPT = """
+local urls = redis.call('LRANGE', KEYS[1], 0, tonumber(ARGV[1]) - 1)
+if #urls > 0 then
+    redis.call('LTRIM', KEYS[1], #urls, -1)
+    for _, url in ipairs(urls) do
+        redis.call('ZADD', KEYS[2], ARGV[2], url)
+    end
+end
+return urls
+"""
+
+
+class SharedFrontier:
+    """
+    SharedFrontier holds the URLs that the shards of a distributed crawl
+    have yet to request, in Redis, so that several crawler processes --
+    on one host or many -- can crawl a site into the same index.
+
+    Every URL any shard finds goes into a Hash of the crawl's requests,
+    which is the same Hash that CrawlCheckpoint saves a crawl's requests
+    to. A URL we add for the first time goes onto a List, from which
+    shards claim URLs to request. We track the URLs each shard claimed
+    until it has downloaded them, so that a shard doesn't stop crawling
+    while another shard may still find links to follow.
+
+    Each shard reports in to a Sorted Set of the crawl's shards while it
+    crawls, and leaves the set when it finishes. The last shard to leave
+    makes the index live. A shard that stops without leaving stops
+    reporting in, so the other shards drop it from the set after
+    `shard_timeout` seconds, and the last of them to leave finishes the
+    crawl instead.
+    """
+    def __init__(self, redis_client: Redis, keys: Keys, index_name: str,
+                 max_claims: int = MAX_CLAIMS,
+                 claim_timeout: float = CLAIM_TIMEOUT,
+                 shard_timeout: float = SHARD_TIMEOUT,
+                 heartbeat_interval: float = HEARTBEAT_INTERVAL):
+        self.redis = redis_client
+        self.requests_key = keys.crawl_requests(index_name)
+        self.queue_key = keys.crawl_frontier(index_name)
+        self.claims_key = keys.crawl_claims(index_name)
+        self.shards_key = keys.crawl_shards(index_name)
+        self.max_claims = max_claims
+        self.claim_timeout = claim_timeout
+        self.shard_timeout = shard_timeout
+        self.heartbeat_interval = heartbeat_interval
+        # Our shard of the crawl, once we join it.
+        self.shard: Optional[str] = None
+        self.next_heartbeat = 0.0
+        # The URLs this process claimed and hasn't finished.
+        self.claimed: Set[str] = set()
+        self.lock = Lock()
+        self.claim_script = self.redis.register_script(CLAIM_SCRIPT)
+
+    def start(self, shards: int, requests: Dict[str, str]):
+        """
+        Start a crawl with `shards` shards, which first request the URLs
+        in `requests` with the spider callbacks they map to.
+
+        We queue these URLs even if the crawl already requested them,
+        because we're resuming a crawl that didn't finish them.
+
+        Each shard counts as reporting in when the crawl starts, so that
+        we give shards that haven't started yet `shard_timeout` seconds.
+        """
+        now = time.time()
+        with self.redis.pipeline(transaction=False) as p:
+            p.delete(self.queue_key, self.claims_key, self.shards_key)
+            p.zadd(self.shards_key, {str(i): now for i in range(shards)})
+            if requests:
+                p.hset(self.requests_key, mapping=requests)
+                p.rpush(self.queue_key, *requests)
+            p.execute()
+
+    def add(self, urls: Iterable[str], callback: str = 'parse') -> int:
+        """
+        Queue the URLs that no shard has found yet, to request with
+        `callback`. Returns how many URLs we queued.
+        """
+        urls = list(dict.fromkeys(urls))
+        if not urls:
+            return 0
+        with self.redis.pipeline(transaction=False) as p:
+            for url in urls:
+                p.hsetnx(self.requests_key, url, callback)
+            added = p.execute()
+        new_urls = [url for url, is_new in zip(urls, added) if is_new]
+        if new_urls:
+            self.redis.rpush(self.queue_key, *new_urls)
+        return len(new_urls)
+
+    def claim(self) -> List[Tuple[str, str]]:
+        """
+        Take URLs off the frontier for this process to request, up to
+        `max_claims` at a time. Returns each URL with the name of the
+        callback to request it with.
+        """
+        with self.lock:
+            count = self.max_claims - len(self.claimed)
+            if count <= 0:
+                return []
+            urls = self.claim_script(keys=[self.queue_key, self.claims_key],
+                                     args=[count, time.time()])
+            if not urls:
+                return []
+            self.claimed.update(urls)
+
+        callbacks = self.redis.hmget(self.requests_key, urls)
+        return [(url, callback or 'parse')
+                for url, callback in zip(urls, callbacks)]
+
+    def done(self, url: str):
+        """Finish a URL we claimed, whether or not we could download it."""
+        with self.lock:
+            if url not in self.claimed:
+                return
+            self.claimed.discard(url)
+        self.redis.zrem(self.claims_key, url)
+
+    def release(self):
+        """
+        Finish every URL we claimed. We do this when our crawler is idle,
+        in case it dropped a request before downloading it.
+        """
+        with self.lock:
+            urls, self.claimed = self.claimed, set()
+        if urls:
+            self.redis.zrem(self.claims_key, *urls)
+
+    def finished(self) -> bool:
+        """
+        Whether every shard is out of URLs to request. Before we check,
+        we put back the URLs that stopped shards claimed.
+        """
+        stale = self.redis.zrangebyscore(self.claims_key, 0,
+                                         time.time() - self.claim_timeout)
+        if stale:
+            # Only the shard that removes a claim puts its URL back.
+            with self.redis.pipeline(transaction=False) as p:
+                for url in stale:
+                    p.zrem(self.claims_key, url)
+                removed = p.execute()
+            requeued = [url for url, ok in zip(stale, removed) if ok]
+            if requeued:
+                self.redis.rpush(self.queue_key, *requeued)
+            return False
+        with self.redis.pipeline(transaction=False) as p:
+            p.llen(self.queue_key)
+            p.zcard(self.claims_key)
+            queued, claims = p.execute()
+        return queued == 0 and claims == 0
+
+    def join(self, shard: int) -> bool:
+        """
+        Start crawling as shard number `shard`. Returns whether the crawl
+        still counts on that shard -- it doesn't once the other shards
+        gave up on it.
+        """
+        self.shard = str(shard)
+        self.next_heartbeat = time.monotonic() + self.heartbeat_interval
+        return self.redis.zadd(self.shards_key, {self.shard: time.time()},
+                               xx=True, ch=True) == 1
+
+    def heartbeat(self):
+        """Report in, if we haven't for `heartbeat_interval` seconds."""
+        if self.shard is None or time.monotonic() < self.next_heartbeat:
+            return
+        self.next_heartbeat = time.monotonic() + self.heartbeat_interval
+        self.redis.zadd(self.shards_key, {self.shard: time.time()}, xx=True)
+
+    def leave(self, clock=None) -> Deferred:
+        """
+        Finish our shard. Returns a Deferred that fires with whether we
+        should finish the crawl.
+
+        If other shards are still crawling, we wait until they leave too,
+        or until they stop reporting in, because they may have stopped.
+        We check again every `heartbeat_interval` seconds on `clock` --
+        the reactor, unless a test gives us another -- rather than sleep,
+        so that the other crawls on the reactor carry on while we wait.
+        """
+        if clock is None:
+            # Don't install the default reactor on import, before Scrapy
+            # installs the one it's configured to use.
+            from twisted.internet import reactor
+            clock = reactor
+        shards = () if self.shard is None else (self.shard, )
+        return self.wait_for_shards(self.remove_shards(*shards), clock)
+
+    def wait_for_shards(self, last: Optional[bool], clock) -> Deferred:
+        if last is not None:
+            return defer.succeed(last)
+        waiting = task.deferLater(clock, self.heartbeat_interval,
+                                  self.remove_shards)
+        return waiting.addCallback(self.wait_for_shards, clock)
+
+    def remove_shards(self, *shards: str) -> Optional[bool]:
+        """
+        Remove `shards`, and every shard that stopped reporting in, from
+        the crawl. Returns whether we removed the last shard, or None if
+        there are shards left.
+        """
+        with self.redis.pipeline() as p:
+            if shards:
+                p.zrem(self.shards_key, *shards)
+            p.zremrangebyscore(self.shards_key, 0,
+                               time.time() - self.shard_timeout)
+            p.zcard(self.shards_key)
+            *removed, remaining = p.execute()
+        if remaining:
+            return None
+        # Only the process that removes the last shard finishes the crawl.
+        return sum(removed) > 0
+
+    def clear(self):
+        """Forget the frontier of a crawl that finished."""
+        self.redis.delete(self.queue_key, self.claims_key, self.shards_key)
@@ -1,13 +1,17 @@
+import asyncio
 import datetime
+import gzip
+import hashlib
 import json
 import logging
 import multiprocessing
 import time
-from dataclasses import asdict
-from queue import Queue
-from threading import Thread
-from typing import Dict, List, Callable, Tuple
-import ipdb
+from collections import defaultdict
+from concurrent.futures import Executor, Future, ProcessPoolExecutor
+from dataclasses import asdict, replace
+from queue import Empty, Full, Queue
+from threading import Lock, Thread
+from typing import AbstractSet, Dict, List, Callable, Optional, Set, Tuple, Union
 from redis import ResponseError
 
 import redis.exceptions
@@ -16,21 +20,59 @@ from bs4 import BeautifulSoup, element
 from redisearch import Client, IndexDefinition
 from scrapy import signals
 from scrapy.linkextractors import LinkExtractor
-from scrapy.crawler import CrawlerProcess
-from scrapy.signalmanager import dispatcher
-
+from scrapy.crawler import CrawlerProcess, CrawlerRunner
+from scrapy.exceptions import DontCloseSpider
+from scrapy.http import HtmlResponse
+from scrapy.utils.sitemap import Sitemap
+from scrapy.utils.reactor import is_asyncio_reactor_installed
+from twisted.internet import defer, task, threads
+from twisted.internet.defer import Deferred
+
+from sitesearch.archive import CrawlArchive
+from sitesearch.checkpoint import ABANDONED_SECONDS, Checkpoint, CrawlCheckpoint
+from sitesearch.frontier import SharedFrontier
 from sitesearch.keys import Keys
+from sitesearch.metrics import (DOCUMENTS_COPIED, DOCUMENTS_PARSED,
+                                DOCUMENTS_UNCHANGED,
+                                DOCUMENTS_WRITTEN, PAGES_FETCHED, QUEUE_DEPTH,
+                                WRITE_ERRORS, Metrics)
 from sitesearch.config import AppConfiguration
-from sitesearch.connections import get_search_connection
+from sitesearch.connections import get_redis_connection
 from sitesearch.errors import ParseError
-from sitesearch.models import SearchDocument, SiteConfiguration, TYPE_PAGE, TYPE_SECTION
+from sitesearch.models import CachedPage, SearchDocument, SiteConfiguration, TYPE_PAGE, TYPE_SECTION
+from sitesearch.page_cache import PageCache
+from sitesearch.search_cache import GENERATION_SEPARATOR, generation_index
+from sitesearch.sections import get_section
 
 ROOT_PAGE = "Redis Labs Documentation"
 MAX_THREADS = multiprocessing.cpu_count() * 5
+# Writer threads send documents to Redis in batches of up to this many
+# documents, or whatever arrived within this many seconds.
+WRITE_BATCH_SIZE = 200
+WRITE_BATCH_SECONDS = 0.05
+# The most documents we'll hold in memory while waiting to write them
+# to Redis. When the queue is full, the crawler blocks until writers
+# catch up.
+DOCUMENT_QUEUE_SIZE = 1000
 DEBOUNCE_SECONDS = 60 * 5  # Five minutes
 SYNUPDATE_COMMAND = 'FT.SYNUPDATE'
+SUGADD_COMMAND = 'FT.SUGADD'
 TWO_HOURS = 60*60*2
+# How many keys we ask SCAN for, and UNLINK, at a time when we delete
+# the documents of an index from before each index had its own prefix.
+LEGACY_DELETE_BATCH_SIZE = 1000
 INDEXING_LOCK_TIMEOUT = 60*60
+CRAWLER_SETTINGS = {
+    'CONCURRENT_ITEMS': 200,
+    'CONCURRENT_REQUESTS': 100,
+    'ITEM_PIPELINES': {
+        'sitesearch.indexer.DocumentPipeline': 100
+    },
+    'CONCURRENT_REQUESTS_PER_DOMAIN': 100,
+    'HTTP_CACHE_ENABLED': True,
+    'REACTOR_THREADPOOL_MAXSIZE': 30,
+    'LOG_LEVEL': 'ERROR'
+}
 
 Scorer = Callable[[SearchDocument, float], None]
 ScorerList = List[Scorer]
@@ -38,6 +80,11 @@ Extractor = Callable[[str], List[str]]
 Validator = Callable[[SearchDocument], None]
 ValidatorList = List[Validator]
 
+# The kinds of strings that get_text() includes.
+TEXT_TYPES = (element.NavigableString, element.CData)
+# The characters BeautifulSoup considers whitespace.
+WHITESPACE = '\x20\x0a\x09\x0c\x0d'
+
 log = logging.getLogger(__name__)
 
 
@@ -53,24 +100,136 @@ def next_element(elem):
             return elem
 
 
-def get_section(root_url: str, url: str) -> str:
-    """Given a root URL and an input URL, determine the "section" of the current URL.
+def await_future(future: Future):
+    """
+    Wrap a concurrent.futures Future in something a Scrapy callback can
+    await, under either the default Twisted reactor or the asyncio one.
+    """
+    if is_asyncio_reactor_installed():
+        return asyncio.wrap_future(future)
+
+    # Importing the reactor installs it, so we wait until Scrapy has.
+    from twisted.internet import reactor
+    deferred = Deferred()
+
+    def done(f: Future):
+        error = f.exception()
+        if error is None:
+            reactor.callFromThread(deferred.callback, f.result())
+        else:
+            reactor.callFromThread(deferred.errback, error)
+
+    future.add_done_callback(done)
+    return deferred
+
+
+def safe_url(url: str) -> str:
+    """The URL we store for a page: no query string or trailing slash."""
+    return url.split('?')[0].rstrip('/')
 
-    The section is the first portion of the path above the root, e.g. in the URL:
 
-        https://docs.redislabs.com/first/second/third
+def body_hash(response) -> str:
+    """A hash of a response's body, to tell if a page has changed."""
+    return hashlib.sha1(response.body).hexdigest()
 
-    The section is "first".
+
+def document_hash(doc_dict: Dict) -> str:
+    """
+    A hash of a document's fields, to tell if a document has changed. We
+    leave out the hierarchy, which update_hierarchies() keeps up to date.
+    """
+    fields = {
+        name: value
+        for name, value in doc_dict.items()
+        if name not in ('hierarchy', 'content_hash')
+    }
+    return hashlib.sha1(json.dumps(fields, sort_keys=True).encode(
+        'utf-8')).hexdigest()
+
+
+def parse_lastmod(lastmod: Optional[str]) -> Optional[datetime.datetime]:
     """
-    if not url.startswith(root_url):
-        return ""
+    Parse a sitemap <lastmod> value, which is a W3C datetime -- either
+    a date or a date and time with a timezone. Dates without a timezone
+    are in UTC.
+    """
+    if not lastmod:
+        return None
+    try:
+        parsed = datetime.datetime.fromisoformat(lastmod.strip().replace(
+            'Z', '+00:00'))
+    except ValueError:
+        log.debug("Could not parse lastmod: %s", lastmod)
+        return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=datetime.timezone.utc)
+    return parsed
+
+
+def index_prefixes(redis_client, index_name: str) -> Optional[List[str]]:
+    """The key prefixes of the documents an index indexes, if it exists."""
     try:
-        url_parts = url.replace(root_url, "").replace("//", "/").split("/")
-        s = [u for u in url_parts if u][0]
-    except (IndexError, TypeError, AttributeError) as e:
-        log.debug("Could not parse section: %s", e)
-        s = ""
-    return s
+        info = redis_client.execute_command('FT.INFO', index_name)
+    except redis.exceptions.ResponseError:
+        return None
+    definition = dict(zip(info[::2], info[1::2])).get('index_definition') or []
+    return dict(zip(definition[::2], definition[1::2])).get('prefixes')
+
+
+def has_own_documents(redis_client, keys: Keys, index_name: str) -> bool:
+    """
+    Whether an index only indexes documents under its own prefix.
+
+    Indexes we created before each generation of an index had its own
+    prefix share their documents with every other generation.
+    """
+    return index_prefixes(redis_client,
+                          index_name) == [keys.index_prefix(index_name)]
+
+
+def drop_index(redis_client, keys: Keys, index_name: str):
+    """
+    Drop an old generation of a site's index.
+
+    If the index has its own documents, RediSearch deletes them with the
+    index (DD), in the background. Otherwise, it's an index from before
+    each generation had its own prefix, which also indexes every newer
+    generation's documents, so we drop it without them and then delete
+    the documents we wrote under its prefix ourselves -- see
+    delete_legacy_documents().
+    """
+    prefixes = index_prefixes(redis_client, index_name)
+    if prefixes == [keys.index_prefix(index_name)]:
+        redis_client.execute_command('FT.DROPINDEX', index_name, 'DD')
+        return
+    if prefixes:
+        # Remember the prefixes first, in case we stop before we've
+        # deleted their documents.
+        redis_client.sadd(keys.legacy_prefixes(), *prefixes)
+    redis_client.execute_command('FT.DROPINDEX', index_name)
+
+
+def delete_legacy_documents(redis_client, keys: Keys):
+    """
+    Delete the documents of the indexes drop_index() dropped without
+    them. We find them with SCAN and UNLINK them in batches, so that we
+    never block Redis for long.
+
+    Those documents are under `<prefix>:doc:`, a key layout we don't
+    write anymore, so this only has work to do once.
+    """
+    for prefix in redis_client.smembers(keys.legacy_prefixes()):
+        batch = []
+        for key in redis_client.scan_iter(match=f"{prefix}:doc:*",
+                                          count=LEGACY_DELETE_BATCH_SIZE):
+            batch.append(key)
+            if len(batch) >= LEGACY_DELETE_BATCH_SIZE:
+                redis_client.unlink(*batch)
+                batch = []
+        if batch:
+            redis_client.unlink(*batch)
+        redis_client.srem(keys.legacy_prefixes(), prefix)
+        log.info("Deleted the documents of the legacy index prefix %s", prefix)
 
 
 class DocumentParser:
@@ -79,35 +238,91 @@ class DocumentParser:
         self.validators = validators
         self.content_classes = content_classes
 
-    def extract_parts(self, doc,
-                      h2s: List[element.Tag]) -> List[SearchDocument]:
+    def extract_text(self, content: element.Tag,
+                     h2s: List[element.Tag]) -> Tuple[str, List[str]]:
+        """
+        Get the text of the page content and of each section of the page.
+
+        A section is all of the sibling elements that follow an H2, up to
+        the next H2. We find the elements that belong to each section,
+        then walk the content tree once, adding each string we find to
+        the page text and to the text of every section it falls within.
+
+        Like get_text(), we only use plain strings and CDATA -- not
+        comments, scripts or styles. A newline separates the elements of
+        a section, and any run of whitespace between them collapses to a
+        single newline or space, the way BeautifulSoup collapses
+        whitespace when it parses HTML.
+        """
+        section_indexes: Dict[int, List[int]] = defaultdict(list)
+        for i, tag in enumerate(h2s):
+            elem = next_element(tag)
+            while elem and elem.name != 'h2':
+                section_indexes[id(elem)].append(i)
+                elem = next_element(elem)
+
+        page_text = []
+        section_texts: List[List[str]] = [[] for _ in h2s]
+        # Text between the elements of a section, waiting to be collapsed.
+        between: List[List[str]] = [[] for _ in h2s]
+        started = [False] * len(h2s)
+
+        def end_between(i):
+            text = ''.join(between[i])
+            between[i] = []
+            if text and not text.strip(WHITESPACE):
+                text = '\n' if '\n' in text else ' '
+            section_texts[i].append(text)
+
+        stack = [(iter(content.children), ())]
+        while stack:
+            children, active = stack[-1]
+            child = next(children, None)
+            if child is None:
+                stack.pop()
+                continue
+
+            is_tag = isinstance(child, element.Tag)
+            indexes = section_indexes.get(id(child), ())
+            for i in indexes:
+                if started[i]:
+                    between[i].append('\n')
+                started[i] = True
+                if is_tag:
+                    end_between(i)
+
+            if is_tag:
+                stack.append((iter(child.children), (*active, *indexes)))
+            elif type(child) in TEXT_TYPES:
+                page_text.append(child)
+                for i in active:
+                    section_texts[i].append(child)
+                for i in indexes:
+                    between[i].append(child)
+
+        for i in range(len(h2s)):
+            end_between(i)
+
+        return ''.join(page_text), [''.join(t) for t in section_texts]
+
+    def extract_parts(self, doc, h2s: List[element.Tag],
+                      section_texts: List[str]) -> List[SearchDocument]:
         """
         Extract SearchDocuments from H2 elements in a SearchDocument.
 
-        Given a list of H2 elements in a page, we extract the HTML content for
-        that "part" of the page by grabbing all of the sibling elements and
-        converting them to text.
+        Given a list of H2 elements in a page and the text of the "part"
+        of the page that follows each one (see `extract_text()`), we
+        create a SearchDocument per part.
         """
         docs = []
 
         for i, tag in enumerate(h2s):
-            origin = tag
-
             # Sometimes we stick the title in as a link...
             if tag and tag.string is None:
                 tag = tag.find("a")
 
             part_title = tag.get_text() if tag else ""
-
-            page = []
-            elem = next_element(origin)
-
-            while elem and elem.name != 'h2':
-                page.append(str(elem))
-                elem = next_element(elem)
-
-            body = self.prepare_text(
-                BeautifulSoup('\n'.join(page), 'html.parser').get_text())
+            body = self.prepare_text(section_texts[i])
             _id = f"{doc.url}:{doc.title}:{part_title}:{i}"
 
             docs.append(
@@ -140,7 +355,6 @@ class DocumentParser:
         docs = []
         soup = BeautifulSoup(html, 'html.parser')
         content = soup
-        safe_url = url.split('?')[0].rstrip('/')
 
         try:
             title = self.prepare_text(soup.title.string.split("|")[0], True)
@@ -163,14 +377,15 @@ class DocumentParser:
         if not h2s:
             h2s = content.find_all('h3')
 
-        body = self.prepare_text(content.get_text(), True)
+        page_text, section_texts = self.extract_text(content, h2s)
+        body = self.prepare_text(page_text, True)
         doc = SearchDocument(doc_id=f"{url}:{title}",
                              title=title,
                              section_title="",
                              hierarchy=[],
                              s=s,
                              body=body,
-                             url=safe_url,
+                             url=safe_url(url),
                              type=TYPE_PAGE)
 
         # Index the entire document
@@ -179,7 +394,7 @@ class DocumentParser:
         # If there are headers, break up the document and index each header
         # as a separate document.
         if h2s:
-            docs += self.extract_parts(doc, h2s)
+            docs += self.extract_parts(doc, h2s, section_texts)
 
         return docs
 
@@ -215,9 +430,38 @@ class DocumentationSpiderBase(scrapy.Spider):
     If `allow` or `deny` are defined, this scraper will send them in
     as arguments to LinkExtractor when extracting links on a page,
     allowing fine-grained control of URL patterns to exclude or allow.
+
+    If `page_cache` is defined, the scraper crawls incrementally: it
+    sends conditional requests, and for any page that hasn't changed
+    since the last crawl, it yields the page's `CachedPage` instead of
+    parsing it again.
+
+    If `parse_pool` is defined, the scraper parses pages in that executor
+    (usually a process pool) instead of on the reactor thread, so that
+    parsing one large page doesn't stall every other request.
+
+    If `sitemap_urls` are defined, the scraper crawls the pages listed in
+    those sitemaps instead of following links. When it's also crawling
+    incrementally and `since` is defined, it doesn't request pages whose
+    <lastmod> is older than `since` -- it treats them as unchanged.
+
+    If `resume_requests` are defined, the scraper resumes a crawl that
+    didn't finish: it starts with those requests, and never requests the
+    `visited` URLs, which the crawl already requested.
+
+    If `frontier` is defined, the scraper is one shard of a distributed
+    crawl. Instead of requesting the URLs it finds, it adds them to the
+    shared frontier, and it requests the URLs it claims from there.
     """
     name: str = "documentation"
     doc_parser_class = DocumentParser
+    custom_settings = {
+        'DOWNLOADER_MIDDLEWARES': {
+            'sitesearch.indexer.ConditionalRequestMiddleware': 500
+        }
+    }
+    # A 304 is how an incremental crawl learns a page hasn't changed.
+    handle_httpstatus_list = [304]
 
     # Sub-classes should override these fields.
     url: str = None
@@ -226,6 +470,15 @@ class DocumentationSpiderBase(scrapy.Spider):
     allow: Tuple[str] = ()
     deny: Tuple[str] = ()
     allowed_domains: Tuple[str] = ()
+    page_cache: Optional[PageCache] = None
+    parse_pool: Optional[Executor] = None
+    sitemap_urls: Tuple[str, ...] = ()
+    since: Optional[datetime.datetime] = None
+    resume_requests: Optional[Dict[str, str]] = None
+    visited: AbstractSet[str] = frozenset()
+    frontier: Optional[SharedFrontier] = None
+    # The Indexer that DocumentPipeline hands scraped items to.
+    indexer = None
 
     def __init__(self, *args, **kwargs):
         self.doc_parser = self.doc_parser_class(self.url, self.validators,
@@ -233,23 +486,121 @@ class DocumentationSpiderBase(scrapy.Spider):
         super().__init__(*args, **kwargs)
         self.extractor = LinkExtractor(allow=self.allow, deny=self.deny)
 
-    def follow_links(self, response):
+    def extract_links(self, response) -> List[str]:
         try:
-            links = [
-                l for l in self.extractor.extract_links(response)
+            return [
+                l.url for l in self.extractor.extract_links(response)
                 if l.url.startswith(self.url)
             ]
         except AttributeError:  # Usually means this page isn't text -- could be a a PDF, etc.
-            links = []
+            return []
+
+    def follow_links(self, response, links: Optional[List[str]] = None):
+        # When we crawl from a sitemap, the sitemap lists every page.
+        if self.sitemap_urls:
+            self.record_parsed(response, {})
+            return
+        if links is None:
+            links = self.extract_links(response)
+        if self.visited:
+            links = [
+                link for link in links if safe_url(link) not in self.visited
+            ]
+        if self.frontier is not None:
+            yield from self.share_requests(links)
+            # The frontier saved the links with the crawl's requests.
+            self.record_parsed(response, {})
+            return
+        self.record_parsed(response, dict.fromkeys(links, 'parse'))
         yield from response.follow_all(links, callback=self.parse)
 
+    def record_parsed(self, response, requests: Dict[str, str]):
+        """
+        Tell our crawl's checkpoint that we parsed a page, along with the
+        links we request from it, so that a resumed crawl only skips the
+        page if it also knows about those links.
+        """
+        if self.indexer is not None:
+            self.indexer.checkpoint.parsed(safe_url(response.url), requests)
+
+    def share_requests(self, urls: List[str], callback: str = 'parse'):
+        """
+        Add URLs to the shared frontier, and request the URLs we claim
+        from it in return.
+        """
+        if self.frontier is None:
+            return
+        self.frontier.add(urls, callback)
+        yield from self.claim_requests()
+
+    def claim_requests(self):
+        """Request the URLs we claim from the shared frontier."""
+        for url, callback in self.frontier.claim():
+            # The frontier only hands out each URL once.
+            yield scrapy.Request(url,
+                                 callback=getattr(self, callback, self.parse),
+                                 dont_filter=True)
+
     def parse(self, response, **kwargs):
+        if self.parse_pool is not None:
+            return self.parse_in_pool(response)
+
+        def parse_documents():
+            return self.doc_parser.parse(response.url, response.body)
+
+        return self.parse_page(response, parse_documents)
+
+    async def parse_in_pool(self, response):
+        """
+        Parse a page in the parse pool, then handle the results the way
+        we would have if we had parsed the page ourselves.
+        """
+        docs_for_page = []
+        error = None
+
+        if self.needs_parsing(response):
+            future = self.parse_pool.submit(self.doc_parser.parse,
+                                            response.url, response.body)
+            try:
+                docs_for_page = await await_future(future)
+            except ParseError as e:
+                error = e
+
+        def parse_documents():
+            if error:
+                raise error
+            return docs_for_page
+
+        return list(self.parse_page(response, parse_documents))
+
+    def needs_parsing(self, response) -> bool:
+        """Whether `parse_page()` will parse this response."""
+        if not response.url.startswith(self.url) or response.status == 304:
+            return False
+        cached_page = response.meta.get('cached_page')
+        if self.page_cache is not None and cached_page:
+            return cached_page.body_hash != body_hash(response)
+        return True
+
+    def parse_page(self, response,
+                   parse_documents: Callable[[], List[SearchDocument]]):
         docs_for_page = []
         if not response.url.startswith(self.url):
             return
 
+        cached_page = response.meta.get('cached_page')
+        if response.status == 304:
+            if cached_page:
+                yield from self.unchanged_page(response, cached_page)
+            return
+
+        if self.page_cache is not None:
+            yield from self.parse_incrementally(response, self.page_cache,
+                                                cached_page, parse_documents)
+            return
+
         try:
-            docs_for_page = self.doc_parser.parse(response.url, response.body)
+            docs_for_page = parse_documents()
         except ParseError as e:
             log.error("Document parser error -- %s: %s", e, response.url)
         else:
@@ -258,10 +609,164 @@ class DocumentationSpiderBase(scrapy.Spider):
 
         yield from self.follow_links(response)
 
+    def unchanged_page(self, response, page: CachedPage):
+        """
+        Treat an unchanged page as crawled: yield its CachedPage, so the
+        indexer keeps its documents, and follow the links we saw on it.
+        """
+        if page.title:
+            yield page
+        yield from self.follow_links(response, page.links)
+
+    def parse_incrementally(self, response, page_cache: PageCache,
+                            cached_page: Optional[CachedPage],
+                            parse_documents: Callable[[], List[SearchDocument]]):
+        """
+        Parse a page unless its body is the same as the last time we
+        crawled it, and remember what we saw for the next crawl.
+        """
+        etag = response.headers.get('ETag')
+        last_modified = response.headers.get('Last-Modified')
+        page = CachedPage(
+            url=safe_url(response.url),
+            body_hash=body_hash(response),
+            etag=etag.decode() if etag else None,
+            last_modified=last_modified.decode() if last_modified else None,
+            links=self.extract_links(response))
+
+        if cached_page and cached_page.body_hash == page.body_hash:
+            page = replace(page, title=cached_page.title)
+            page_cache.set(page)
+            yield from self.unchanged_page(response, page)
+            return
+
+        try:
+            docs_for_page = parse_documents()
+        except ParseError as e:
+            log.error("Document parser error -- %s: %s", e, response.url)
+        else:
+            page = replace(page, title=docs_for_page[0].title)
+            yield from docs_for_page
+
+        page_cache.set(page)
+        yield from self.follow_links(response, page.links)
+
     @property
     def start_urls(self):
         return [self.url]
 
+    def start_requests(self):
+        if self.frontier is not None:
+            yield from self.claim_requests()
+            return
+        if self.resume_requests is not None:
+            for url, callback in self.resume_requests.items():
+                yield scrapy.Request(url,
+                                     callback=getattr(self, callback,
+                                                      self.parse),
+                                     dont_filter=True)
+            return
+        if not self.sitemap_urls:
+            for url in self.start_urls:
+                yield scrapy.Request(url, dont_filter=True)
+            return
+        for url in self.sitemap_urls:
+            yield scrapy.Request(url, callback=self.parse_sitemap)
+
+    async def start(self):
+        # Scrapy 2.13 and later call start() instead of start_requests().
+        for request in self.start_requests():
+            yield request
+
+    def parse_sitemap(self, response):
+        """
+        Request the pages in a sitemap, or the sitemaps in a sitemap index.
+        """
+        body = response.body
+        if body[:2] == b'\x1f\x8b':
+            body = gzip.decompress(body)
+
+        sitemap = Sitemap(body)
+        if sitemap.type == 'sitemapindex':
+            sitemap_urls = [
+                entry['loc'] for entry in sitemap
+                if safe_url(entry['loc']) not in self.visited
+            ]
+            if self.frontier is not None:
+                yield from self.share_requests(sitemap_urls, 'parse_sitemap')
+                return
+            for url in sitemap_urls:
+                yield scrapy.Request(url, callback=self.parse_sitemap)
+            return
+
+        page_urls = []
+        for entry in sitemap:
+            url = entry['loc']
+            if not url.startswith(self.url) or safe_url(url) in self.visited:
+                continue
+            cached_page = self.unmodified_page(url, entry.get('lastmod'))
+            if cached_page:
+                if cached_page.title:
+                    yield cached_page
+                continue
+            page_urls.append(url)
+
+        if self.frontier is not None:
+            yield from self.share_requests(page_urls)
+            return
+        for url in page_urls:
+            yield scrapy.Request(url, callback=self.parse)
+
+    def unmodified_page(self, url: str,
+                        lastmod: Optional[str]) -> Optional[CachedPage]:
+        """
+        Get the cached page for a URL if its sitemap entry says it hasn't
+        changed since our last crawl.
+        """
+        if self.page_cache is None or self.since is None:
+            return None
+        modified = parse_lastmod(lastmod)
+        if modified is None or modified >= self.since:
+            return None
+        return self.page_cache.get(safe_url(url))
+
+
+class DocumentPipeline:
+    """
+    An item pipeline that hands each item the spider scrapes to the
+    spider's indexer, which queues it for the writer threads.
+    """
+    def process_item(self, item, spider):
+        queued = spider.indexer.queue_document_later(item)
+        queued.addCallback(lambda _: item)
+        return queued
+
+
+class ConditionalRequestMiddleware:
+    """
+    A downloader middleware that makes requests conditional when the
+    spider crawls incrementally.
+
+    We look up the page cache here, rather than when we extract links,
+    so that we only do it for requests that survive Scrapy's duplicate
+    filter. The cached page rides along in the request's `meta` so the
+    spider doesn't have to look it up again.
+    """
+    def process_request(self, request, spider):
+        if getattr(spider, 'page_cache', None) is None:
+            return None
+
+        cached_page = spider.page_cache.get(safe_url(request.url))
+        if cached_page is None:
+            return None
+
+        request.meta['cached_page'] = cached_page
+        if cached_page.etag:
+            request.headers['If-None-Match'] = cached_page.etag
+        if cached_page.last_modified:
+            request.headers['If-Modified-Since'] = cached_page.last_modified
+        return None
+
 
 class Indexer:
     """
@@ -281,22 +786,56 @@ class Indexer:
 
     Whenever we try to search the index, we'll refer to the alias --
     not the actual index name.
+
+    If the app is configured to index in place, we instead update the
+    index the alias already points to, writing only the documents that
+    changed, and start a new generation of it when we're done.
+
+    Each index only indexes the documents we write for it, under its own
+    key prefix. So while we build a new index, RediSearch doesn't also
+    index the previous index's documents into it (or ours into the
+    previous index), and dropping the previous index deletes its
+    documents.
     """
     def __init__(self,
                  site: SiteConfiguration,
                  app_config: AppConfiguration,
                  search_client: Client = None):
         self.site = site
+        self.app_config = app_config
         self.keys = Keys(app_config.key_prefix)
         self.index_alias = self.keys.index_alias(self.site.url)
-        self.index_name = f"{self.index_alias}-{time.time()}"
+        redis_client = (search_client.redis
+                        if search_client is not None else get_redis_connection())
+
+        # The index the alias pointed to when we started. An incremental
+        # crawl copies the documents of unchanged pages from it.
+        previous_generation = redis_client.get(
+            self.keys.index_generation(self.index_alias))
+        self.previous_index: Optional[str] = (
+            generation_index(previous_generation)
+            if previous_generation else None)
+
+        self.checkpoint = CrawlCheckpoint(redis_client, self.keys,
+                                          self.index_alias)
+        # A crawl of this site that didn't finish, which index() resumes
+        # if it takes the site's lock.
+        self.resuming = self.resumable_crawl(redis_client)
+        self.choose_index(redis_client)
+        # The URLs left to crawl, if we crawl as a shard of a distributed
+        # crawl.
+        self.frontier = SharedFrontier(redis_client, self.keys,
+                                       self.index_name)
 
         if search_client is None:
-            search_client = get_search_connection(self.index_name)
+            search_client = Client(self.index_name, conn=redis_client)
 
         self.search_client = search_client
         self.redis = self.search_client.redis
         self.lock = self.keys.index_lock(site.url)
+        self.suggestions_key = self.keys.suggestions(self.index_alias,
+                                                     self.index_name)
+        self.metrics = Metrics(self.redis, self.keys)
         index_exists = self.search_index_exists()
 
         if not index_exists:
@@ -307,10 +846,145 @@ class Indexer:
         # segment of its URL to known URLs.
         self.seen_urls: Dict[str, str] = {}
 
+        # Documents wait here between the crawler and the writer threads.
+        self.docs_to_process: Queue = Queue(maxsize=DOCUMENT_QUEUE_SIZE)
+        self.writers: List[Thread] = []
+
+        # We write documents while we're still crawling, so a document's
+        # hierarchy may be missing pages we haven't seen yet. We track
+        # the hierarchy we wrote for each URL, and the keys we wrote it
+        # to, so that we can fix them up after the crawl.
+        self.written_hierarchies: Dict[str, str] = {}
+        self.written_keys: Dict[str, Set[str]] = defaultdict(set)
+        self.written_lock = Lock()
+
+        self.crawl_started = datetime.datetime.now(datetime.timezone.utc)
+        if self.resuming is not None:
+            self.crawl_started = datetime.datetime.fromtimestamp(
+                self.resuming.crawl_started, datetime.timezone.utc)
+
+        # The executor we parse pages in, if we don't parse them on the
+        # crawler's reactor thread.
+        self.parse_pool: Optional[Executor] = None
+
     @property
     def url(self):
         return self.site.url
 
+    def choose_index(self, redis_client):
+        """
+        Choose the index we write to: the index of the crawl we're
+        resuming, the index we're updating in place, or a new one.
+        """
+        self.in_place = bool(self.app_config.in_place_indexing
+                             and self.previous_index
+                             and has_own_documents(redis_client, self.keys,
+                                                   self.previous_index))
+        if self.resuming is not None:
+            self.in_place = self.resuming.in_place
+            self.index_name = self.resuming.index_name
+            self.generation = self.resuming.generation
+        elif self.in_place:
+            self.index_name = self.previous_index
+            self.generation = (f"{self.index_name}{GENERATION_SEPARATOR}"
+                               f"{time.time()}")
+        else:
+            if self.app_config.in_place_indexing:
+                log.info("No index to update in place, so building a new one")
+            self.index_name = f"{self.index_alias}-{time.time()}"
+            self.generation = self.index_name
+
+    def start_over(self):
+        """
+        Index the site from scratch, rather than resume the crawl we found
+        a checkpoint for. Its run may still be crawling into its index.
+        """
+        log.info("Not resuming the crawl of %s into %s", self.site.url,
+                 self.index_name)
+        self.resuming = None
+        self.choose_index(self.redis)
+        self.frontier = SharedFrontier(self.redis, self.keys, self.index_name)
+        if isinstance(self.search_client, Client):
+            self.search_client = Client(self.index_name, conn=self.redis)
+        self.suggestions_key = self.keys.suggestions(self.index_alias,
+                                                     self.index_name)
+        if not self.search_index_exists():
+            self.setup_index()
+        self.crawl_started = datetime.datetime.now(datetime.timezone.utc)
+
+    def resumable_crawl(self, redis_client) -> Optional[Checkpoint]:
+        """The checkpoint of a crawl we can resume, if there is one."""
+        checkpoint = self.checkpoint.load()
+        if checkpoint is None:
+            return None
+        if has_own_documents(redis_client, self.keys, checkpoint.index_name):
+            return checkpoint
+        # Another run dropped the index the crawl was building.
+        log.info("Can't resume crawl of %s, because its index is gone",
+                 self.site.url)
+        self.checkpoint.clear(checkpoint.index_name)
+        return None
+
+    def crawl_abandoned(self) -> bool:
+        """Whether the crawl we'd resume stopped without releasing its lock."""
+        return (self.resuming is not None
+                and time.time() - self.resuming.saved_at > ABANDONED_SECONDS)
+
+    def resume(self) -> Tuple[Dict[str, str], Set[str]]:
+        """
+        Pick up the crawl we're resuming where it stopped.
+
+        Returns the requests the crawl made but didn't finish, by URL,
+        with the names of their callbacks, and every URL that it requested
+        or indexed, which we shouldn't request again.
+
+        A page is finished once the crawl saved both its documents and the
+        links it followed from it. The crawl may have stopped after it
+        indexed a page but before it saved the page's links, or the other
+        way around, so we request every other page again.
+        """
+        requested = self.checkpoint.saved_requests(self.index_name)
+        parsed = self.checkpoint.saved_parsed(self.index_name)
+        indexed = self.load_crawl_progress()
+        finished = parsed & indexed
+
+        requested_urls = {safe_url(url) for url in requested}
+        pending = {
+            url: callback
+            for url, callback in requested.items()
+            if safe_url(url) not in finished
+        }
+        pending.update({
+            url: 'parse'
+            for url in indexed - finished - requested_urls
+        })
+
+        log.info("Resuming crawl of %s: %s pages indexed, %s to request",
+                 self.site.url, len(indexed), len(pending))
+        return pending, requested_urls | indexed
+
+    def load_crawl_progress(self) -> Set[str]:
+        """
+        Load what other runs of our crawl saved: the titles of the pages
+        they saw and the documents they wrote, so that update_hierarchies()
+        can fix up those documents too. Returns the URLs they indexed.
+        """
+        self.seen_urls.update(self.checkpoint.saved_titles(self.index_name))
+        indexed = self.redis.smembers(self.keys.site_urls_new(self.index_alias))
+
+        urls = list(indexed)
+        written = [(url, doc_keys)
+                   for url, doc_keys in zip(urls, self.url_document_keys(urls))
+                   if doc_keys]
+        with self.redis.pipeline(transaction=False) as p:
+            for _, doc_keys in written:
+                p.hget(next(iter(doc_keys)), 'hierarchy')
+            hierarchies = p.execute()
+        for (url, doc_keys), hierarchy in zip(written, hierarchies):
+            for key in doc_keys:
+                self.record_hierarchy(url, key, hierarchy)
+        return indexed
+
     def document_to_dict(self, document: SearchDocument):
         """
         Given a SearchDocument, return a dictionary of the fields to index,
@@ -327,6 +1001,7 @@ class Indexer:
             score = scorer(document, score)
         doc = asdict(document)
         doc['__score'] = score
+        doc['content_hash'] = document_hash(doc)
         hierarchy = self.build_hierarchy(document)
         doc['hierarchy'] = json.dumps(hierarchy)
         return doc
@@ -338,16 +1013,236 @@ class Indexer:
         This is the moment we convert a SearchDocument into a Python
         dictionary and send it to RediSearch.
         """
-        key = self.keys.document(self.site.url, doc.doc_id)
+        key = self.keys.document(self.index_name, doc.doc_id)
+        doc_dict = self.document_to_dict(doc)
         try:
-            self.redis.hset(key, mapping=self.document_to_dict(doc))
+            self.redis.hset(key, mapping=doc_dict)
         except redis.exceptions.DataError as e:
             log.error("Failed -- bad data: %s, %s", e, doc.url)
+            self.metrics.increment(WRITE_ERRORS, site=self.site.url)
         except redis.exceptions.ResponseError as e:
             log.error("Failed -- response error: %s, %s", e, doc.url)
+            self.metrics.increment(WRITE_ERRORS, site=self.site.url)
+        else:
+            self.record_hierarchy(doc.url, key, doc_dict['hierarchy'])
+            self.metrics.increment(DOCUMENTS_WRITTEN, site=self.site.url)
 
         new_urls_key = self.keys.site_urls_new(self.index_alias)
         self.redis.sadd(new_urls_key, doc.url)
+        self.redis.sadd(self.keys.url_documents(self.index_name, doc.url), key)
+
+        try:
+            self.add_suggestion(self.redis, doc.type, doc.title,
+                                doc.section_title, doc.url, doc_dict['__score'])
+        except redis.exceptions.ResponseError as e:
+            log.error("Failed -- could not add suggestion: %s, %s", e, doc.url)
+
+    def index_documents(self, items: List[Union[SearchDocument, CachedPage]]):
+        """
+        Add a batch of documents to the search index in one round trip.
+
+        We send every document's HSET, SADD and FT.SUGADD in a single
+        non-transactional pipeline, then check the results so that a failure
+        only costs us the document that failed.
+
+        The batch may include pages that an incremental crawl found
+        unchanged. We record that the pages are still part of the site and
+        copy their documents over from the previous index.
+
+        When we update an index in place, we only write documents that
+        changed since we last wrote them.
+        """
+        new_urls_key = self.keys.site_urls_new(self.index_alias)
+        unchanged_urls = [
+            item.url for item in items if isinstance(item, CachedPage)
+        ]
+        entries = [(doc, self.keys.document(self.index_name, doc.doc_id),
+                    self.document_to_dict(doc)) for doc in items
+                   if isinstance(doc, SearchDocument)]
+        kept_urls = list(unchanged_urls)
+        if self.in_place:
+            entries, unchanged_doc_urls = self.changed_documents(entries)
+            kept_urls += unchanged_doc_urls
+        docs = [doc for doc, _, _ in entries]
+        # Each document, with the position of its HSET in the pipeline.
+        writes = []
+        queued = 0
+
+        with self.redis.pipeline(transaction=False) as p:
+            for doc, key, doc_dict in entries:
+                writes.append((doc, key, doc_dict, queued))
+                p.hset(key, mapping=doc_dict)
+                p.sadd(new_urls_key, doc.url)
+                p.sadd(self.keys.url_documents(self.index_name, doc.url), key)
+                queued += 3
+                if self.add_suggestion(p, doc.type, doc.title,
+                                       doc.section_title, doc.url,
+                                       doc_dict['__score']):
+                    queued += 1
+            if kept_urls:
+                p.sadd(new_urls_key, *kept_urls)
+            try:
+                results = p.execute(raise_on_error=False)
+            except redis.exceptions.DataError as e:
+                # redis-py encodes the whole pipeline before sending it, so
+                # bad data in one document fails the batch. Retry documents
+                # one at a time so that we only lose the bad one.
+                log.error("Failed -- bad data in batch, retrying: %s", e)
+                for doc in docs:
+                    self.index_document(doc)
+                if kept_urls:
+                    self.redis.sadd(new_urls_key, *kept_urls)
+                if unchanged_urls and not self.in_place:
+                    self.carry_over(unchanged_urls)
+                return
+
+        # A document has an FT.SUGADD after its HSET and two SADDs only if
+        # it has a title to suggest, so we look up each HSET's result by
+        # its position. The SADD for unchanged pages comes last.
+        errors = 0
+        for doc, key, doc_dict, position in writes:
+            result = results[position]
+            if isinstance(result, redis.exceptions.ResponseError):
+                log.error("Failed -- response error: %s, %s", result, doc.url)
+                errors += 1
+            else:
+                self.record_hierarchy(doc.url, key, doc_dict['hierarchy'])
+        self.metrics.increment(DOCUMENTS_WRITTEN, len(writes) - errors,
+                               site=self.site.url)
+        if errors:
+            self.metrics.increment(WRITE_ERRORS, errors, site=self.site.url)
+
+        # An index we update in place already has the documents of
+        # unchanged pages.
+        if unchanged_urls and not self.in_place:
+            self.carry_over(unchanged_urls)
+
+    def changed_documents(self, entries: List[Tuple[SearchDocument, str, Dict]]):
+        """
+        Find the documents that changed since we last wrote them to the
+        index we're updating in place. We leave the rest alone, but
+        remember that we saw them, so that remove_missing_documents()
+        keeps them. Returns the changed documents and the URLs of the
+        unchanged ones.
+        """
+        with self.redis.pipeline(transaction=False) as p:
+            for _, key, _ in entries:
+                p.hmget(key, 'content_hash', 'hierarchy')
+            stored = p.execute()
+
+        changed = []
+        kept_urls = []
+        for (doc, key, doc_dict), (content_hash, hierarchy) in zip(
+                entries, stored):
+            if content_hash == doc_dict['content_hash']:
+                self.record_hierarchy(doc.url, key, hierarchy)
+                kept_urls.append(doc.url)
+            else:
+                changed.append((doc, key, doc_dict))
+
+        unchanged = len(entries) - len(changed)
+        if unchanged:
+            self.metrics.increment(DOCUMENTS_UNCHANGED, unchanged,
+                                   site=self.site.url)
+        return changed, kept_urls
+
+    def add_suggestion(self, client, doc_type: str, title: str,
+                       section_title: str, url: str, score: float):
+        """
+        Add an autocomplete suggestion for a document: the page title for
+        a page, or the section title for a section. The suggestion's
+        payload is the document's URL.
+
+        `client` may be a Redis client or a pipeline. Returns whether we
+        added a suggestion, since a document without a title has none.
+        """
+        suggestion = title if doc_type == TYPE_PAGE else section_title
+        if not suggestion:
+            return False
+        client.execute_command(SUGADD_COMMAND, self.suggestions_key,
+                               suggestion, score, 'PAYLOAD', url)
+        return True
+
+    def carry_over(self, urls: List[str]):
+        """
+        Copy the documents of pages that an incremental crawl found
+        unchanged from the previous index into ours, and add their
+        suggestions. We didn't parse these pages again, so we read
+        everything from the documents we wrote last time.
+
+        Every index has its own documents, so this still writes each
+        document of an unchanged page, one HSET apiece -- we only save
+        fetching and parsing the page. We count these writes as
+        DOCUMENTS_COPIED. Updating the index in place is what skips them.
+        """
+        if not self.previous_index:
+            return
+
+        with self.redis.pipeline(transaction=False) as p:
+            for url in urls:
+                p.smembers(
+                    self.keys.url_documents(self.previous_index, url))
+            doc_keys = [
+                key for doc_keys in p.execute() for key in doc_keys
+            ]
+
+        with self.redis.pipeline(transaction=False) as p:
+            for key in doc_keys:
+                p.hgetall(key)
+            documents = p.execute()
+
+        # The position of each document's HSET in the pipeline.
+        positions = []
+        queued = 0
+        with self.redis.pipeline(transaction=False) as p:
+            for doc in documents:
+                if 'doc_id' not in doc:
+                    continue
+                url = doc['url']
+                key = self.keys.document(self.index_name, doc['doc_id'])
+                positions.append(queued)
+                p.hset(key, mapping=doc)
+                p.sadd(self.keys.url_documents(self.index_name, url), key)
+                queued += 2
+                if self.add_suggestion(p, doc.get('type'), doc.get('title'),
+                                       doc.get('section_title'), url,
+                                       float(doc.get('__score') or 1.0)):
+                    queued += 1
+                # The page's parents may have changed titles since.
+                self.record_hierarchy(url, key, doc.get('hierarchy'))
+            results = p.execute(raise_on_error=False)
+
+        errors = sum(1 for position in positions if isinstance(
+            results[position], redis.exceptions.ResponseError))
+        if positions:
+            self.metrics.increment(DOCUMENTS_COPIED, len(positions) - errors,
+                                   site=self.site.url)
+        if errors:
+            self.metrics.increment(WRITE_ERRORS, errors, site=self.site.url)
+
+    def record_hierarchy(self, url: str, key: str, hierarchy: str):
+        """Remember the hierarchy we wrote to a document key."""
+        with self.written_lock:
+            self.written_hierarchies[url] = hierarchy
+            self.written_keys[url].add(key)
+
+    def update_hierarchies(self):
+        """
+        Rewrite the hierarchy of documents whose parent pages we crawled
+        after we wrote the documents.
+
+        By the time the crawl finishes, `seen_urls` contains every page
+        title we're going to see, so we can rebuild each URL's hierarchy
+        and update only the documents whose hierarchy changed.
+        """
+        with self.redis.pipeline(transaction=False) as p:
+            for url, written in self.written_hierarchies.items():
+                hierarchy = json.dumps(self.url_hierarchy(url))
+                if hierarchy == written:
+                    continue
+                for key in self.written_keys[url]:
+                    p.hset(key, 'hierarchy', hierarchy)
+            p.execute()
 
     def add_synonyms(self):
         for synonym_group in self.site.synonym_groups:
@@ -356,6 +1251,14 @@ class Indexer:
                                               synonym_group.group_id,
                                               *synonym_group.synonyms)
 
+    def add_synonym_suggestions(self):
+        """Suggest each synonym we know for the site."""
+        with self.redis.pipeline(transaction=False) as p:
+            for synonym in self.site.all_synonyms:
+                p.execute_command(SUGADD_COMMAND, self.suggestions_key,
+                                  synonym, 1.0)
+            p.execute()
+
     def search_index_exists(self):
         try:
             self.search_client.info()
@@ -371,12 +1274,14 @@ class Indexer:
         If the indexer was given any synonym groups, it adds these
         to RediSearch after creating the index.
         """
-        definition = IndexDefinition(prefix=[self.keys.index_prefix(self.url)])
+        definition = IndexDefinition(
+            prefix=[self.keys.index_prefix(self.index_name)])
         self.search_client.create_index(self.site.schema,
                                         definition=definition)
 
         if self.site.synonym_groups:
             self.add_synonyms()
+            self.add_synonym_suggestions()
 
     def debounce(self):
         last_index = self.redis.get(self.keys.last_index(self.site.url))
@@ -389,12 +1294,13 @@ class Indexer:
     def clear_old_indexes(self):
         old_indexes = [
             i for i in self.redis.execute_command('FT._LIST')
-            if i.startswith(self.index_alias) and i != self.index_name
+            if i.startswith(f"{self.index_alias}-") and i != self.index_name
         ]
 
         log.debug("Dropping old indexes: %s", ", ".join(old_indexes))
         for idx in old_indexes:
-            self.redis.execute_command('FT.DROPINDEX', idx)
+            drop_index(self.redis, self.keys, idx)
+        delete_legacy_documents(self.redis, self.keys)
 
     def create_index_alias(self):
         """
@@ -409,35 +1315,90 @@ class Indexer:
                       self.index_alias, self.index_name)
             self.search_client.aliasadd(self.index_alias)
 
+        self.start_generation()
         self.clear_old_indexes()
 
-    def cleanup_urls(self):
+    def start_generation(self):
         """
-        Remove all Hashes for any URL that we previously indexed but is now
-        missing from the indexed site (because e.g., it was deleted from the
-        site).
+        Record that the alias now points to our generation of the index,
+        which invalidates the search results cached for the previous one.
+        """
+        previous = self.redis.getset(self.keys.index_generation(self.index_alias),
+                                     self.generation)
+        if not previous or previous == self.generation:
+            return
+        stale_keys = [self.keys.search_cache(self.index_alias, previous)]
+        if generation_index(previous) != self.index_name:
+            stale_keys.append(
+                self.keys.suggestions(self.index_alias,
+                                      generation_index(previous)))
+        self.redis.delete(*stale_keys)
+
+    def url_document_keys(self, urls: List[str]) -> List[Set[str]]:
+        """The keys of the documents in our index for each of the URLs."""
+        with self.redis.pipeline(transaction=False) as p:
+            for url in urls:
+                p.smembers(self.keys.url_documents(self.index_name, url))
+            return p.execute()
 
-        Without special handling for this situation, we will retain Hashes
-        for a URL in the search index even if that URL is removed from the
-        site we are indexing.
+    def remove_missing_documents(self):
+        """
+        Delete the documents of pages we parsed again that we neither
+        wrote nor found unchanged this time, e.g. the document for a
+        section whose H2 was removed from its page. Only an index we
+        update in place has these.
+        """
+        urls = list(self.written_keys)
+        with self.redis.pipeline(transaction=False) as p:
+            for url, doc_keys in zip(urls, self.url_document_keys(urls)):
+                missing = doc_keys - self.written_keys[url]
+                if missing:
+                    p.delete(*missing)
+                    p.srem(self.keys.url_documents(self.index_name, url),
+                           *missing)
+            p.execute()
 
-        To account for these stale URLs, we will keep a Set in Redis of all
-        the "current" indexed URLs for a site every time we index. Then, each
-        time we index the site, we'll take the difference of the Set of
-        current URLs and the Set of "new" URLs we just indexed. The result is
-        the Set of stale URLs, and we'll remove all Hashes for those URLs --
-        thus, we'll remove them from the search index, which follows Hashes.
+    def cleanup_urls(self):
+        """
+        Forget URLs that we previously indexed but that are now missing
+        from the indexed site (because e.g., it was deleted from the site).
+
+        A new index only has documents for the pages we just crawled, so a
+        stale URL drops out of search results as soon as we swap the alias.
+        But we keep a Set in Redis of all the "current" indexed URLs for a
+        site and cache what we last saw at each URL. Every time we index
+        the site, we take the difference of the Set of current URLs and the
+        Set of "new" URLs we just indexed. The result is the Set of stale
+        URLs, and we delete what we cached for them.
+
+        The current URLs are also every URL in the previous index, so we
+        delete its Sets of document keys as well. Dropping the previous
+        index already deleted the documents themselves.
+
+        If we updated the index in place, it still has the documents of
+        the stale URLs, so we delete those instead.
         """
         current_urls_key = self.keys.site_urls_current(self.index_alias)
         new_urls_key = self.keys.site_urls_new(self.index_alias)
-        old_urls = self.redis.sdiff(current_urls_key, new_urls_key)
+        stale_urls = list(self.redis.sdiff(current_urls_key, new_urls_key))
+        if self.in_place:
+            forgotten_urls = stale_urls
+            stale_keys = [
+                key for doc_keys in self.url_document_keys(stale_urls)
+                for key in doc_keys
+            ]
+            if stale_keys:
+                self.redis.delete(*stale_keys)
+        else:
+            forgotten_urls = self.redis.smembers(current_urls_key)
 
         with self.redis.pipeline(transaction=False) as p:
-            for url in old_urls:
-                # A URL can have multiple self.keys.if it had H2s, so here we scan
-                # through all of the URLs document self.keys.and delete them.
-                for doc_key in self.redis.scan_iter(self.keys.document(url, "*")):
-                    p.delete(doc_key)
+            PageCache(self.redis, self.keys,
+                      self.index_alias).delete(stale_urls, pipeline=p)
+            if self.previous_index:
+                for url in forgotten_urls:
+                    p.delete(
+                        self.keys.url_documents(self.previous_index, url))
             p.rename(new_urls_key, current_urls_key)
             p.execute()
 
@@ -445,9 +1406,10 @@ class Indexer:
         """
         Build the hierarchy of pages "above" this document.
 
-        At this point, we've already crawled all the URLs that we're going to
-        index, and we added the URLs and page titles to the `seen_urls`
-        dictionary.
+        As we crawl, we add the URLs and page titles we see to the `seen_urls`
+        dictionary. We usually crawl a page before the pages it links to, but
+        not always, so `update_hierarchies()` runs this again for every URL
+        once the crawl is over.
 
         Now, for this document, we're going to walk through the parts of its
         URL and reconstruct the page titles for those pages. We don't need
@@ -473,8 +1435,12 @@ class Indexer:
         trailing slash when we add a URL to `seen_urls` and then we remove
         any trailing slashes again when we look up a URL.
         """
+        return self.url_hierarchy(doc.url)
+
+    def url_hierarchy(self, doc_url: str) -> List[str]:
+        """Build the hierarchy of pages "above" a URL."""
         hierarchy = []
-        url = doc.url.replace(self.site.url, "").replace("//", "/").strip("/")
+        url = doc_url.replace(self.site.url, "").replace("//", "/").strip("/")
         parts = url.split("/")
         joinable_site_url = self.site.url.rstrip("/")
 
@@ -489,82 +1455,571 @@ class Indexer:
 
         return hierarchy
 
-    def index(self, force: bool = False):
-        if not force:
+    def see_document(self, item: Union[SearchDocument, CachedPage]) -> bool:
+        """
+        Record that we crawled an item's page. Returns whether to index
+        the item.
+        """
+        if isinstance(item, SearchDocument):
+            self.metrics.increment(DOCUMENTS_PARSED, site=self.site.url)
+        url_without_slash = item.url.rstrip("/")
+        # Don't index the root page. There is probably a better way to
+        # do this with Scrapy!
+        log.info(url_without_slash)
+        if url_without_slash == self.site.url.rstrip("/"):
+            return False
+        # A CachedPage only has a title if we indexed its page.
+        if item.title is None:
+            return False
+        self.seen_urls[url_without_slash] = item.title
+        self.checkpoint.saw_title(url_without_slash, item.title)
+        return True
+
+    def queue_document(self, item: Union[SearchDocument, CachedPage]):
+        """
+        Queue a SearchDocument, or a page an incremental crawl found
+        unchanged, for indexation.
+
+        The queue is bounded, so this blocks while the writer threads
+        catch up. Don't call it on the reactor thread -- see
+        queue_document_later().
+        """
+        if self.see_document(item):
+            self.docs_to_process.put(item)
+
+    def queue_document_later(self, item: Union[SearchDocument, CachedPage]
+                             ) -> Deferred:
+        """
+        Queue an item from the reactor thread, without blocking it.
+
+        If the queue is full, we wait for room in a thread and return a
+        Deferred that fires once we've queued the item. Scrapy stops
+        downloading pages while items wait in its pipeline, so the crawl
+        slows down to the writers' pace, and memory stays flat, while
+        the reactor keeps serving other crawls.
+        """
+        if not self.see_document(item):
+            return defer.succeed(None)
+        try:
+            self.docs_to_process.put_nowait(item)
+        except Full:
+            return threads.deferToThread(self.docs_to_process.put, item)
+        return defer.succeed(None)
+
+    def next_batch(self) -> List[Union[SearchDocument, CachedPage]]:
+        """
+        Wait for a document, then collect more until the batch is full
+        or WRITE_BATCH_SECONDS have passed.
+        """
+        batch = [self.docs_to_process.get()]
+        deadline = time.monotonic() + WRITE_BATCH_SECONDS
+
+        # None tells a writer to stop, so each writer takes at most one.
+        while len(batch) < WRITE_BATCH_SIZE and batch[-1] is not None:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
             try:
-                self.debounce()
-            except DebounceError as e:
-                log.error("Debounced indexing task: %s", e)
+                batch.append(self.docs_to_process.get(timeout=timeout))
+            except Empty:
+                break
+
+        return batch
+
+    def write_documents(self):
+        """Index batches of documents from the queue until stop_writers()."""
+        while True:
+            batch = self.next_batch()
+            stop = batch[-1] is None
+            if stop:
+                batch.pop()
+                self.docs_to_process.task_done()
+            if batch:
+                self.metrics.set(QUEUE_DEPTH, self.docs_to_process.qsize(),
+                                 site=self.site.url)
+                try:
+                    self.index_documents(batch)
+                except Exception as e:
+                    for item in batch:
+                        log.error(
+                            "Unexpected error while indexing %s, error: %s",
+                            getattr(item, 'doc_id', item.url), e)
+                    self.metrics.increment(WRITE_ERRORS, len(batch),
+                                           site=self.site.url)
+                for _ in batch:
+                    self.docs_to_process.task_done()
+            if stop:
                 return
-            if self.redis.exists(self.lock):
-                log.info("Skipping index due to presence of lock %s", self.lock)
+
+    def start_writers(self):
+        """Start the threads that write queued documents to Redis."""
+        for _ in range(MAX_THREADS):
+            writer = Thread(target=self.write_documents, daemon=True)
+            writer.start()
+            self.writers.append(writer)
+
+    def stop_writers(self):
+        """
+        Stop the writer threads once they've written every document we
+        queued, so that a long-running crawler process doesn't collect
+        idle threads from every crawl.
+        """
+        writers, self.writers = self.writers, []
+        for _ in writers:
+            self.docs_to_process.put(None)
+        for writer in writers:
+            writer.join()
+
+    def drain(self):
+        """Wait for the writers to write every document we queued."""
+        self.docs_to_process.join()
+        self.stop_writers()
+        self.metrics.set(QUEUE_DEPTH, 0, site=self.site.url)
+        self.metrics.flush()
+
+        if self.parse_pool is not None:
+            self.parse_pool.shutdown(wait=False)
+
+    def finish_indexing(self, complete_crawl: bool = True):
+        """
+        Wait for the writers to drain the queue, then make the new index
+        live.
+
+        If this was a `complete_crawl`, the next incremental crawl can skip
+        pages that haven't changed since this one started.
+        """
+        self.drain()
+
+        if not self.seen_urls:
+            self.finish_checkpoint()
+            if self.in_place:
+                # We found nothing, so leave the live index as it was.
                 return
+            # Don't keep around an empty search index.
+            self.redis.execute_command('FT.DROPINDEX', self.index_name, 'DD')
+            self.redis.delete(self.suggestions_key)
+            return
 
-        # Set a lock per URL while indexing.
-        self.redis.set(self.lock, 1, ex=INDEXING_LOCK_TIMEOUT)
+        self.update_hierarchies()
+        self.redis.set(self.keys.last_index(self.site.url),
+                       datetime.datetime.now().timestamp())
+        if complete_crawl:
+            self.redis.set(self.keys.last_complete_crawl(self.site.url),
+                           self.crawl_started.timestamp())
+        if self.in_place:
+            # Remove documents before we start the new generation, so that
+            # the search results we cache for it never include them.
+            self.remove_missing_documents()
+            self.cleanup_urls()
+            self.start_generation()
+        else:
+            self.create_index_alias()
+            # Forget the previous index's URLs only once ours is live, so
+            # that if swapping the alias fails, the next crawl can still
+            # copy documents from it.
+            self.cleanup_urls()
+        self.finish_checkpoint()
+        self.redis.delete(self.lock)
 
-        docs_to_process = Queue()
-        Spider = type(
+    def finish_shard(self, clock=None) -> Deferred:
+        """
+        Finish our shard of a distributed crawl. Once every other shard
+        has finished too, or stopped, the last of us makes the index live
+        with the pages all of them crawled.
+
+        We wait for our writers and for the other shards without holding
+        up the reactor -- see SharedFrontier.leave(), which we pass
+        `clock` to.
+        """
+        def drain():
+            self.drain()
+            # The last shard needs the titles we saw to build hierarchies.
+            self.checkpoint.save()
+
+        def finish_crawl(last: bool) -> Optional[Deferred]:
+            if not last:
+                log.info("Finished a shard of the crawl of %s", self.site.url)
+                return None
+            log.info("Finished the last shard of the crawl of %s",
+                     self.site.url)
+            return threads.deferToThread(self.finish_last_shard)
+
+        finished = threads.deferToThread(drain)
+        finished.addCallback(lambda _: self.frontier.leave(clock))
+        finished.addCallback(finish_crawl)
+        return finished
+
+    def finish_last_shard(self):
+        """Make the index live with the pages every shard crawled."""
+        self.load_crawl_progress()
+        self.frontier.clear()
+        self.finish_indexing()
+
+    def finish_checkpoint(self):
+        """Forget the checkpoint of our crawl, now that it's finished."""
+        if self.resuming is not None or self.checkpoint.index_name is not None:
+            self.checkpoint.clear(self.index_name)
+
+    def last_complete_crawl(self) -> Optional[datetime.datetime]:
+        """When the last crawl that finished indexing this site started."""
+        timestamp = self.redis.get(self.keys.last_complete_crawl(self.site.url))
+        if not timestamp:
+            return None
+        return datetime.datetime.fromtimestamp(float(timestamp),
+                                               datetime.timezone.utc)
+
+    def spider_type(self,
+                    page_cache: Optional[PageCache] = None,
+                    resume_requests: Optional[Dict[str, str]] = None,
+                    visited: AbstractSet[str] = frozenset(),
+                    frontier: Optional[SharedFrontier] = None):
+        """Build a spider class that crawls this indexer's site."""
+        return type(
             'Spider', (DocumentationSpiderBase, ), {
                 "url": self.url,
                 "validators": self.site.validators,
                 "allow": self.site.allow,
                 "allowed_domains": self.site.allowed_domains,
                 "deny": self.site.deny,
-                "content_classes": self.site.content_classes
+                "content_classes": self.site.content_classes,
+                "page_cache": page_cache,
+                "parse_pool": self.parse_pool,
+                "sitemap_urls": self.site.sitemap_urls,
+                "since": self.last_complete_crawl(),
+                "resume_requests": resume_requests,
+                "visited": visited,
+                "frontier": frontier,
+                "indexer": self
             })
 
-        def enqueue_document(signal, sender, item: SearchDocument, response,
-                             spider):
-            """Queue a SearchDocument for indexation."""
-            url_without_slash = item.url.rstrip("/")
-            # Don't index the root page. There is probably a better way to
-            # do this with Scrapy!
-            log.info(item.url.rstrip("/"))
-            if url_without_slash == self.site.url.rstrip("/"):
-                return
-            self.seen_urls[url_without_slash] = item.title
-            docs_to_process.put(item)
+    def lock_site(self, force: bool = False) -> bool:
+        """
+        Take the site's indexing lock. Returns whether we may index.
+
+        We only resume the site's unfinished crawl once we hold the lock,
+        because the run that holds it may still be crawling into that
+        crawl's index. A run we didn't force skips indexing if we indexed
+        the site too recently or another run holds the lock -- unless that
+        run stopped saving its progress, in which case we take over its
+        crawl. A forced run always indexes, and never resumes a crawl: it
+        builds a new index of its own.
+        """
+        if not force:
+            try:
+                self.debounce()
+            except DebounceError as e:
+                log.error("Debounced indexing task: %s", e)
+                return False
 
-        def index_documents():
-            while True:
-                doc: SearchDocument = docs_to_process.get()
-                try:
-                    self.index_document(doc)
-                except Exception as e:
-                    log.error(
-                        "Unexpected error while indexing doc %s, error: %s",
-                        doc.doc_id, e)
-                docs_to_process.task_done()
-
-        def start_indexing():
-            if docs_to_process.empty():
-                # Don't keep around an empty search index.
-                self.redis.execute_command('FT.DROPINDEX', self.index_name)
-                return
-            for _ in range(MAX_THREADS):
-                Thread(target=index_documents, daemon=True).start()
-            self.redis.set(self.keys.last_index(self.site.url),
-                           datetime.datetime.now().timestamp())
-            docs_to_process.join()
-            self.create_index_alias()
-            self.cleanup_urls()
-            self.redis.delete(self.lock)
-
-        dispatcher.connect(enqueue_document, signal=signals.item_scraped)
-        dispatcher.connect(start_indexing, signal=signals.engine_stopped)
-
-        process = CrawlerProcess(
-            settings={
-                'CONCURRENT_ITEMS': 200,
-                'CONCURRENT_REQUESTS': 100,
-                'CONCURRENT_REQUESTS_PER_DOMAIN': 100,
-                'HTTP_CACHE_ENABLED': True,
-                'REACTOR_THREADPOOL_MAXSIZE': 30,
-                'LOG_LEVEL': 'ERROR'
-            })
+        # Set a lock per URL while indexing.
+        if not self.redis.set(self.lock, 1, ex=INDEXING_LOCK_TIMEOUT, nx=True):
+            if not force and not self.crawl_abandoned():
+                log.info("Skipping index due to presence of lock %s",
+                         self.lock)
+                return False
+            self.redis.set(self.lock, 1, ex=INDEXING_LOCK_TIMEOUT)
+
+        if force and self.resuming is not None:
+            self.start_over()
+        return True
+
+    def start_crawl(self) -> Tuple[Optional[Dict[str, str]], AbstractSet[str]]:
+        """
+        Start a checkpoint for the crawl we hold the site's lock for.
+
+        If we're resuming a crawl, returns the requests it didn't finish
+        and the URLs it visited -- see resume().
+        """
+        resume_requests = None
+        visited: AbstractSet[str] = frozenset()
+        if self.resuming is not None:
+            resume_requests, visited = self.resume()
+        else:
+            # Forget the URLs indexed by any crawl we couldn't resume.
+            self.redis.delete(self.keys.site_urls_new(self.index_alias))
+        self.checkpoint.start(self.index_name, self.generation, self.in_place,
+                              self.crawl_started.timestamp())
+        return resume_requests, visited
+
+    def build_spider(self, archive: Optional[CrawlArchive] = None, **kwargs):
+        """
+        Set up to crawl the way the app is configured to, and build a
+        spider class that crawls that way. We pass `kwargs` on to
+        spider_type().
+        """
+        page_cache = None
+        if archive is not None:
+            # An archive needs the body of every page, so we can't skip
+            # pages that haven't changed.
+            log.info("Recording a crawl archive, so crawling every page")
+        elif self.app_config.incremental_crawl:
+            if self.previous_index and has_own_documents(
+                    self.redis, self.keys, self.previous_index):
+                page_cache = PageCache(self.redis, self.keys, self.index_alias)
+            else:
+                # We skip unchanged pages by copying their documents from
+                # the previous index, so we need one with its own documents.
+                log.info("No previous index to copy pages from, so crawling "
+                         "every page")
+
+        if self.app_config.parse_in_process_pool:
+            # Use a fork server so that parser processes don't inherit the
+            # state of our writer threads.
+            self.parse_pool = ProcessPoolExecutor(
+                max_workers=multiprocessing.cpu_count(),
+                mp_context=multiprocessing.get_context('forkserver'))
+
+        return self.spider_type(page_cache, **kwargs)
+
+    def save_progress(self) -> Deferred:
+        """
+        Save our crawl's checkpoint and hold on to the site's lock, in a
+        thread, so that we don't hold up the reactor's other crawls.
+        """
+        def save():
+            self.checkpoint.save()
+            self.redis.expire(self.lock, INDEXING_LOCK_TIMEOUT)
+
+        saved = threads.deferToThread(save)
+        # Keep saving, so that a Redis hiccup doesn't make a live crawl
+        # look abandoned.
+        saved.addErrback(
+            lambda failure: log.error("Could not save crawl progress: %s",
+                                      failure.value))
+        return saved
+
+    def run_crawler(self,
+                    Spider,
+                    handlers: List[Tuple[object, Callable]],
+                    finish: Callable[[], Deferred],
+                    runner: Optional[CrawlerRunner] = None
+                    ) -> Optional[Deferred]:
+        """
+        Crawl with a spider class, whose DocumentPipeline queues the
+        documents it scrapes, and
+        call `finish` when the crawl is over. We connect `handlers`, pairs
+        of a signal and a function, to the crawler's signals.
+
+        `finish` runs on the reactor thread and returns a Deferred, so it
+        should do its waiting in threads. Until that Deferred fires, we
+        save the crawl's progress every checkpoint interval, so that no
+        other run takes the crawl over while we're still finishing it.
+
+        Without a `runner`, we run a reactor until we're done. Given a
+        CrawlerRunner whose reactor is already running, like the crawler
+        service's, we return a Deferred that fires once we're done.
+        Cancelling that Deferred stops the crawl without finishing it:
+        we save its progress, and a later run takes it over once it's
+        abandoned.
+        """
+        def count_response(signal, sender, response, request, spider):
+            self.metrics.increment(PAGES_FETCHED, site=self.site.url)
+
+        handlers = [(signals.response_received, count_response), *handlers]
+
+        # Writers drain documents while we crawl, rather than waiting
+        # for the crawl to finish.
+        self.start_writers()
 
         log.info("Started crawling")
 
-        process.crawl(Spider)
-        process.start()
+        saving = task.LoopingCall(self.save_progress)
+
+        def stop_saving(result):
+            if saving.running:
+                saving.stop()
+            return result
+
+        def finish_crawl():
+            return finish().addBoth(stop_saving)
+
+        if runner is None:
+            process = CrawlerProcess(settings=CRAWLER_SETTINGS)
+            crawler = process.create_crawler(Spider)
+            # Scrapy waits for the Deferred we return before it stops.
+            handlers.append((signals.engine_stopped, finish_crawl))
+        else:
+            crawler = runner.create_crawler(Spider)
+
+        # Connect to this crawler's signals only, because other crawls
+        # may share our process. Our handlers are closures, so we keep
+        # strong references to them.
+        for signal, handler in handlers:
+            crawler.signals.connect(handler, signal=signal, weak=False)
+
+        saving.start(self.checkpoint.interval, now=False)
+
+        if runner is None:
+            process.crawl(crawler)
+            process.start()
+            return None
+
+        def stop_crawl(_):
+            log.info("Stopping the crawl of %s", self.site.url)
+            stop_saving(None)
+            crawler.stop()
+
+        def save_crawl():
+            self.drain()
+            self.checkpoint.save()
+
+        def finish_unless_stopped(_):
+            # A cancelled Deferred has already fired.
+            if crawled.called:
+                return threads.deferToThread(save_crawl)
+            return finish()
+
+        crawled = Deferred(canceller=stop_crawl)
+        crawl = runner.crawl(crawler)
+        crawl.addCallback(finish_unless_stopped)
+        crawl.addBoth(stop_saving)
+        crawl.chainDeferred(crawled)
+        return crawled
+
+    def index(self,
+              force: bool = False,
+              archive: Optional[CrawlArchive] = None,
+              runner: Optional[CrawlerRunner] = None) -> Optional[Deferred]:
+        """
+        Crawl the site and index it.
+
+        If given an `archive`, we record every page we fetch to it, so
+        that `replay()` can index the site again without crawling it.
+
+        If given a `runner`, we crawl on its running reactor and return a
+        Deferred -- see run_crawler().
+        """
+        Spider = self.prepare_crawl(force, archive)
+        if Spider is None:
+            return None
+        return self.crawl_site(Spider, archive, runner)
+
+    def prepare_crawl(self,
+                      force: bool = False,
+                      archive: Optional[CrawlArchive] = None):
+        """
+        Lock the site and build the spider class for a crawl of it,
+        resuming the last crawl if it didn't finish. Returns None if
+        another run is crawling the site.
+
+        This only talks to Redis, so the crawler service calls it in a
+        thread rather than on its reactor.
+        """
+        if not self.lock_site(force):
+            return None
+
+        resume_requests, visited = self.start_crawl()
+        return self.build_spider(archive,
+                                 resume_requests=resume_requests,
+                                 visited=visited)
+
+    def crawl_site(self,
+                   Spider,
+                   archive: Optional[CrawlArchive] = None,
+                   runner: Optional[CrawlerRunner] = None
+                   ) -> Optional[Deferred]:
+        """
+        Crawl with a spider class from prepare_crawl(), then make the new
+        index live. Given a `runner`, this runs on its reactor thread.
+        """
+        def record_request(signal, sender, request, spider):
+            self.checkpoint.requested(
+                request.url, getattr(request.callback, '__name__', 'parse'))
+
+        def record_response(signal, sender, response, request, spider):
+            if isinstance(response, HtmlResponse) and response.status == 200:
+                archive.record(response)
+
+        def finish_indexing():
+            if archive is not None:
+                archive.close()
+            return threads.deferToThread(self.finish_indexing)
+
+        handlers: List[Tuple[object, Callable]] = [
+            (signals.request_scheduled, record_request)]
+        if archive is not None:
+            archive.open()
+            handlers.append((signals.response_received, record_response))
+
+        return self.run_crawler(Spider, handlers, finish_indexing, runner)
+
+    def start_distributed_crawl(self, shards: int, force: bool = False) -> bool:
+        """
+        Start a crawl of the site that `shards` crawler processes share,
+        each of which runs crawl_shard(). Returns whether we started it.
+
+        We create the index the shards write to and put the URLs to start
+        crawling from on the shared frontier. If we're resuming a crawl,
+        we start from the requests it didn't finish.
+        """
+        if not self.lock_site(force):
+            return False
+
+        resume_requests, _ = self.start_crawl()
+        if resume_requests is None:
+            resume_requests = {
+                url: 'parse_sitemap'
+                for url in self.site.sitemap_urls
+            } or {
+                self.url: 'parse'
+            }
+        self.frontier.start(shards, resume_requests)
+        log.info("Started a crawl of %s with %s shards", self.site.url, shards)
+        return True
+
+    def crawl_shard(self, shard: int, runner: Optional[CrawlerRunner] = None
+                    ) -> Optional[Deferred]:
+        """
+        Crawl the site as shard number `shard` of the crawl that
+        start_distributed_crawl() started, writing to the same index as
+        every other shard.
+
+        When our crawler runs out of URLs, we claim more from the shared
+        frontier. We only stop once no shard has URLs left to request,
+        since any of them might still find links for us to follow.
+        """
+        if not self.frontier.join(shard):
+            log.info("The crawl of %s went on without shard %s",
+                     self.site.url, shard)
+            return None
+        self.checkpoint.join(self.index_name)
+        Spider = self.build_spider(frontier=self.frontier)
+
+        def finish_request(signal, sender, request, spider):
+            self.frontier.done(request.url)
+            self.frontier.heartbeat()
+
+        def claim_requests(signal, sender, spider):
+            self.frontier.heartbeat()
+            # We're idle, so we aren't requesting any URL we claimed.
+            self.frontier.release()
+            requests = list(spider.claim_requests())
+            for request in requests:
+                spider.crawler.engine.crawl(request, spider)
+            if requests or not self.frontier.finished():
+                raise DontCloseSpider
+
+        handlers: List[Tuple[object, Callable]] = [
+            (signals.request_left_downloader, finish_request),
+            (signals.spider_idle, claim_requests)]
+        return self.run_crawler(Spider, handlers, self.finish_shard, runner)
+
+    def replay(self, archive: CrawlArchive):
+        """
+        Index the site from the pages recorded in a crawl archive,
+        instead of crawling the site.
+        """
+        self.redis.set(self.lock, 1, ex=INDEXING_LOCK_TIMEOUT)
+        spider = self.spider_type()()
+        self.start_writers()
+
+        log.info("Started replaying %s", archive.path)
+
+        for response in archive:
+            for item in spider.parse(response):
+                if isinstance(item, SearchDocument):
+                    self.queue_document(item)
+
+        # The pages in the archive are only as fresh as the crawl that
+        # recorded them, so this doesn't count as a complete crawl.
+        self.finish_indexing(complete_crawl=False)
@@ -0,0 +1,16 @@
+# These constants are used by other modules to refer to the
+# state of the `index` task in the queueing/scheduling system.
+#
+# They live apart from sitesearch.tasks so that the API can enqueue
+# and inspect jobs without importing the indexer, and with it Scrapy,
+# into every web process. The API enqueues the task by its name.
+INDEX_TASK = 'sitesearch.tasks.index'
+DISTRIBUTED_INDEX_TASK = 'sitesearch.tasks.index_distributed'
+CRAWL_SHARD_TASK = 'sitesearch.tasks.crawl_shard'
+JOB_NOT_QUEUED = 'not_queued'
+JOB_QUEUED = 'queued'
+JOB_STARTED = 'started'
+INDEXING_TIMEOUT = 60*60  # One hour
+# The queue the crawler service takes `index` jobs from, instead of RQ
+# workers.
+CRAWLER_QUEUE = 'crawler'
@@ -4,19 +4,26 @@ class Keys:
     def __init__(self, prefix: str):
         self.prefix = prefix
 
-    def document(self, url: str, doc_id: str) -> str:
-        """The key used for a single document in the index.
+    def document(self, index_name: str, doc_id: str) -> str:
+        """The key used for a single document in an index.
 
         This key ends with an ID because each URL might have several
         documents in the index, one for the page as a whole and one
         per H2 we scraped (if there were H2 elements on the page).
+
+        Every generation of a site's index has its own documents, under
+        the index's prefix.
         """
-        return f"{self.prefix}:{url}:doc:{doc_id}"
+        return f"{self.index_prefix(index_name)}{doc_id}"
 
     def last_index(self, url: str) -> str:
         """The last time we indexed a URL."""
         return f"{self.prefix}:{url}:last_indexing_time"
 
+    def last_complete_crawl(self, url: str) -> str:
+        """When the last crawl that finished indexing a URL started."""
+        return f"{self.prefix}:{url}:last_complete_crawl_time"
+
     def index_alias(self, url: str) -> str:
         """The index alias we use for a URL."""
         return f"{self.prefix}:{url}"
@@ -25,13 +32,24 @@ class Keys:
         """A simple lock taken while indexing."""
         return f"{self.prefix}:{url}:lock"
 
-    def index_prefix(self, url: str) -> str:
+    def index_prefix(self, index_name: str) -> str:
         """The prefix we use for a RediSearch index.
 
         This becomes part of the index definition and controls which
-        documents (Hashes) RediSearch will index.
+        documents (Hashes) RediSearch will index. Each index gets its own
+        prefix, so that a new index doesn't index the documents of the
+        index it replaces, and vice versa.
         """
-        return f"{self.prefix}:{url}"
+        return f"{index_name}:doc:"
+
+    def legacy_prefixes(self) -> str:
+        """A Set of the prefixes of the legacy indexes we dropped.
+
+        Before each index had its own prefix, a site's index indexed
+        every document under the site's prefix. We keep the prefixes of
+        those indexes here until we've deleted their documents.
+        """
+        return f"{self.prefix}:legacy_index_prefixes"
 
     def startup_indexing_job_ids(self) -> str:
         """A Set containing the startup indexing task IDs.
@@ -51,3 +69,90 @@ class Keys:
         indexed from a site in the past but that are no longer on the site.
         """
         return f"{self.prefix}:{index_alias}:{{urls}}:new"
+
+    def url_documents(self, index_name: str, url: str) -> str:
+        """All the document keys we have written for a URL in an index.
+
+        A URL has one document for the page and one per H2, so when an
+        incremental crawl finds a page unchanged, we use this Set to find
+        every document to copy into the next index.
+        """
+        return f"{self.prefix}:{index_name}:{{urls}}:docs:{url}"
+
+    def page_cache(self, index_alias: str, url: str) -> str:
+        """What we saw the last time we crawled a URL.
+
+        Incremental crawls use this to send conditional requests and to
+        skip pages whose content hasn't changed.
+        """
+        return f"{self.prefix}:{index_alias}:{{urls}}:cache:{url}"
+
+    def crawl_checkpoint(self, index_alias: str) -> str:
+        """The crawl of a site that hasn't finished yet.
+
+        This Hash holds the index the crawl builds, when it started and
+        when it last saved its progress.
+        """
+        return f"{self.prefix}:{index_alias}:checkpoint"
+
+    def crawl_requests(self, index_name: str) -> str:
+        """All the URLs an unfinished crawl requested.
+
+        This Hash maps each URL to the name of its spider callback.
+        """
+        return f"{self.prefix}:{index_name}:{{urls}}:requested"
+
+    def crawl_parsed(self, index_name: str) -> str:
+        """A Set of the pages an unfinished crawl parsed.
+
+        We only add a page once we've saved the links it led to in
+        crawl_requests().
+        """
+        return f"{self.prefix}:{index_name}:{{urls}}:parsed"
+
+    def crawl_titles(self, index_name: str) -> str:
+        """A Hash of the titles of the pages an unfinished crawl saw."""
+        return f"{self.prefix}:{index_name}:{{urls}}:titles"
+
+    def crawl_frontier(self, index_name: str) -> str:
+        """A List of the URLs a distributed crawl has yet to request."""
+        return f"{self.prefix}:{index_name}:{{urls}}:frontier"
+
+    def crawl_claims(self, index_name: str) -> str:
+        """The URLs the shards of a distributed crawl are requesting.
+
+        This Sorted Set scores each URL by when a shard claimed it.
+        """
+        return f"{self.prefix}:{index_name}:{{urls}}:claims"
+
+    def crawl_shards(self, index_name: str) -> str:
+        """The shards of a distributed crawl that are still crawling.
+
+        This Sorted Set scores each shard by when it last reported in.
+        """
+        return f"{self.prefix}:{index_name}:{{urls}}:shards"
+
+    def index_generation(self, index_alias: str) -> str:
+        """The generation of the index an alias currently points to.
+
+        Every indexing run creates a new index, or updates the index in
+        place -- a new generation of the site's search results -- so we
+        cache search results per generation. See generation_index().
+        """
+        return f"{self.prefix}:{index_alias}:generation"
+
+    def search_cache(self, index_alias: str, generation: str) -> str:
+        """A Hash of search results for one generation of an index."""
+        return f"{self.prefix}:{index_alias}:search_cache:{generation}"
+
+    def suggestions(self, index_alias: str, index_name: str) -> str:
+        """The autocomplete suggestions for one of a site's indexes."""
+        return f"{self.prefix}:{index_alias}:suggestions:{index_name}"
+
+    def metrics(self) -> str:
+        """A Hash of the metrics that every API worker and indexer records."""
+        return f"{self.prefix}:metrics"
+
+    def query_log(self) -> str:
+        """A List of sampled searches, newest first, for load tests to replay."""
+        return f"{self.prefix}:query_log"
@@ -0,0 +1,220 @@
+import logging
+import re
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from threading import Lock
+from typing import Dict, Iterator, List, Mapping, NamedTuple, Tuple
+
+import redis.exceptions
+from redis import Redis
+
+from sitesearch.keys import Keys
+
+log = logging.getLogger(__name__)
+
+COUNTER = 'counter'
+GAUGE = 'gauge'
+HISTOGRAM = 'histogram'
+
+# The upper bounds, in seconds, of the histogram buckets we count
+# observations in.
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+           1.0, 2.5, 5.0, 10.0)
+
+# How often each process sends what it has recorded to Redis. Recording
+# a metric only touches memory; a process sends everything it recorded
+# in the meantime in one pipeline.
+FLUSH_INTERVAL = 1.0
+
+# The content type of the Prometheus text format.
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+LABEL_RE = re.compile(r'(\w+)="((?:[^"\\]|\\.)*)"')
+
+# A command to send to Redis, the field of the metrics Hash it changes,
+# and the amount or value.
+Update = Tuple[str, str, float]
+
+
+class Metric(NamedTuple):
+    name: str
+    type: str
+    help: str
+
+
+SEARCH_STAGE_SECONDS = Metric(
+    'sitesearch_search_stage_seconds', HISTOGRAM,
+    'Time spent in each stage of a search: parsing the request (params), '
+    'parsing the query (parse), running FT.SEARCH (search) or a batch of '
+    'them (batch_search), transforming the results (transform) and '
+    'encoding the response (encode).')
+SEARCH_CACHE_HITS = Metric('sitesearch_search_cache_hits_total', COUNTER,
+                           'Searches answered from the result cache.')
+SEARCH_COALESCED = Metric(
+    'sitesearch_search_coalesced_total', COUNTER,
+    'Searches that shared the results of the same search already in flight.')
+PAGES_FETCHED = Metric('sitesearch_indexer_pages_fetched_total', COUNTER,
+                       'Pages the crawler fetched.')
+DOCUMENTS_PARSED = Metric('sitesearch_indexer_documents_parsed_total',
+                          COUNTER, 'Documents the indexer parsed from pages.')
+DOCUMENTS_WRITTEN = Metric('sitesearch_indexer_documents_written_total',
+                           COUNTER, 'Documents the indexer wrote to Redis.')
+DOCUMENTS_UNCHANGED = Metric(
+    'sitesearch_indexer_documents_unchanged_total', COUNTER,
+    'Documents an in-place update left alone because they had not changed.')
+DOCUMENTS_COPIED = Metric(
+    'sitesearch_indexer_documents_copied_total', COUNTER,
+    'Documents of unchanged pages an incremental crawl copied from the '
+    'previous index into a new one.')
+WRITE_ERRORS = Metric('sitesearch_indexer_write_errors_total', COUNTER,
+                      'Documents the indexer failed to write to Redis.')
+QUEUE_DEPTH = Metric('sitesearch_indexer_queue_depth', GAUGE,
+                     'Documents waiting for a writer thread.')
+
+METRICS = (SEARCH_STAGE_SECONDS, SEARCH_CACHE_HITS, SEARCH_COALESCED,
+           PAGES_FETCHED, DOCUMENTS_PARSED, DOCUMENTS_WRITTEN,
+           DOCUMENTS_UNCHANGED, DOCUMENTS_COPIED, WRITE_ERRORS, QUEUE_DEPTH)
+
+
+def escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def sample(name: str, **labels) -> str:
+    """The name of a sample in the Prometheus text format."""
+    if not labels:
+        return name
+    pairs = ','.join(f'{label}="{escape(str(value))}"'
+                     for label, value in sorted(labels.items()))
+    return f'{name}{{{pairs}}}'
+
+
+class Metrics:
+    """
+    Counters, gauges and histograms that every process records into the
+    same Redis Hash, so that /metrics can report them for every API
+    worker and indexer at once.
+
+    Each field of the Hash is a sample in the Prometheus text format,
+    e.g. `sitesearch_search_cache_hits_total` or
+    `sitesearch_search_stage_seconds_bucket{le="0.005",stage="parse"}`.
+    Histogram buckets are cumulative, as Prometheus expects.
+    """
+    def __init__(self, redis_client: Redis, keys: Keys,
+                 flush_interval: float = FLUSH_INTERVAL,
+                 autoflush: bool = True):
+        self.redis = redis_client
+        self.keys = keys
+        self.flush_interval = flush_interval
+        self.autoflush = autoflush
+        self.lock = Lock()
+        self.counts: Dict[str, int] = defaultdict(int)
+        self.sums: Dict[str, float] = defaultdict(float)
+        self.gauges: Dict[str, float] = {}
+        self.next_flush = time.monotonic() + flush_interval
+
+    def increment(self, metric: Metric, amount: int = 1, **labels):
+        with self.lock:
+            self.counts[sample(metric.name, **labels)] += amount
+        self.maybe_flush()
+
+    def set(self, metric: Metric, value: float, **labels):
+        with self.lock:
+            self.gauges[sample(metric.name, **labels)] = value
+        self.maybe_flush()
+
+    def observe(self, metric: Metric, value: float, **labels):
+        """Count a value, e.g. a duration in seconds, in a histogram."""
+        with self.lock:
+            # Count zeros too, so that every bucket has a sample.
+            for bound in BUCKETS:
+                self.counts[sample(f'{metric.name}_bucket',
+                                   le=str(bound),
+                                   **labels)] += int(value <= bound)
+            self.counts[sample(f'{metric.name}_bucket', le='+Inf',
+                               **labels)] += 1
+            self.counts[sample(f'{metric.name}_count', **labels)] += 1
+            self.sums[sample(f'{metric.name}_sum', **labels)] += value
+        self.maybe_flush()
+
+    @contextmanager
+    def time(self, metric: Metric, **labels) -> Iterator[None]:
+        """Observe how long the body of a `with` block takes."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(metric, time.perf_counter() - start, **labels)
+
+    def flush_due(self) -> bool:
+        return time.monotonic() >= self.next_flush
+
+    def maybe_flush(self):
+        if self.autoflush and self.flush_due():
+            self.flush()
+
+    def drain(self) -> List[Update]:
+        """Take everything we've recorded since the last flush."""
+        with self.lock:
+            updates: List[Update] = [
+                ('hincrby', field, count) for field, count in self.counts.items()
+            ]
+            updates += [('hincrbyfloat', field, total)
+                        for field, total in self.sums.items()]
+            updates += [('hset', field, value)
+                        for field, value in self.gauges.items()]
+            self.counts.clear()
+            self.sums.clear()
+            self.gauges.clear()
+            self.next_flush = time.monotonic() + self.flush_interval
+        return updates
+
+    def flush(self):
+        """Send everything we've recorded since the last flush to Redis."""
+        updates = self.drain()
+        if not updates:
+            return
+        key = self.keys.metrics()
+        pipeline = self.redis.pipeline(transaction=False)
+        for command, field, value in updates:
+            getattr(pipeline, command)(key, field, value)
+        try:
+            pipeline.execute()
+        except redis.exceptions.RedisError as e:
+            # Metrics should never cost us a search or a crawl.
+            log.error("Could not record metrics: %s", e)
+
+
+def sort_key(field: str):
+    """Order a metric's samples by labels, with buckets in increasing order."""
+    name = field.split('{', 1)[0]
+    labels = dict(LABEL_RE.findall(field))
+    le = labels.pop('le', None)
+    bound = float(le) if le is not None else float('inf')
+    suffix_order = 0 if name.endswith('_bucket') else 1
+    return sorted(labels.items()), suffix_order, name, bound
+
+
+def render(values: Mapping[str, str]) -> str:
+    """Render the samples in the metrics Hash in the Prometheus text format."""
+    samples: Dict[str, List[str]] = defaultdict(list)
+    for field in values:
+        samples[field.split('{', 1)[0]].append(field)
+
+    lines = []
+    for metric in METRICS:
+        if metric.type == HISTOGRAM:
+            names = [
+                f'{metric.name}_bucket', f'{metric.name}_sum',
+                f'{metric.name}_count'
+            ]
+        else:
+            names = [metric.name]
+        fields = [field for name in names for field in samples[name]]
+        lines.append(f'# HELP {metric.name} {metric.help}')
+        lines.append(f'# TYPE {metric.name} {metric.type}')
+        for field in sorted(fields, key=sort_key):
+            lines.append(f'{field} {values[field]}')
+
+    return '\n'.join(lines) + '\n'
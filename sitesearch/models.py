@@ -1,5 +1,5 @@
-from dataclasses import dataclass, replace
-from typing import Dict, List, Set, Tuple, Callable, Pattern
+from dataclasses import dataclass, field, replace
+from typing import Dict, List, Optional, Set, Tuple, Callable, Pattern
 
 from redisearch.client import Field
 
@@ -20,6 +20,17 @@ class SearchDocument:
     position: int = 0
 
 
+@dataclass(frozen=True)
+class CachedPage:
+    """What we saw the last time we crawled a page."""
+    url: str
+    body_hash: str
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+    title: Optional[str] = None  # Only set if we indexed the page.
+    links: List[str] = field(default_factory=list)
+
+
 @dataclass(frozen=True)
 class SynonymGroup:
     group_id: str
@@ -42,6 +53,13 @@ class SiteConfiguration:
     deny: Tuple[Pattern]
     allowed_domains: Tuple[str]
     content_classes: Tuple[str] = None
+    # If given, we find the site's pages in these sitemaps instead of
+    # following links.
+    sitemap_urls: Tuple[str, ...] = ()
+    # The Cache-Control header of search responses. Results only change
+    # when we index the site again, and clients and CDNs can revalidate
+    # them with the ETag we send, so they can keep them for a while.
+    cache_control: Optional[str] = "public, max-age=60"
 
     @property
     def all_synonyms(self) -> Set[str]:
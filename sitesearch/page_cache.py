@@ -0,0 +1,53 @@
+import json
+from typing import Iterable, Optional
+
+from redis import Redis
+from redis.client import Pipeline
+
+from sitesearch.keys import Keys
+from sitesearch.models import CachedPage
+
+
+class PageCache:
+    """
+    PageCache stores what we saw the last time we crawled each page of
+    a site: the page's ETag and Last-Modified headers, a hash of its body,
+    its title, and the links on it.
+
+    Incremental crawls use the headers to send conditional requests and
+    the hash to detect unchanged pages when a server ignores them. The
+    title and links let us treat an unchanged page as if we had crawled
+    it, without parsing it again.
+    """
+    def __init__(self, redis_client: Redis, keys: Keys, index_alias: str):
+        self.redis = redis_client
+        self.keys = keys
+        self.index_alias = index_alias
+
+    def get(self, url: str) -> Optional[CachedPage]:
+        data = self.redis.hgetall(self.keys.page_cache(self.index_alias, url))
+        if not data:
+            return None
+        return CachedPage(url=url,
+                          body_hash=data['body_hash'],
+                          etag=data.get('etag') or None,
+                          last_modified=data.get('last_modified') or None,
+                          title=data.get('title') or None,
+                          links=json.loads(data.get('links', '[]')))
+
+    def set(self, page: CachedPage):
+        self.redis.hset(self.keys.page_cache(self.index_alias, page.url),
+                        mapping={
+                            'body_hash': page.body_hash,
+                            'etag': page.etag or '',
+                            'last_modified': page.last_modified or '',
+                            'title': page.title or '',
+                            'links': json.dumps(page.links)
+                        })
+
+    def delete(self, urls: Iterable[str], pipeline: Optional[Pipeline] = None):
+        """Forget the pages at `urls`, e.g. because they left the site."""
+        client = self.redis if pipeline is None else pipeline
+        keys = [self.keys.page_cache(self.index_alias, url) for url in urls]
+        if keys:
+            client.delete(*keys)
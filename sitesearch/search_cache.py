@@ -0,0 +1,173 @@
+import json
+from collections import OrderedDict
+from threading import Lock
+from typing import (Any, Callable, Hashable, List, Optional, Sequence, Tuple,
+                    TypeVar)
+
+from redis import Redis
+
+from sitesearch.keys import Keys
+
+# How long we keep a generation's results in Redis. Results never go
+# stale within a generation; this only bounds memory if a generation
+# lives a long time and sees many different queries.
+REDIS_CACHE_TTL = 60 * 60 * 24
+
+# An index alias, generation and search parameters.
+CacheEntry = Tuple[str, str, Sequence[Hashable]]
+
+T = TypeVar('T')
+# Calls a function with a server to read from, like SharedConnections.read().
+Reader = Callable[[Callable[[Any], T]], T]
+
+# A generation is usually the name of an index. When the indexer updates
+# an index in place, it starts a new generation of the same index, named
+# e.g. "<index name>@1620000000.0".
+GENERATION_SEPARATOR = '@'
+
+
+def generation_index(generation: str) -> str:
+    """The name of the index a generation's search results come from."""
+    return generation.split(GENERATION_SEPARATOR, 1)[0]
+
+
+class LRUCache:
+    """A thread-safe, in-memory cache that evicts the least recently used item."""
+    def __init__(self, size: int):
+        self.size = size
+        self.items: OrderedDict = OrderedDict()
+        self.lock = Lock()
+
+    def get(self, key: Hashable) -> Optional[str]:
+        with self.lock:
+            value = self.items.get(key)
+            if value is not None:
+                self.items.move_to_end(key)
+            return value
+
+    def set(self, key: Hashable, value: str):
+        if self.size <= 0:
+            return
+        with self.lock:
+            self.items[key] = value
+            self.items.move_to_end(key)
+            while len(self.items) > self.size:
+                self.items.popitem(last=False)
+
+
+class SearchCache:
+    """
+    SearchCache holds the JSON responses of searches, in memory in each
+    API process and in a Redis Hash that all processes share.
+
+    Every indexing run builds a new index and points the site's alias at
+    it, or updates the index in place. We call each version of the index
+    a generation and cache results per generation, so when the indexer
+    swaps the alias or finishes updating the index, every cached result
+    for the old generation becomes unreachable at once.
+
+    We write to `redis_client`. If given a `read` function, we read
+    through it instead, e.g. from read replicas.
+    """
+    def __init__(self, redis_client: Redis, keys: Keys, size: int,
+                 read: Optional[Reader] = None):
+        self.redis = redis_client
+        self.keys = keys
+        self.local = LRUCache(size)
+        self.reader = read
+
+    def read(self, fn: Callable[[Redis], T]) -> T:
+        if self.reader is None:
+            return fn(self.redis)
+        return self.reader(lambda server: fn(server.redis))
+
+    def generation(self, index_alias: str) -> Optional[str]:
+        """The index the alias points to, if an indexer recorded it."""
+        key = self.keys.index_generation(index_alias)
+        return self.read(lambda redis: redis.get(key))
+
+    def generations(self, index_aliases: Sequence[str]) -> List[Optional[str]]:
+        """The generations of several aliases, in one round trip."""
+        if not index_aliases:
+            return []
+        keys = [self.keys.index_generation(alias) for alias in index_aliases]
+        return self.read(lambda redis: redis.mget(keys))
+
+    def get(self, index_alias: str, generation: str,
+            params: Sequence[Hashable]) -> Optional[str]:
+        return self.get_many([(index_alias, generation, params)])[0]
+
+    def get_many(self, entries: Sequence[CacheEntry]) -> List[Optional[str]]:
+        """
+        Get the cached results for several searches, from memory if we
+        can and otherwise from Redis in one round trip.
+        """
+        bodies = [self.local.get((alias, generation, *params))
+                  for alias, generation, params in entries]
+        misses = [i for i, body in enumerate(bodies) if body is None]
+        if not misses:
+            return bodies
+
+        def get(redis):
+            pipeline = redis.pipeline(transaction=False)
+            for i in misses:
+                alias, generation, params = entries[i]
+                pipeline.hget(self.keys.search_cache(alias, generation),
+                              json.dumps(params))
+            return pipeline.execute()
+
+        for i, body in zip(misses, self.read(get)):
+            if body is not None:
+                alias, generation, params = entries[i]
+                self.local.set((alias, generation, *params), body)
+                bodies[i] = body
+        return bodies
+
+    def set(self, index_alias: str, generation: str,
+            params: Sequence[Hashable], body: str):
+        self.set_many([(index_alias, generation, params, body)])
+
+    def set_many(self, entries: Sequence[Tuple[str, str, Sequence[Hashable],
+                                               str]]):
+        if not entries:
+            return
+        pipeline = self.redis.pipeline(transaction=False)
+        for alias, generation, params, body in entries:
+            self.local.set((alias, generation, *params), body)
+            key = self.keys.search_cache(alias, generation)
+            pipeline.hset(key, json.dumps(params), body)
+            pipeline.expire(key, REDIS_CACHE_TTL)
+        pipeline.execute()
+
+
+class AsyncSearchCache:
+    """A SearchCache for an aioredis client, for the ASGI app."""
+    def __init__(self, redis_client, keys: Keys, size: int):
+        self.redis = redis_client
+        self.keys = keys
+        self.local = LRUCache(size)
+
+    async def generation(self, index_alias: str) -> Optional[str]:
+        return await self.redis.get(self.keys.index_generation(index_alias))
+
+    async def get(self, index_alias: str, generation: str,
+                  params: Sequence[Hashable]) -> Optional[str]:
+        local_key = (index_alias, generation, *params)
+        body = self.local.get(local_key)
+        if body is not None:
+            return body
+
+        body = await self.redis.hget(
+            self.keys.search_cache(index_alias, generation), json.dumps(params))
+        if body is not None:
+            self.local.set(local_key, body)
+        return body
+
+    async def set(self, index_alias: str, generation: str,
+                  params: Sequence[Hashable], body: str):
+        self.local.set((index_alias, generation, *params), body)
+        key = self.keys.search_cache(index_alias, generation)
+        pipeline = self.redis.pipeline()
+        pipeline.hset(key, json.dumps(params), body)
+        pipeline.expire(key, REDIS_CACHE_TTL)
+        await pipeline.execute()
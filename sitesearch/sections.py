@@ -0,0 +1,23 @@
+import logging
+
+log = logging.getLogger(__name__)
+
+
+def get_section(root_url: str, url: str) -> str:
+    """Given a root URL and an input URL, determine the "section" of the current URL.
+
+    The section is the first portion of the path above the root, e.g. in the URL:
+
+        https://docs.redislabs.com/first/second/third
+
+    The section is "first".
+    """
+    if not url.startswith(root_url):
+        return ""
+    try:
+        url_parts = url.replace(root_url, "").replace("//", "/").split("/")
+        s = [u for u in url_parts if u][0]
+    except (IndexError, TypeError, AttributeError) as e:
+        log.debug("Could not parse section: %s", e)
+        s = ""
+    return s
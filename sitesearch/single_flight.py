@@ -0,0 +1,75 @@
+import asyncio
+from threading import Event, Lock
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+
+
+class Call:
+    """A call that one caller is making on behalf of all of them."""
+    def __init__(self):
+        self.done = Event()
+        self.value: Any = None
+        self.error: Optional[BaseException] = None
+
+
+class SingleFlight:
+    """
+    Make one call for every concurrent caller that asks for the same key.
+
+    The first caller for a key runs the function; callers that arrive
+    while it's running wait for it and get the same result, or the same
+    exception. Once the call returns, the next caller for the key starts
+    a new one, so callers never get a result from before they asked.
+
+    gunicorn's gevent workers patch the threading module, so this
+    coalesces requests served by greenlets as well as threads.
+    """
+    def __init__(self):
+        self.lock = Lock()
+        self.calls: Dict[Hashable, Call] = {}
+
+    def do(self, key: Hashable, fn: Callable[[], Any]) -> Tuple[Any, bool]:
+        """
+        Call `fn`, or wait for the call already in flight for `key`.
+        Returns the result and whether it came from another caller's call.
+        """
+        with self.lock:
+            leader = key not in self.calls
+            if leader:
+                self.calls[key] = Call()
+            call = self.calls[key]
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.value, True
+
+        try:
+            call.value = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+            call.done.set()
+
+        return call.value, False
+
+
+class AsyncSingleFlight:
+    """A SingleFlight for coroutines, for the ASGI app."""
+    def __init__(self):
+        self.calls: Dict[Hashable, asyncio.Future] = {}
+
+    async def do(self, key: Hashable,
+                 fn: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        future = self.calls.get(key)
+        if future is not None:
+            return await asyncio.shield(future), True
+
+        future = asyncio.ensure_future(fn())
+        self.calls[key] = future
+        future.add_done_callback(lambda _: self.calls.pop(key, None))
+        # If this caller is cancelled, the call carries on for the others.
+        return await asyncio.shield(future), False
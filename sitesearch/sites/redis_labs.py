@@ -90,7 +90,9 @@ DOCS_PROD = SiteConfiguration(
 DOCS_STAGING = dataclasses.replace(
     DOCS_PROD,
 
-    url="https://docs.redislabs.com/staging/boost-current-section"
+    url="https://docs.redislabs.com/staging/boost-current-section",
+    # Revalidate every time, so that staging shows new results at once.
+    cache_control="no-cache"
 )
 
 DEVELOPERS = SiteConfiguration(
@@ -4,27 +4,26 @@ from redis import ResponseError
 
 from rq import get_current_job
 
+from sitesearch.archive import CrawlArchive
+from sitesearch.cluster_aware_rq import ClusterAwareQueue
 from sitesearch.config import AppConfiguration
 from sitesearch.connections import get_rq_redis_client, get_search_connection
-from sitesearch.indexer import Indexer
+from sitesearch.indexer import Indexer, delete_legacy_documents, drop_index
+from sitesearch.jobs import CRAWL_SHARD_TASK, INDEXING_TIMEOUT
 from sitesearch.keys import Keys
 from sitesearch.models import SiteConfiguration
 
 log = logging.getLogger(__name__)
 
-# These constants are used by other modules to refer to the
-# state of the `index` task in the queueing/scheduling system.
-JOB_NOT_QUEUED = 'not_queued'
-JOB_STARTED = 'started'
-INDEXING_TIMEOUT = 60*60  # One hour
 
-
-def index(site: SiteConfiguration, config: Optional[AppConfiguration] = None, force=False):
+def index(site: SiteConfiguration, config: Optional[AppConfiguration] = None, force=False,
+          archive_path: Optional[str] = None):
     redis_client = get_rq_redis_client()
     if config is None:
         config = AppConfiguration()
     indexer = Indexer(site, config)
-    indexer.index(force)
+    archive = CrawlArchive(archive_path) if archive_path else None
+    indexer.index(force, archive=archive)
 
     job = get_current_job()
     if job:
@@ -35,6 +34,49 @@ def index(site: SiteConfiguration, config: Optional[AppConfiguration] = None, fo
     return True
 
 
+def index_distributed(site: SiteConfiguration,
+                      config: Optional[AppConfiguration] = None,
+                      force=False,
+                      shards: Optional[int] = None):
+    """
+    Start a crawl of a site that `shards` workers share, and enqueue a
+    crawl_shard() job for each of them.
+    """
+    redis_client = get_rq_redis_client()
+    if config is None:
+        config = AppConfiguration()
+    if shards is None:
+        shards = config.crawl_shards
+    indexer = Indexer(site, config)
+    if not indexer.start_distributed_crawl(shards, force):
+        return False
+
+    queue = ClusterAwareQueue(connection=redis_client)
+    for shard in range(shards):
+        queue.enqueue(CRAWL_SHARD_TASK,
+                      args=[site, indexer.index_name],
+                      kwargs={"config": config, "shard": shard},
+                      job_timeout=INDEXING_TIMEOUT)
+
+    return True
+
+
+def crawl_shard(site: SiteConfiguration,
+                index_name: str,
+                config: Optional[AppConfiguration] = None,
+                shard: int = 0):
+    """Crawl a site as one shard of the crawl that builds `index_name`."""
+    if config is None:
+        config = AppConfiguration()
+    indexer = Indexer(site, config)
+    if indexer.resuming is None or indexer.index_name != index_name:
+        log.info("Crawl of %s for index %s already finished", site.url,
+                 index_name)
+        return False
+    indexer.crawl_shard(shard)
+    return True
+
+
 def clear_old_indexes(site: SiteConfiguration, config: Optional[AppConfiguration] = None):
     if config is None:
         config = AppConfiguration()
@@ -49,10 +91,11 @@ def clear_old_indexes(site: SiteConfiguration, config: Optional[AppConfiguration
 
     old_indexes = [
         i for i in redis_client.redis.execute_command('FT._LIST')
-        if i.startswith(index_alias) and i != current_index
+        if i.startswith(f"{index_alias}-") and i != current_index
     ]
 
     for idx in old_indexes:
-        redis_client.redis.execute_command('FT.DROPINDEX', idx)
+        drop_index(redis_client.redis, keys, idx)
+    delete_legacy_documents(redis_client.redis, keys)
 
     return True
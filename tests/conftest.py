@@ -3,6 +3,7 @@ import os
 import pytest
 import redis as redis_client
 from falcon import testing
+from redis.exceptions import ResponseError
 
 from sitesearch.api.app import create_app
 from sitesearch.config import AppConfiguration
@@ -65,6 +66,34 @@ def docs(parse_file, app_config):
     yield docs
 
 
+@pytest.fixture
+def make_indexer(app_config, redis):
+    """
+    This fixture builds Indexers for the docs site that talk to RediSearch,
+    so that they create and set up their indexes as they would in
+    production.
+
+    The fixture is a callable that takes an optional AppConfiguration and
+    returns a new Indexer. After the test, we drop every index that the
+    Indexers created.
+    """
+    indexers = []
+
+    def fn(config=None):
+        indexer = Indexer(DOCS_PROD, config or app_config)
+        indexers.append(indexer)
+        return indexer
+
+    yield fn
+
+    for index_name in {indexer.index_name for indexer in indexers}:
+        try:
+            redis.execute_command('FT.DROPINDEX', index_name)
+        except ResponseError:
+            # The test dropped it already.
+            pass
+
+
 def _delete_test_keys(prefix: str, conn: redis_client.Redis):
     for key in conn.scan_iter(f"{prefix}:*"):
         conn.delete(key)
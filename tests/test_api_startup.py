@@ -0,0 +1,8 @@
+from benchmarks.startup import MAX_RSS_MB, measure_startup
+
+
+def test_api_does_not_import_the_indexer():
+    result = measure_startup()
+
+    assert result['indexing_modules'] == []
+    assert result['rss_mb'] < MAX_RSS_MB
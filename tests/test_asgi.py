@@ -0,0 +1,141 @@
+import asyncio
+import json
+from unittest import mock
+
+import pytest
+
+from sitesearch.api.asgi_app import create_asgi_app
+from sitesearch.search_cache import AsyncSearchCache
+from sitesearch.sites.redis_labs import DOCS_PROD
+
+SEARCH_REPLY = [
+    1, f"sitesearch:test:{DOCS_PROD.url}:doc:test", [
+        "title", "Test", "section_title", "", "hierarchy", "[]", "body",
+        "A test page", "url", f"{DOCS_PROD.url}test"
+    ]
+]
+
+
+async def request(app, path, query_string=b"", method="GET", headers=()):
+    messages = []
+
+    async def receive():
+        return {'type': 'http.request', 'body': b''}
+
+    async def send(message):
+        messages.append(message)
+
+    await app({
+        'type': 'http',
+        'method': method,
+        'path': path,
+        'query_string': query_string,
+        'headers': list(headers)
+    }, receive, send)
+    start, body = messages
+    return start['status'], dict(start['headers']), body['body']
+
+
+@pytest.fixture()
+def asgi_app(app_config):
+    app = create_asgi_app(app_config)
+    app.redis = mock.MagicMock()
+    app.redis.get = mock.AsyncMock(return_value="generation-1")
+    app.redis.hget = mock.AsyncMock(return_value=None)
+    app.redis.execute = mock.AsyncMock(return_value=SEARCH_REPLY)
+    app.redis.pipeline.return_value.execute = mock.AsyncMock()
+    app.cache = AsyncSearchCache(app.redis, app.keys, 10)
+    yield app
+
+
+def test_asgi_search_returns_results_and_caches_them(asgi_app):
+    status, headers, body = asyncio.run(
+        request(asgi_app, '/search', b'q=test',
+                headers=[(b'origin', b'https://docs.redislabs.com')]))
+    asyncio.run(request(asgi_app, '/search', b'q=test'))
+
+    assert status == 200
+    assert headers[b'access-control-allow-origin'] == b'https://docs.redislabs.com'
+    assert json.loads(body) == {
+        "total": 1,
+        "results": [{
+            "title": "Test",
+            "section_title": "",
+            "hierarchy": [],
+            "body": "A test page",
+            "url": f"{DOCS_PROD.url}test"
+        }]
+    }
+    command = asgi_app.redis.execute.call_args[0]
+    assert command[:2] == ('FT.SEARCH', 'generation-1')
+    assert asgi_app.redis.execute.call_count == 1
+
+
+def test_asgi_search_answers_not_modified_for_current_generation(asgi_app):
+    _, headers, _ = asyncio.run(request(asgi_app, '/search', b'q=test'))
+    status, not_modified_headers, body = asyncio.run(
+        request(asgi_app, '/search', b'q=test',
+                headers=[(b'if-none-match', headers[b'etag'])]))
+
+    assert headers[b'cache-control'] == DOCS_PROD.cache_control.encode()
+    assert status == 304
+    assert body == b''
+    assert not_modified_headers[b'etag'] == headers[b'etag']
+    assert asgi_app.redis.execute.call_count == 1
+
+
+def test_asgi_search_rejects_invalid_site(asgi_app):
+    status, _, body = asyncio.run(
+        request(asgi_app, '/search', b'q=test&site=https://example.com'))
+
+    assert status == 400
+    assert json.loads(body)['title'] == "Invalid site"
+
+
+def test_asgi_health_reports_pool(app_config):
+    app = create_asgi_app(app_config)
+
+    async def check_health():
+        await app.connection()
+        try:
+            return await request(app, '/health')
+        finally:
+            await app.close()
+
+    status, _, body = asyncio.run(check_health())
+
+    assert status == 200
+    assert json.loads(body)['redis_pool']['connections'] >= 1
+
+
+def test_asgi_connects_again_after_connecting_fails(app_config):
+    app = create_asgi_app(app_config)
+    redis_client = mock.MagicMock()
+    attempts = []
+
+    async def connect():
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise OSError("Connection refused")
+        app.redis = redis_client
+
+    app.connect = connect
+
+    with pytest.raises(OSError):
+        asyncio.run(app.connection())
+
+    assert asyncio.run(app.connection()) is redis_client
+    assert len(attempts) == 2
+
+
+def test_asgi_search_samples_queries_into_query_log(asgi_app, monkeypatch):
+    monkeypatch.setattr(asgi_app.app_config, 'query_log_sample_rate', 1)
+    pipeline = asgi_app.redis.pipeline.return_value
+
+    asyncio.run(request(asgi_app, '/search', b'q=test&start=0'))
+
+    key = asgi_app.keys.query_log()
+    pipeline.lpush.assert_called_once_with(
+        key, json.dumps({"q": "test", "start": "0"}))
+    pipeline.ltrim.assert_called_once_with(
+        key, 0, asgi_app.app_config.query_log_size - 1)
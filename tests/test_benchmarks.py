@@ -0,0 +1,19 @@
+import json
+
+from click.testing import CliRunner
+
+from benchmarks.indexing import benchmark
+
+
+def test_benchmarks_save_results_as_json(tmp_path):
+    output = tmp_path / "results.json"
+
+    result = CliRunner().invoke(
+        benchmark, ['--scales', '2', '--rounds', '1', '--output', output])
+
+    assert result.exit_code == 0, result.output
+    results = json.loads(output.read_text())
+    assert "DocumentParser.prepare_document[x2]" in results['benchmarks']
+    for stats in results['benchmarks'].values():
+        assert stats['items'] > 0
+        assert stats['min'] >= 0
@@ -0,0 +1,80 @@
+from unittest import mock
+
+from redis.exceptions import ConnectionError
+
+from sitesearch.connections import MAX_SEARCH_CLIENTS, SharedConnections
+
+
+def test_shared_connections_reuse_one_client_per_index():
+    connections = SharedConnections()
+
+    client = connections.get_search_connection("index")
+
+    assert connections.get_search_connection("index") is client
+    assert connections.get_search_connection("other").redis is client.redis
+    assert client.redis.connection_pool is connections.pool
+
+
+def test_shared_connections_drop_least_recently_used_search_clients():
+    connections = SharedConnections()
+    first = connections.get_search_connection("index-0")
+
+    for generation in range(1, MAX_SEARCH_CLIENTS + 1):
+        connections.get_search_connection(f"index-{generation}")
+
+    assert connections.stats()['search_clients'] == MAX_SEARCH_CLIENTS
+    assert connections.get_search_connection("index-0") is not first
+
+
+def test_shared_connections_start_over_after_fork():
+    connections = SharedConnections()
+    client = connections.get_search_connection("index")
+    pool = connections.pool
+
+    with mock.patch('os.getpid', return_value=connections.pid + 1):
+        forked_client = connections.get_search_connection("index")
+
+    assert forked_client is not client
+    assert connections.pool is not pool
+
+
+def test_shared_connections_report_pool_stats():
+    connections = SharedConnections()
+    redis = connections.get_redis_connection()
+    redis.ping()
+
+    connection = connections.pool.get_connection('PING')
+    stats = connections.stats()
+    connections.pool.release(connection)
+
+    assert stats['connections'] == 1
+    assert stats['in_use'] == 1
+    assert stats['idle'] == 0
+    assert connections.stats()['in_use'] == 0
+
+
+def test_shared_connections_take_turns_reading_from_replicas():
+    connections = SharedConnections(replicas=[("replica-1", 6379),
+                                              ("replica-2", 6379)])
+
+    servers = [connections.read(lambda server: server.host) for _ in range(4)]
+
+    assert servers == ["replica-1", "replica-2", "replica-1", "replica-2"]
+
+
+def test_shared_connections_read_from_primary_when_a_replica_fails():
+    connections = SharedConnections(replicas=[("replica-1", 6379)])
+    replica = connections.read_server()
+
+    def read(server):
+        if server is replica:
+            raise ConnectionError("Connection refused")
+        return "primary"
+
+    assert connections.read(read) == "primary"
+    assert connections.read_server() is connections.primary
+    assert connections.stats()['replicas'][0]['healthy'] is False
+
+    with mock.patch('time.monotonic',
+                    return_value=replica.down_until + 1):
+        assert connections.read_server() is replica
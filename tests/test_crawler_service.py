@@ -0,0 +1,149 @@
+from unittest import mock
+
+import pytest
+from rq.job import JobStatus
+from scrapy.settings import Settings
+from twisted.internet import defer, task
+
+from sitesearch.crawler_service import (SERVICE_SETTINGS, CrawlerService,
+                                        SharedPoolDownloadHandler)
+from sitesearch.jobs import INDEX_TASK
+from sitesearch.sites.redis_labs import DOCS_PROD
+
+
+@pytest.fixture()
+def threads_inline():
+    """Run what the service defers to a thread right away, without a reactor."""
+    with mock.patch('sitesearch.crawler_service.threads.deferToThread',
+                    side_effect=defer.maybeDeferred):
+        yield
+
+
+@pytest.fixture()
+def service(app_config, threads_inline):
+    service = CrawlerService(app_config, clock=task.Clock())
+    yield service
+    service.queue.empty()
+
+
+@pytest.fixture()
+def crawls():
+    """
+    Replace the indexer with one whose crawls wait until a test fires
+    them. Yields the Deferreds of the crawls started so far.
+    """
+    started = []
+
+    def crawl_site(Spider, runner=None):
+        crawl = defer.Deferred()
+        started.append(crawl)
+        return crawl
+
+    with mock.patch('sitesearch.crawler_service.Indexer') as Indexer:
+        Indexer.return_value.crawl_site.side_effect = crawl_site
+        yield started
+
+
+def enqueue(service, timeout=60):
+    return service.queue.enqueue(INDEX_TASK, args=[DOCS_PROD],
+                                 job_timeout=timeout)
+
+
+def test_download_handlers_share_one_connection_pool():
+    SharedPoolDownloadHandler.pool = None
+    settings = Settings(SERVICE_SETTINGS)
+
+    first = SharedPoolDownloadHandler(settings)
+    first.close()
+    second = SharedPoolDownloadHandler(settings)
+
+    assert second._pool is first._pool
+    assert first._pool.persistent
+
+
+def test_service_finishes_job_once_crawl_finishes(service, crawls):
+    job = enqueue(service)
+    service.run_job(job)
+    assert job.get_status() == JobStatus.STARTED
+
+    crawls[0].callback(None)
+
+    assert job.get_status() == JobStatus.FINISHED
+    assert job.id in service.finished.get_job_ids()
+    assert job.id not in service.started.get_job_ids()
+
+
+def test_service_fails_job_whose_crawl_fails(service, crawls):
+    job = enqueue(service)
+    service.run_job(job)
+
+    crawls[0].errback(RuntimeError("The site is down"))
+
+    assert job.get_status() == JobStatus.FAILED
+    assert job.id in service.failed.get_job_ids()
+    job.refresh()
+    assert "The site is down" in job.exc_info
+
+
+def test_service_fails_job_for_another_task(service, crawls):
+    job = service.queue.enqueue('sitesearch.tasks.clear_old_indexes')
+    service.run_job(job)
+
+    assert job.get_status() == JobStatus.FAILED
+    assert not crawls
+
+
+def test_service_stops_crawl_and_fails_job_that_times_out(service):
+    stopped = []
+    crawl = defer.Deferred(canceller=stopped.append)
+    job = enqueue(service, timeout=60)
+
+    with mock.patch('sitesearch.crawler_service.Indexer') as Indexer:
+        Indexer.return_value.crawl_site.return_value = crawl
+        service.run_job(job)
+
+    service.clock.advance(59)
+    assert not stopped
+    assert job.get_status() == JobStatus.STARTED
+
+    service.clock.advance(1)
+    assert stopped == [crawl]
+    assert job.get_status() == JobStatus.FAILED
+    job.refresh()
+    assert "timeout" in job.exc_info
+
+
+def test_service_cancels_timeout_of_finished_job(service, crawls):
+    job = enqueue(service)
+    service.run_job(job)
+    crawls[0].callback(None)
+
+    assert not service.clock.getDelayedCalls()
+
+
+def test_service_runs_two_jobs_at_once(service, crawls):
+    first = enqueue(service)
+    second = enqueue(service)
+    service.run_job(first)
+    service.run_job(second)
+
+    assert len(crawls) == 2
+    assert first.get_status() == JobStatus.STARTED
+    assert second.get_status() == JobStatus.STARTED
+
+    crawls[1].callback(None)
+    assert first.get_status() == JobStatus.STARTED
+    assert second.get_status() == JobStatus.FINISHED
+
+    crawls[0].callback(None)
+    assert first.get_status() == JobStatus.FINISHED
+
+
+def test_service_skips_crawl_of_site_another_run_is_crawling(service):
+    job = enqueue(service)
+    with mock.patch('sitesearch.crawler_service.Indexer') as Indexer:
+        Indexer.return_value.prepare_crawl.return_value = None
+        service.run_job(job)
+        Indexer.return_value.crawl_site.assert_not_called()
+
+    assert job.get_status() == JobStatus.FINISHED
@@ -0,0 +1,125 @@
+import time
+
+import pytest
+from twisted.internet import task
+
+from sitesearch.frontier import SharedFrontier
+from sitesearch.keys import Keys
+
+INDEX_NAME = "sitesearch:test:index-1"
+URL = "https://docs.redislabs.com/latest"
+
+
+@pytest.fixture()
+def keys(app_config):
+    yield Keys(prefix=app_config.key_prefix)
+
+
+def result_of(deferred):
+    results = []
+    deferred.addCallback(results.append)
+    [result] = results
+    return result
+
+
+@pytest.fixture()
+def frontier(redis, keys):
+    frontier = SharedFrontier(redis, keys, INDEX_NAME, max_claims=2)
+    frontier.start(2, {URL: 'parse'})
+    yield frontier
+
+
+def test_shards_request_each_url_once(redis, keys, frontier):
+    other_shard = SharedFrontier(redis, keys, INDEX_NAME, max_claims=2)
+
+    assert frontier.claim() == [(URL, 'parse')]
+    assert frontier.add([f"{URL}/a", f"{URL}/b", f"{URL}/a", URL]) == 2
+    assert other_shard.add([f"{URL}/b", f"{URL}/c"], 'parse_sitemap') == 1
+
+    assert frontier.claim() == [(f"{URL}/a", 'parse')]
+    assert other_shard.claim() == [(f"{URL}/b", 'parse'),
+                                   (f"{URL}/c", 'parse_sitemap')]
+    assert other_shard.claim() == []
+
+
+def test_frontier_finishes_when_no_shard_has_urls(redis, keys, frontier):
+    other_shard = SharedFrontier(redis, keys, INDEX_NAME, max_claims=2)
+    assert not frontier.finished()
+
+    frontier.claim()
+    assert not other_shard.finished()
+
+    frontier.done(URL)
+    assert other_shard.finished()
+
+
+def test_idle_shard_releases_its_claims(frontier):
+    frontier.add([f"{URL}/a"])
+    frontier.claim()
+
+    frontier.release()
+
+    assert frontier.claimed == set()
+    assert frontier.finished()
+
+
+def test_claims_of_stopped_shards_go_back_on_the_frontier(redis, keys,
+                                                          frontier):
+    frontier.claim()
+    other_shard = SharedFrontier(redis, keys, INDEX_NAME, claim_timeout=-1)
+
+    assert not other_shard.finished()
+    assert other_shard.claim() == [(URL, 'parse')]
+
+
+def test_last_shard_to_leave_finishes_the_crawl(redis, keys, frontier):
+    other_shard = SharedFrontier(redis, keys, INDEX_NAME)
+    assert frontier.join(0)
+    assert other_shard.join(1)
+
+    assert frontier.remove_shards(frontier.shard) is None
+    assert result_of(other_shard.leave()) is True
+    assert result_of(frontier.leave()) is False
+
+
+def test_shard_waits_for_the_others_to_leave_without_blocking(
+        redis, keys, frontier):
+    other_shard = SharedFrontier(redis, keys, INDEX_NAME)
+    assert frontier.join(0)
+    assert other_shard.join(1)
+    clock = task.Clock()
+
+    leaving = frontier.leave(clock)
+    assert not leaving.called
+
+    assert result_of(other_shard.leave(clock)) is True
+    clock.advance(frontier.heartbeat_interval)
+    assert result_of(leaving) is False
+
+
+def test_claimed_urls_leave_the_frontier_and_join_the_claims(redis, keys,
+                                                             frontier):
+    frontier.add([f"{URL}/a", f"{URL}/b"])
+
+    assert frontier.claim() == [(URL, 'parse'), (f"{URL}/a", 'parse')]
+
+    assert redis.lrange(keys.crawl_frontier(INDEX_NAME), 0, -1) == [
+        f"{URL}/b"
+    ]
+    assert set(redis.zrange(keys.crawl_claims(INDEX_NAME), 0, -1)) == {
+        URL, f"{URL}/a"
+    }
+
+
+def test_shards_that_stop_reporting_in_are_left_behind(redis, keys, frontier):
+    frontier.shard_timeout = 0.05
+    frontier.heartbeat_interval = 0.05
+    assert frontier.join(0)
+    time.sleep(0.1)
+    frontier.heartbeat()
+
+    # Shard 1 never started, so we finish the crawl without it.
+    assert frontier.remove_shards() is None
+    assert result_of(frontier.leave()) is True
+    late_shard = SharedFrontier(redis, keys, INDEX_NAME)
+    assert not late_shard.join(1)
@@ -1,15 +1,29 @@
+import asyncio
+import datetime
+import gzip
+import hashlib
 import os
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import replace
+from queue import Queue
 from unittest import mock
 from unittest.mock import call
 import ipdb
 
 import pytest
+from redis.exceptions import DataError, ResponseError
+from bs4 import BeautifulSoup
+from scrapy.http import HtmlResponse, Request, XmlResponse
+from twisted.internet import defer, task
 
+from sitesearch.archive import CrawlArchive
 from sitesearch.keys import Keys
-from sitesearch.config import DOCS_PROD
+from sitesearch.config import AppConfiguration, DOCS_PROD
 from sitesearch.errors import ParseError
-from sitesearch.indexer import DocumentParser, Indexer
-from sitesearch.models import SearchDocument
+from sitesearch.indexer import (DocumentParser, DocumentationSpiderBase,
+                                Indexer, document_hash, parse_lastmod)
+from sitesearch.models import CachedPage, SearchDocument
+from sitesearch.page_cache import PageCache
 
 DOCS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
                         "documents")
@@ -31,6 +45,14 @@ def indexer(app_config):
     yield Indexer(DOCS_PROD, app_config, mock_search_client)
 
 
+@pytest.fixture()
+def threads_inline():
+    """Run what the indexer defers to a thread right away, without a reactor."""
+    with mock.patch('sitesearch.indexer.threads.deferToThread',
+                    side_effect=defer.maybeDeferred):
+        yield
+
+
 @pytest.fixture()
 def keys(app_config):
     yield Keys(prefix=app_config.key_prefix)
@@ -86,9 +108,10 @@ def test_indexer_indexes_page_document(index_file, keys):
         'All data is stored and managed exclusively in either RAM or RAM + Flash Memory (Redis on Flash) and therefore, is at risk of being lost upon a\xa0process or server failure.\xa0As Redis Enterprise Software is not just a caching solution, but also a full-fledged database, persistence to disk is critical. Therefore, Redis Enterprise Software supports persisting data to disk on a per-database basis and in multiple ways. There are two options for persistence:  Append Only File (AOF) - A continuous writing of data to disk Snapshot (RDB) - An automatic periodic snapshot writing to disk  Data persistence, via either mechanism, is used solely to rehydrate the database if the database process fails for any reason. It is not a replacement for backups, but something you do in addition to backups. To disable data persistence, select None. AOF writes the latest ‘write’ commands into a file every second, it resembles a traditional RDBMS’s redo log, if you are familiar with that. This file can later be ‘replayed’ in order to recover from a crash. A snapshot (RDB) on the other hand, is performed every one, six, or twelve hours. The snapshot is a dump of the data and while there is a potential of losing up to one hour of data, it is dramatically faster to recover from a snapshot compared to AOF recovery. Persistence can be configured either at time of database creation or by editing an existing database’s configuration. While the persistence model can be changed dynamically, just know that it can take time for your database to switch from one persistence model to the other. It depends on what you are switching from and to, but also on the size of your database. Note: For performance reasons, if you are going to be using AOF, it is highly recommended to make sure replication is enabled for that database as well. When these two features are enabled, persistence is performed\xa0on the database slave and does not impact performance on the master. Options for configuring data persistence There are six\xa0options for persistence in Redis Enterprise Software:    Options Description     None Data is not persisted to disk at all.   Append Only File (AoF) on every write Data is fsynced to disk with every write.   Append Only File (AoF) one second Data is fsynced to disk every second.   Snapshot every 1 hour A snapshot of the database is created every hour.   Snapshot every 6 hours A snapshot of the database is created every 6 hours.   Snapshot every 12 hours A snapshot of the database is created every 12 hours.    The first thing you need to do is determine if you even need persistence. Persistence is used to recover from a catastrophic failure, so make sure that you need to incur the overhead of persistence before you select it. If the database is being used as a cache, then you may not need persistence. If you do need persistence, then you need to identify\xa0which is the best type for your use case. Append only file (AOF) vs snapshot (RDB) Now that you know the available options, to assist in making a decision on which option is right for your use case, here is a table about the two:    Append Only File (AOF) Snapshot (RDB)     More resource intensive Less resource\xa0intensive   Provides better durability (recover the latest point in time) Less durable   Slower time to recover (Larger files) Faster recovery time   More disk space required (files tend to grow large and require compaction) Requires less resource (I/O once every several hours and no compaction required)    Data persistence and Redis on Flash If you are enabling data persistence for databases running on Redis Enterprise Flash, by default both master and slave shards are configured to write to disk. This is unlike a standard Redis Enterprise Software database where only the slave shards persist to disk. This master and slave dual data persistence with replication is done to better protect the database against node failures. Flash-based databases are expected to hold larger datasets and repair times for shards can be longer under node failures. Having dual-persistence provides better protection against failures under these longer repair times. However, the dual data persistence with replication adds some processor and network overhead, especially in the case of cloud configurations with persistent storage that is network attached (e.g. EBS-backed volumes in AWS). There may be times where performance is critical for your use case and you don’t want to risk data persistence adding latency. If that is the case, you can disable data-persistence on the master shards using the following\xa0rladmin command: rladmin tune db db: master_persistence disabled     Page Contents   Options for configuring data persistence   Append only file (AOF) vs snapshot (RDB)   Data persistence and Redis on Flash',
         'type': 'page',
         'position': 0,
-        '__score': 1
+        '__score': 1.0
     }
-    key = keys.document(DOCS_PROD.url, expected_doc['doc_id'])
+    expected_doc['content_hash'] = document_hash(expected_doc)
+    key = keys.document(indexer.index_name, expected_doc['doc_id'])
     indexer.search_client.redis.hset.assert_any_call(key, mapping=expected_doc)
 
 
@@ -138,7 +161,8 @@ def test_indexer_indexes_page_section_documents(index_file, keys):
     # Ignore the first call, which is for the page. In this test,
     # we're focused on the section documents
     for i, doc in enumerate(expected_section_docs, start=1):
-        key = keys.document(DOCS_PROD.url, doc['doc_id'])
+        doc['content_hash'] = document_hash(doc)
+        key = keys.document(indexer.index_name, doc['doc_id'])
         assert indexer.search_client.redis.hset.call_args_list[i] == call(
             key, mapping=doc)
 
@@ -262,6 +286,673 @@ def test_indexer_indexes_sections_from_h3s(index_file, keys):
     }]
 
     for i, doc in enumerate(expected_section_docs):
-        key = keys.document(DOCS_PROD.url, doc['doc_id'])
+        doc['content_hash'] = document_hash(doc)
+        key = keys.document(indexer.index_name, doc['doc_id'])
         assert indexer.search_client.redis.hset.call_args_list[i] == call(
             key, mapping=doc)
+
+
+def test_queue_document_skips_root_page(indexer):
+    doc = SearchDocument(doc_id="123",
+                         title="Root",
+                         section_title="",
+                         hierarchy=[],
+                         s="",
+                         url=f"{DOCS_PROD.url}/",
+                         body="This is the body",
+                         type='page',
+                         position=0)
+    indexer.queue_document(doc)
+    assert indexer.docs_to_process.empty()
+    assert indexer.seen_urls == {}
+
+
+def test_update_hierarchies_rewrites_documents_written_before_parents(indexer, keys):
+    doc = SearchDocument(doc_id="123",
+                         title="Three",
+                         section_title="",
+                         hierarchy=[],
+                         s="",
+                         url="https://docs.redislabs.com/latest/1/2/3",
+                         body="This is the body",
+                         type='page',
+                         position=0)
+    indexer.seen_urls = {"https://docs.redislabs.com/latest/1/2/3": "Three"}
+    indexer.index_document(doc)
+
+    # We crawl the parent pages after writing the document.
+    indexer.seen_urls["https://docs.redislabs.com/latest/1"] = "One"
+    indexer.seen_urls["https://docs.redislabs.com/latest/1/2"] = "Two"
+    indexer.update_hierarchies()
+
+    pipeline = indexer.redis.pipeline.return_value.__enter__.return_value
+    key = keys.document(indexer.index_name, doc.doc_id)
+    pipeline.hset.assert_called_once_with(key, 'hierarchy',
+                                          '["One", "Two", "Three"]')
+
+
+def test_index_documents_writes_batch_in_one_pipeline(indexer, parse_file,
+                                                      keys):
+    docs = parse_file(FILE_WITH_SECTIONS)
+    pipeline = indexer.redis.pipeline.return_value.__enter__.return_value
+    pipeline.execute.return_value = [1, 1, 1, 1] * len(docs)
+
+    indexer.index_documents(docs)
+
+    indexer.redis.pipeline.assert_called_once_with(transaction=False)
+    pipeline.execute.assert_called_once_with(raise_on_error=False)
+    assert [c.args[0] for c in pipeline.hset.call_args_list] == [
+        keys.document(indexer.index_name, doc.doc_id) for doc in docs
+    ]
+    assert pipeline.sadd.call_count == len(docs) * 2
+    assert [c.args[2] for c in pipeline.execute_command.call_args_list] == [
+        docs[0].title, *[doc.section_title for doc in docs[1:]]
+    ]
+    assert indexer.written_hierarchies == {TEST_URL: '[]'}
+
+
+def test_index_documents_reports_failed_documents(indexer, parse_file,
+                                                  caplog):
+    docs = parse_file(FILE_WITH_SECTIONS)
+    pipeline = indexer.redis.pipeline.return_value.__enter__.return_value
+    pipeline.execute.return_value = [1, 1, 1, 1] * len(docs)
+    pipeline.execute.return_value[4] = ResponseError("OOM")
+
+    indexer.index_documents(docs)
+
+    assert "Failed -- response error: OOM" in caplog.text
+    assert len(indexer.written_keys[TEST_URL]) == len(docs) - 1
+
+
+def test_index_documents_reports_failed_write_after_untitled_section(
+        indexer, parse_file, keys, caplog):
+    docs = parse_file(FILE_WITH_SECTIONS)
+    docs[1] = replace(docs[1], section_title="")
+    pipeline = indexer.redis.pipeline.return_value.__enter__.return_value
+    # The untitled section has no FT.SUGADD, so it has three results.
+    results = [1, 1, 1, 1] * len(docs)
+    del results[7]
+    results[7] = ResponseError("OOM")
+    pipeline.execute.return_value = results
+
+    indexer.index_documents(docs)
+
+    assert "Failed -- response error: OOM" in caplog.text
+    assert indexer.written_keys[TEST_URL] == {
+        keys.document(indexer.index_name, doc.doc_id)
+        for doc in docs if doc is not docs[2]
+    }
+
+
+def test_index_documents_retries_one_by_one_after_bad_data(indexer, parse_file):
+    docs = parse_file(FILE_WITH_SECTIONS)
+    pipeline = indexer.redis.pipeline.return_value.__enter__.return_value
+    pipeline.execute.side_effect = DataError("Invalid input of type: 'NoneType'")
+
+    indexer.index_documents(docs)
+
+    assert indexer.redis.hset.call_count == len(docs)
+
+
+def test_cleanup_urls_forgets_stale_urls(redis, make_indexer, keys):
+    alias = keys.index_alias(DOCS_PROD.url)
+    previous = f"{alias}-1"
+    redis.set(keys.index_generation(alias), previous)
+    indexer = make_indexer()
+    stale_url = f"{DOCS_PROD.url}/stale"
+
+    for url in (stale_url, TEST_URL):
+        redis.hset(keys.page_cache(alias, url), "body_hash", "abc")
+        redis.sadd(keys.url_documents(previous, url),
+                   keys.document(previous, f"{url}:Doc"))
+    redis.sadd(keys.site_urls_current(alias), stale_url, TEST_URL)
+    redis.sadd(keys.site_urls_new(alias), TEST_URL)
+
+    indexer.cleanup_urls()
+
+    assert not redis.exists(keys.page_cache(alias, stale_url))
+    assert redis.exists(keys.page_cache(alias, TEST_URL))
+    assert not redis.exists(keys.url_documents(previous, stale_url),
+                            keys.url_documents(previous, TEST_URL))
+    assert redis.smembers(keys.site_urls_current(alias)) == {TEST_URL}
+
+
+def test_clear_old_indexes_drops_their_documents(indexer, keys):
+    alias = indexer.index_alias
+    legacy = f"{alias}-1"
+    previous = f"{alias}-2"
+
+    def execute_command(command, *args):
+        if command == 'FT._LIST':
+            return [legacy, previous, indexer.index_name, f"{alias}/rs-3"]
+        if command == 'FT.INFO':
+            prefix = alias if args[0] == legacy else keys.index_prefix(args[0])
+            return ['index_name', args[0],
+                    'index_definition', ['key_type', 'HASH',
+                                         'prefixes', [prefix]]]
+
+    indexer.redis.execute_command.side_effect = execute_command
+
+    indexer.clear_old_indexes()
+
+    drops = [c.args for c in indexer.redis.execute_command.call_args_list
+             if c.args[0] == 'FT.DROPINDEX']
+    assert drops == [('FT.DROPINDEX', legacy),
+                     ('FT.DROPINDEX', previous, 'DD')]
+
+
+def test_dropping_legacy_index_deletes_its_documents(redis, make_indexer,
+                                                     keys):
+    indexer = make_indexer()
+    legacy = f"{indexer.index_alias}-1"
+    redis.execute_command('FT.CREATE', legacy, 'ON', 'HASH', 'PREFIX', 1,
+                          indexer.index_alias, 'SCHEMA', 'title', 'TEXT')
+    legacy_docs = [f"{indexer.index_alias}:doc:{i}" for i in range(3)]
+    for key in legacy_docs:
+        redis.hset(key, 'title', "Legacy")
+    new_doc = keys.document(indexer.index_name, "new")
+    redis.hset(new_doc, 'title', "New")
+
+    with mock.patch('sitesearch.indexer.LEGACY_DELETE_BATCH_SIZE', 2):
+        indexer.clear_old_indexes()
+
+    assert legacy not in redis.execute_command('FT._LIST')
+    assert not any(redis.exists(key) for key in legacy_docs)
+    assert redis.exists(new_doc)
+    assert not redis.exists(keys.legacy_prefixes())
+
+
+@pytest.fixture()
+def incremental_spider():
+    page_cache = mock.MagicMock()
+    Spider = type(
+        'Spider', (DocumentationSpiderBase, ), {
+            "url": DOCS_PROD.url,
+            "validators": DOCS_PROD.validators,
+            "content_classes": DOCS_PROD.content_classes,
+            "page_cache": page_cache
+        })
+    yield Spider()
+
+
+def test_spider_reuses_cached_page_when_not_modified(incremental_spider):
+    cached_page = CachedPage(url=TEST_URL,
+                             body_hash="abc",
+                             etag='"123"',
+                             title="Test",
+                             links=[f"{DOCS_PROD.url}/child"])
+    request = Request(TEST_URL, meta={'cached_page': cached_page})
+    response = HtmlResponse(TEST_URL, status=304, request=request)
+
+    results = list(incremental_spider.parse(response))
+
+    assert results[0] == cached_page
+    assert [r.url for r in results[1:]] == [f"{DOCS_PROD.url}/child"]
+    incremental_spider.page_cache.set.assert_not_called()
+
+
+def test_spider_skips_parsing_unchanged_body(incremental_spider):
+    file = os.path.join(DOCS_DIR, FILE_WITH_SECTIONS)
+    with open(file, 'rb') as f:
+        body = f.read()
+    cached_page = CachedPage(url=TEST_URL,
+                             body_hash=hashlib.sha1(body).hexdigest(),
+                             title="Test")
+    request = Request(TEST_URL, meta={'cached_page': cached_page})
+    response = HtmlResponse(TEST_URL, body=body, request=request)
+
+    results = list(incremental_spider.parse(response))
+
+    assert not [r for r in results if isinstance(r, SearchDocument)]
+    assert results[0].title == "Test"
+    assert results[0].body_hash == cached_page.body_hash
+
+
+def test_spider_caches_parsed_page(incremental_spider):
+    file = os.path.join(DOCS_DIR, FILE_WITH_SECTIONS)
+    with open(file, 'rb') as f:
+        body = f.read()
+    response = HtmlResponse(TEST_URL,
+                            body=body,
+                            headers={'ETag': '"123"'},
+                            request=Request(TEST_URL))
+
+    results = list(incremental_spider.parse(response))
+
+    assert isinstance(results[0], SearchDocument)
+    page = incremental_spider.page_cache.set.call_args.args[0]
+    assert page.etag == '"123"'
+    assert page.title == 'Database Persistence with Redis Enterprise Software'
+
+
+SITEMAP = f"""<?xml version="1.0" encoding="UTF-8"?>
+<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">
+  <url><loc>{DOCS_PROD.url}/old</loc><lastmod>2020-01-01</lastmod></url>
+  <url><loc>{DOCS_PROD.url}/new</loc><lastmod>2020-03-01T10:00:00Z</lastmod></url>
+  <url><loc>{DOCS_PROD.url}/undated</loc></url>
+  <url><loc>https://example.com/elsewhere</loc></url>
+</urlset>"""
+
+
+def test_spider_skips_sitemap_pages_unmodified_since_last_crawl(
+        incremental_spider):
+    cached_page = CachedPage(url=f"{DOCS_PROD.url}/old",
+                             body_hash="abc",
+                             title="Old")
+    incremental_spider.page_cache.get.return_value = cached_page
+    incremental_spider.since = datetime.datetime(
+        2020, 2, 1, tzinfo=datetime.timezone.utc)
+    url = f"{DOCS_PROD.url}/sitemap.xml"
+    response = XmlResponse(url, body=SITEMAP.encode(), request=Request(url))
+
+    results = list(incremental_spider.parse_sitemap(response))
+
+    assert results[0] == cached_page
+    assert [r.url for r in results[1:]] == [
+        f"{DOCS_PROD.url}/new", f"{DOCS_PROD.url}/undated"
+    ]
+
+
+def test_spider_follows_sitemap_index(incremental_spider):
+    url = f"{DOCS_PROD.url}/sitemap.xml"
+    body = gzip.compress(f"""<?xml version="1.0" encoding="UTF-8"?>
+<sitemapindex xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">
+  <sitemap><loc>{DOCS_PROD.url}/sitemap-1.xml</loc></sitemap>
+</sitemapindex>""".encode())
+    response = XmlResponse(url, body=body, request=Request(url))
+
+    results = list(incremental_spider.parse_sitemap(response))
+
+    assert [r.url for r in results] == [f"{DOCS_PROD.url}/sitemap-1.xml"]
+    assert results[0].callback == incremental_spider.parse_sitemap
+
+
+def test_parse_lastmod():
+    utc = datetime.timezone.utc
+    assert parse_lastmod("2020-01-01") == datetime.datetime(2020, 1, 1,
+                                                            tzinfo=utc)
+    assert parse_lastmod("2020-01-01T10:00:00+02:00") == datetime.datetime(
+        2020, 1, 1, 8, tzinfo=utc)
+    assert parse_lastmod("last tuesday") is None
+    assert parse_lastmod(None) is None
+
+
+def test_index_documents_keeps_unchanged_pages(indexer):
+    pipeline = indexer.redis.pipeline.return_value.__enter__.return_value
+    pipeline.execute.side_effect = [[1], [set()], [], []]
+
+    indexer.index_documents([CachedPage(url=TEST_URL, body_hash="abc")])
+
+    pipeline.hset.assert_not_called()
+    pipeline.sadd.assert_called_once_with(
+        indexer.keys.site_urls_new(indexer.index_alias), TEST_URL)
+
+
+def test_unchanged_pages_keep_their_suggestions(redis, make_indexer,
+                                                parse_file):
+    indexer = make_indexer()
+    docs = parse_file(FILE_WITH_SECTIONS)
+    with mock.patch.object(indexer, 'clear_old_indexes'):
+        indexer.index_documents(docs)
+    indexer.start_generation()
+    next_indexer = make_indexer()
+
+    # The mock queues no FT.SUGADD.
+    with mock.patch.object(next_indexer, 'add_suggestion',
+                           return_value=False) as add_suggestion:
+        next_indexer.index_documents(
+            [CachedPage(url=TEST_URL, body_hash="abc", title=docs[0].title)])
+
+    suggestions = {(c.args[2], c.args[3]) for c in add_suggestion.call_args_list}
+    assert suggestions == {(doc.title, doc.section_title) for doc in docs}
+    next_indexer.metrics.flush()
+    assert redis.hget(next_indexer.keys.metrics(), (
+        'sitesearch_indexer_documents_copied_total'
+        f'{{site="{DOCS_PROD.url}"}}')) == str(len(docs))
+    copied = redis.smembers(
+        next_indexer.keys.url_documents(next_indexer.index_name, TEST_URL))
+    assert copied == {
+        next_indexer.keys.document(next_indexer.index_name, doc.doc_id)
+        for doc in docs
+    }
+    for doc in docs:
+        key = next_indexer.keys.document(next_indexer.index_name, doc.doc_id)
+        assert redis.hget(key, 'body') == doc.body
+
+
+def test_page_cache_round_trip(redis, keys):
+    page_cache = PageCache(redis, keys, keys.index_alias(DOCS_PROD.url))
+    page = CachedPage(url=TEST_URL,
+                      body_hash="abc",
+                      last_modified="Wed, 21 Oct 2015 07:28:00 GMT",
+                      title="Test",
+                      links=[f"{DOCS_PROD.url}/child"])
+
+    page_cache.set(page)
+
+    assert page_cache.get(TEST_URL) == page
+    assert page_cache.get(f"{DOCS_PROD.url}/missing") is None
+
+    page_cache.delete([TEST_URL])
+    assert page_cache.get(TEST_URL) is None
+
+
+def test_extract_text_gets_page_and_section_text_in_one_pass():
+    html = ("<div><p>Intro</p><h2>One</h2><p>First</p>\n<!-- hidden -->"
+            "<script>var x;</script><p>Second</p><h2>Two</h2>Third</div>")
+    soup = BeautifulSoup(html, 'html.parser')
+    parser = DocumentParser(DOCS_PROD.url, (), ())
+
+    page_text, section_texts = parser.extract_text(soup, soup.find_all('h2'))
+
+    assert page_text == "IntroOneFirst\nSecondTwoThird"
+    assert section_texts == ["First\n\nSecond", "Third"]
+
+
+def test_spider_parses_in_pool_like_it_parses_inline():
+    Spider = type(
+        'Spider', (DocumentationSpiderBase, ), {
+            "url": DOCS_PROD.url,
+            "validators": DOCS_PROD.validators,
+            "content_classes": DOCS_PROD.content_classes
+        })
+    spider = Spider()
+    file = os.path.join(DOCS_DIR, FILE_WITH_SECTIONS)
+    with open(file, 'rb') as f:
+        response = HtmlResponse(TEST_URL, body=f.read(),
+                                request=Request(TEST_URL))
+    inline_results = list(spider.parse(response))
+
+    with ThreadPoolExecutor(max_workers=1) as pool, mock.patch(
+            'sitesearch.indexer.await_future', asyncio.wrap_future):
+        spider.parse_pool = pool
+        pool_results = asyncio.run(spider.parse(response))
+
+    assert [r for r in pool_results if isinstance(r, SearchDocument)] == [
+        r for r in inline_results if isinstance(r, SearchDocument)
+    ]
+    assert len(pool_results) == len(inline_results)
+
+
+def test_replay_indexes_pages_recorded_in_crawl_archive(redis, make_indexer,
+                                                       parse_file, tmp_path):
+    indexer = make_indexer()
+    archive = CrawlArchive(str(tmp_path / "crawl.jsonl.gz"))
+    file = os.path.join(DOCS_DIR, FILE_WITH_SECTIONS)
+    with open(file, 'rb') as f:
+        response = HtmlResponse(TEST_URL,
+                                body=f.read(),
+                                headers={'Content-Type': 'text/html'},
+                                request=Request(TEST_URL))
+    archive.open()
+    archive.record(response)
+    archive.close()
+
+    [replayed] = list(archive)
+    assert replayed.url == TEST_URL
+    assert replayed.body == response.body
+    assert replayed.headers['Content-Type'] == b'text/html'
+
+    with mock.patch.object(indexer, 'clear_old_indexes'):
+        indexer.replay(archive)
+
+    docs = parse_file(FILE_WITH_SECTIONS)
+    assert redis.smembers(
+        indexer.keys.url_documents(indexer.index_name, TEST_URL)) == {
+            indexer.keys.document(indexer.index_name, doc.doc_id)
+            for doc in docs
+        }
+    assert redis.smembers(indexer.keys.site_urls_current(
+        indexer.index_alias)) == {TEST_URL}
+    assert not redis.exists(indexer.keys.last_complete_crawl(DOCS_PROD.url))
+
+
+def test_in_place_indexing_writes_only_changed_documents(
+        redis, app_config, make_indexer, parse_file):
+    indexer = make_indexer()
+    docs = parse_file(FILE_WITH_SECTIONS)
+    indexer.index_documents(docs)
+    indexer.start_generation()
+    cached_results = indexer.keys.search_cache(indexer.index_alias,
+                                               indexer.generation)
+    redis.hset(cached_results, "query", "{}")
+    in_place_config = AppConfiguration(key_prefix=app_config.key_prefix,
+                                       in_place_indexing=True)
+
+    updater = make_indexer(in_place_config)
+    changed = replace(docs[1], body="New body")
+    removed = docs[-1]
+    updater.seen_urls[TEST_URL] = docs[0].title
+    updater.index_documents([docs[0], changed, *docs[2:-1]])
+    updater.finish_indexing()
+
+    keys = updater.keys
+    assert updater.index_name == indexer.index_name
+    assert redis.hget(keys.metrics(), (
+        'sitesearch_indexer_documents_unchanged_total'
+        f'{{site="{DOCS_PROD.url}"}}')) == str(len(docs) - 2)
+    assert redis.hget(keys.document(updater.index_name, changed.doc_id),
+                      'body') == "New body"
+    assert not redis.exists(keys.document(updater.index_name, removed.doc_id))
+    assert keys.document(updater.index_name,
+                         removed.doc_id) not in redis.smembers(
+                             keys.url_documents(updater.index_name, TEST_URL))
+    assert redis.get(keys.index_generation(
+        updater.index_alias)) == updater.generation
+    assert updater.generation.startswith(f"{updater.index_name}@")
+    assert not redis.exists(cached_results)
+
+
+def test_resumed_crawl_skips_what_the_last_crawl_did(make_indexer,
+                                                     parse_file):
+    indexer = make_indexer()
+    indexer.checkpoint.start(indexer.index_name, indexer.generation, False,
+                             indexer.crawl_started.timestamp())
+    docs = parse_file(FILE_WITH_SECTIONS)
+    for doc in docs:
+        indexer.queue_document(doc)
+    indexer.index_documents([indexer.docs_to_process.get() for _ in docs])
+    pending_url = f"{DOCS_PROD.url}/pending"
+    indexer.checkpoint.requested(TEST_URL, 'parse')
+    indexer.checkpoint.parsed(TEST_URL, {pending_url: 'parse'})
+    indexer.checkpoint.save()
+
+    resumed = make_indexer()
+    resume_requests, visited = resumed.resume()
+
+    assert resumed.index_name == indexer.index_name
+    assert resumed.crawl_started == indexer.crawl_started
+    assert resumed.seen_urls == {TEST_URL: docs[0].title}
+    assert resume_requests == {pending_url: 'parse'}
+    assert visited == {TEST_URL, pending_url}
+    assert set(resumed.written_keys[TEST_URL]) == {
+        indexer.keys.document(indexer.index_name, doc.doc_id)
+        for doc in docs
+    }
+
+    resumed.finish_checkpoint()
+    assert resumed.checkpoint.load() is None
+
+
+def test_resumed_crawl_follows_links_found_after_the_last_save(
+        make_indexer, parse_file):
+    indexer = make_indexer()
+    assert indexer.lock_site()
+    indexer.start_crawl()
+    indexer.checkpoint.requested(TEST_URL, 'parse')
+    indexer.checkpoint.save()
+    docs = parse_file(FILE_WITH_SECTIONS)
+    for doc in docs:
+        indexer.queue_document(doc)
+    indexer.index_documents([indexer.docs_to_process.get() for _ in docs])
+    linked_url = f"{DOCS_PROD.url}/linked"
+    spider = indexer.spider_type()()
+    response = HtmlResponse(TEST_URL,
+                            body=f'<a href="{linked_url}">a</a>'.encode(),
+                            request=Request(TEST_URL))
+    assert [r.url for r in spider.follow_links(response)] == [linked_url]
+
+    # The crawl stops before it saves the link it followed, so we parse
+    # the page again rather than skip it.
+    stopped = make_indexer()
+    resume_requests, _ = stopped.resume()
+    assert resume_requests == {TEST_URL: 'parse'}
+
+    indexer.checkpoint.save()
+    resumed = make_indexer()
+    resume_requests, visited = resumed.resume()
+    assert resume_requests == {linked_url: 'parse'}
+    assert visited == {TEST_URL, linked_url}
+
+
+def test_checkpoint_is_not_saved_once_the_crawl_finishes(redis, make_indexer):
+    indexer = make_indexer()
+    assert indexer.lock_site()
+    indexer.start_crawl()
+
+    indexer.finish_checkpoint()
+    # The crawl keeps saving its progress until it has finished.
+    indexer.checkpoint.save()
+
+    assert not redis.exists(indexer.checkpoint.key)
+
+
+def test_crawl_holding_the_lock_is_not_resumed(make_indexer):
+    crawling = make_indexer()
+    assert crawling.lock_site()
+    crawling.start_crawl()
+
+    waiting = make_indexer()
+    forced = make_indexer()
+
+    assert waiting.resuming is not None
+    assert not waiting.lock_site()
+    assert forced.lock_site(force=True)
+    assert forced.resuming is None
+    assert forced.index_name != crawling.index_name
+    assert forced.search_index_exists()
+
+    forced.start_crawl()
+    crawling.finish_checkpoint()
+    assert forced.checkpoint.load().index_name == forced.index_name
+
+
+def test_resuming_spider_requests_only_unfinished_pages():
+    pending_url = f"{DOCS_PROD.url}/pending"
+    spider = type(
+        'Spider', (DocumentationSpiderBase, ), {
+            "url": DOCS_PROD.url,
+            "validators": DOCS_PROD.validators,
+            "content_classes": DOCS_PROD.content_classes,
+            "resume_requests": {
+                pending_url: 'parse'
+            },
+            "visited": frozenset({TEST_URL, pending_url})
+        })()
+    response = HtmlResponse(
+        DOCS_PROD.url,
+        body=f'<a href="{TEST_URL}">a</a><a href="{pending_url}/next">b</a>'
+        .encode(),
+        request=Request(DOCS_PROD.url))
+
+    [request] = list(spider.start_requests())
+    followed = [r.url for r in spider.follow_links(response)]
+
+    assert request.url == pending_url
+    assert request.callback == spider.parse
+    assert followed == [f"{pending_url}/next"]
+
+
+def test_last_crawl_shard_makes_the_index_live(redis, make_indexer,
+                                               parse_file, threads_inline):
+    coordinator = make_indexer()
+    assert coordinator.start_distributed_crawl(2, force=True)
+
+    shards = [make_indexer() for _ in range(2)]
+    docs = parse_file(FILE_WITH_SECTIONS)
+    for number, shard in enumerate(shards):
+        assert shard.index_name == coordinator.index_name
+        assert shard.frontier.join(number)
+        shard.frontier.heartbeat_interval = 0.01
+        shard.checkpoint.join(shard.index_name)
+    shards[0].queue_document(docs[0])
+    shards[0].index_documents([shards[0].docs_to_process.get()])
+    shards[0].docs_to_process.task_done()
+    shards_key = coordinator.keys.crawl_shards(coordinator.index_name)
+
+    clock = task.Clock()
+
+    with mock.patch.object(Indexer, 'create_index_alias') as create_alias:
+        # The first shard waits for the other one to finish.
+        first = shards[0].finish_shard(clock)
+        assert not first.called
+        assert not redis.zscore(shards_key, shards[0].frontier.shard)
+        assert shards[1].finish_shard(clock).called
+        clock.advance(shards[0].frontier.heartbeat_interval)
+        assert first.called
+        create_alias.assert_called_once()
+
+    assert shards[1].seen_urls == {TEST_URL: docs[0].title}
+    assert redis.smembers(coordinator.keys.site_urls_current(
+        coordinator.index_alias)) == {TEST_URL}
+    assert shards[1].checkpoint.load() is None
+    assert not redis.exists(coordinator.keys.crawl_shards(
+        coordinator.index_name))
+
+
+def test_live_shard_finishes_crawl_without_lost_shard(redis, make_indexer,
+                                                      threads_inline):
+    coordinator = make_indexer()
+    assert coordinator.start_distributed_crawl(2, force=True)
+    shard = make_indexer()
+    assert shard.frontier.join(0)
+    shard.checkpoint.join(shard.index_name)
+    # The other shard's job never ran.
+    shard.frontier.shard_timeout = 0
+
+    with mock.patch.object(Indexer, 'create_index_alias') as create_alias:
+        assert shard.finish_shard().called
+
+    create_alias.assert_called_once()
+    assert shard.checkpoint.load() is None
+    assert not redis.exists(coordinator.keys.crawl_shards(
+        coordinator.index_name))
+
+
+def test_drain_stops_writers_after_writing_queued_documents(
+        redis, make_indexer, parse_file):
+    indexer = make_indexer()
+    docs = parse_file(FILE_WITH_SECTIONS)
+    indexer.start_writers()
+    writers = list(indexer.writers)
+
+    for doc in docs:
+        indexer.queue_document(doc)
+    indexer.drain()
+
+    assert indexer.writers == []
+    assert not any(writer.is_alive() for writer in writers)
+    assert redis.exists(indexer.keys.document(indexer.index_name,
+                                              docs[0].doc_id))
+
+
+def test_setup_index_adds_synonym_suggestions(redis, make_indexer):
+    indexer = make_indexer()
+
+    assert redis.execute_command('FT.SUGLEN', indexer.suggestions_key) == len(
+        DOCS_PROD.all_synonyms)
+
+
+def test_queue_document_later_waits_for_room_off_the_reactor(indexer,
+                                                             parse_file):
+    docs = parse_file(FILE_WITH_SECTIONS)
+    indexer.docs_to_process = Queue(maxsize=1)
+
+    queued = indexer.queue_document_later(docs[0])
+    with mock.patch('sitesearch.indexer.threads.deferToThread') as defer_put:
+        waiting = indexer.queue_document_later(docs[1])
+
+    assert queued.called
+    assert waiting is defer_put.return_value
+    defer_put.assert_called_once_with(indexer.docs_to_process.put, docs[1])
+    assert indexer.docs_to_process.get_nowait() == docs[0]
@@ -0,0 +1,39 @@
+import json
+
+from click.testing import CliRunner
+
+from benchmarks.loadtest import loadtest
+from sitesearch.keys import Keys
+
+
+def test_export_writes_sampled_queries_oldest_first(redis, app_config):
+    key = Keys(app_config.key_prefix).query_log()
+    redis.delete(key)
+    redis.lpush(key, json.dumps({"q": "first"}), json.dumps({"q": "second"}))
+
+    result = CliRunner().invoke(loadtest, ['export'])
+
+    redis.delete(key)
+    assert result.exit_code == 0, result.output
+    assert [json.loads(line)['q'] for line in result.output.splitlines()] == [
+        "first", "second"
+    ]
+
+
+def test_replay_reports_latency_and_errors(tmp_path):
+    queries = tmp_path / "queries.jsonl"
+    queries.write_text('{"q": "redis"}\n'
+                       '{"q": "redis", "site": "https://example.com"}\n')
+    output = tmp_path / "results.json"
+
+    result = CliRunner().invoke(loadtest, [
+        'replay', str(queries), '--concurrency', '2', '--repeat', '2',
+        '--output', str(output)
+    ])
+
+    assert result.exit_code == 0, result.output
+    results = json.loads(output.read_text())
+    assert results['requests'] == 4
+    assert results['status_codes'] == {"200": 2, "400": 2}
+    assert results['error_rate'] == 0.5
+    assert results['latency_ms']['p50'] <= results['latency_ms']['p99']
@@ -0,0 +1,88 @@
+from unittest import mock
+
+import pytest
+from redis.exceptions import ResponseError
+
+from sitesearch.indexer import Indexer
+from sitesearch.keys import Keys
+from sitesearch.metrics import (CONTENT_TYPE, DOCUMENTS_WRITTEN,
+                                SEARCH_CACHE_HITS, SEARCH_STAGE_SECONDS,
+                                QUEUE_DEPTH, WRITE_ERRORS, Metrics, render,
+                                sample)
+from sitesearch.sites.redis_labs import DOCS_PROD
+
+
+@pytest.fixture
+def metrics(redis, app_config):
+    keys = Keys(app_config.key_prefix)
+    redis.delete(keys.metrics())
+    yield Metrics(redis, keys)
+    redis.delete(keys.metrics())
+
+
+def test_metrics_aggregate_across_processes(redis, metrics):
+    other_process = Metrics(redis, metrics.keys)
+    metrics.observe(SEARCH_STAGE_SECONDS, 0.003, stage='parse')
+    other_process.observe(SEARCH_STAGE_SECONDS, 0.2, stage='parse')
+    other_process.increment(SEARCH_CACHE_HITS)
+    metrics.flush()
+    other_process.flush()
+
+    values = redis.hgetall(metrics.keys.metrics())
+    bucket = 'sitesearch_search_stage_seconds_bucket{{le="{}",stage="parse"}}'
+
+    assert values[bucket.format('0.001')] == '0'
+    assert values[bucket.format('0.005')] == '1'
+    assert values[bucket.format('0.25')] == '2'
+    assert values[bucket.format('+Inf')] == '2'
+    assert values['sitesearch_search_stage_seconds_count{stage="parse"}'] == '2'
+    assert float(values['sitesearch_search_stage_seconds_sum{stage="parse"}']) == \
+        pytest.approx(0.203)
+    assert values['sitesearch_search_cache_hits_total'] == '1'
+
+
+def test_render_orders_histogram_buckets():
+    text = render({
+        'sitesearch_search_stage_seconds_bucket{le="+Inf",stage="parse"}': '2',
+        'sitesearch_search_stage_seconds_bucket{le="10.0",stage="parse"}': '2',
+        'sitesearch_search_stage_seconds_bucket{le="0.5",stage="parse"}': '1',
+        'sitesearch_search_stage_seconds_count{stage="parse"}': '2',
+        'sitesearch_search_stage_seconds_sum{stage="parse"}': '1.5',
+    })
+
+    lines = text.splitlines()
+    start = lines.index('# TYPE sitesearch_search_stage_seconds histogram') + 1
+    assert lines[start:start + 5] == [
+        'sitesearch_search_stage_seconds_bucket{le="0.5",stage="parse"} 1',
+        'sitesearch_search_stage_seconds_bucket{le="10.0",stage="parse"} 2',
+        'sitesearch_search_stage_seconds_bucket{le="+Inf",stage="parse"} 2',
+        'sitesearch_search_stage_seconds_count{stage="parse"} 2',
+        'sitesearch_search_stage_seconds_sum{stage="parse"} 1.5',
+    ]
+
+
+def test_metrics_endpoint(client, metrics):
+    metrics.set(QUEUE_DEPTH, 12, site=DOCS_PROD.url)
+    metrics.flush()
+
+    result = client.simulate_get('/metrics')
+
+    assert result.status_code == 200
+    assert result.headers['content-type'] == CONTENT_TYPE
+    assert '# TYPE sitesearch_indexer_queue_depth gauge' in result.text
+    assert f'sitesearch_indexer_queue_depth{{site="{DOCS_PROD.url}"}} 12' \
+        in result.text.splitlines()
+
+
+def test_indexer_counts_written_documents_and_errors(app_config, parse_file):
+    indexer = Indexer(DOCS_PROD, app_config, mock.MagicMock())
+    docs = parse_file("page_with_sections.html")
+    pipeline = indexer.redis.pipeline.return_value.__enter__.return_value
+    pipeline.execute.return_value = [1, 1, 1, 1] * len(docs)
+    pipeline.execute.return_value[4] = ResponseError("OOM")
+
+    indexer.index_documents(docs)
+
+    counts = indexer.metrics.counts
+    assert counts[sample(DOCUMENTS_WRITTEN.name, site=DOCS_PROD.url)] == len(docs) - 1
+    assert counts[sample(WRITE_ERRORS.name, site=DOCS_PROD.url)] == 1
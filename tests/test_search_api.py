@@ -1,4 +1,17 @@
+import json
 import time
+from concurrent.futures import ThreadPoolExecutor
+from threading import Event
+from unittest import mock
+
+from falcon import testing
+from redis.exceptions import ResponseError
+from redisearch import Result
+
+from sitesearch.api.app import create_app
+from sitesearch.config import AppConfiguration
+from sitesearch.keys import Keys
+from sitesearch.sites.redis_labs import DOCS_PROD
 
 
 def test_query_python(docs, client):
@@ -14,3 +27,133 @@ def test_cloud_landing_page(client):
     result = client.simulate_get('/search?q=cloud')
     assert result.json['results'][0]['title'] == 'Redis Enterprise Cloud'
     assert result.json['results'][0]['url'] == 'https://docs.redislabs.com/latest/rc/'
+
+
+def test_search_caches_results_per_index_generation(redis, client, app_config):
+    keys = Keys(app_config.key_prefix)
+    generation_key = keys.index_generation(keys.index_alias(DOCS_PROD.url))
+    search_client = mock.MagicMock()
+    search_client.search.return_value = Result([0], False)
+    redis.set(generation_key, "generation-1")
+
+    with mock.patch('sitesearch.api.search.get_shared_search_connection',
+                    return_value=search_client):
+        first = client.simulate_get('/search?q=redis&num=5')
+        second = client.simulate_get('/search?q=redis&num=5')
+        redis.set(generation_key, "generation-2")
+        client.simulate_get('/search?q=redis&num=5')
+
+    assert first.json == second.json
+    assert search_client.search.call_count == 2
+
+
+def test_search_searches_the_current_generation(redis, client, app_config):
+    keys = Keys(app_config.key_prefix)
+    redis.set(keys.index_generation(keys.index_alias(DOCS_PROD.url)),
+              "generation-1")
+    search_client = mock.MagicMock()
+    search_client.search.return_value = Result([0], False)
+
+    with mock.patch('sitesearch.api.search.get_shared_search_connection',
+                    return_value=search_client) as get_search_connection:
+        client.simulate_get('/search?q=replicas')
+
+    assert get_search_connection.call_args[0][0] == "generation-1"
+
+
+def test_search_does_not_cache_failed_searches(redis, client, app_config):
+    keys = Keys(app_config.key_prefix)
+    redis.set(keys.index_generation(keys.index_alias(DOCS_PROD.url)),
+              "generation-1")
+    search_client = mock.MagicMock()
+    search_client.search.side_effect = ResponseError("Unknown index name")
+
+    with mock.patch('sitesearch.api.search.get_shared_search_connection',
+                    return_value=search_client):
+        client.simulate_get('/search?q=failing')
+        client.simulate_get('/search?q=failing')
+
+    assert search_client.search.call_count == 2
+
+
+def test_search_answers_not_modified_for_current_generation(redis, client,
+                                                            app_config):
+    keys = Keys(app_config.key_prefix)
+    generation_key = keys.index_generation(keys.index_alias(DOCS_PROD.url))
+    search_client = mock.MagicMock()
+    search_client.search.return_value = Result([0], False)
+    redis.set(generation_key, "etag-generation-1")
+
+    with mock.patch('sitesearch.api.search.get_shared_search_connection',
+                    return_value=search_client):
+        first = client.simulate_get('/search?q=etag')
+        etag = first.headers['etag']
+        cached = client.simulate_get('/search?q=etag',
+                                     headers={'If-None-Match': f'W/{etag}'})
+        redis.set(generation_key, "etag-generation-2")
+        reindexed = client.simulate_get('/search?q=etag',
+                                        headers={'If-None-Match': etag})
+
+    assert first.headers['cache-control'] == DOCS_PROD.cache_control
+    assert cached.status_code == 304
+    assert cached.headers['etag'] == etag
+    assert reindexed.status_code == 200
+    assert reindexed.headers['etag'] != etag
+    assert search_client.search.call_count == 2
+
+
+def test_failed_searches_have_no_etag(redis, client, app_config):
+    keys = Keys(app_config.key_prefix)
+    redis.set(keys.index_generation(keys.index_alias(DOCS_PROD.url)),
+              "generation-1")
+    search_client = mock.MagicMock()
+    search_client.search.side_effect = ResponseError("Unknown index name")
+
+    with mock.patch('sitesearch.api.search.get_shared_search_connection',
+                    return_value=search_client):
+        result = client.simulate_get('/search?q=failing-etag')
+
+    assert 'etag' not in result.headers
+    assert 'cache-control' not in result.headers
+
+
+def test_search_samples_queries_into_query_log(redis):
+    config = AppConfiguration(key_prefix="sitesearch:test",
+                              env="test",
+                              query_log_sample_rate=1,
+                              query_log_size=2)
+    key = Keys(config.key_prefix).query_log()
+    redis.delete(key)
+    client = testing.TestClient(create_app(config))
+
+    for q in ("one", "two", "three"):
+        client.simulate_get('/search', params={"q": q, "start": "0"})
+
+    entries = [json.loads(entry) for entry in redis.lrange(key, 0, -1)]
+    redis.delete(key)
+    assert entries == [{"q": "three", "start": "0"}, {"q": "two", "start": "0"}]
+
+
+def test_concurrent_identical_searches_share_one_query(redis, client,
+                                                       app_config):
+    keys = Keys(app_config.key_prefix)
+    redis.set(keys.index_generation(keys.index_alias(DOCS_PROD.url)),
+              "coalesce-generation-1")
+    release = Event()
+    search_client = mock.MagicMock()
+    search_client.search.side_effect = lambda q: release.wait() and Result(
+        [0], False)
+
+    with mock.patch('sitesearch.api.search.get_shared_search_connection',
+                    return_value=search_client):
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            futures = [
+                pool.submit(client.simulate_get, '/search?q=coalesce')
+                for _ in range(4)
+            ]
+            time.sleep(0.1)
+            release.set()
+            results = [f.result() for f in futures]
+
+    assert search_client.search.call_count == 1
+    assert all(r.json == results[0].json for r in results)
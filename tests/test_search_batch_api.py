@@ -0,0 +1,83 @@
+from unittest import mock
+
+from redis.exceptions import ResponseError
+
+from sitesearch.api.search_batch import MAX_BATCH_SIZE
+from sitesearch.keys import Keys
+from sitesearch.sites.redis_labs import DOCS_PROD
+
+SEARCH_REPLY = [
+    1, f"sitesearch:test:{DOCS_PROD.url}:doc:test", [
+        "title", "Test", "section_title", "", "hierarchy", "[]", "body",
+        "A test page", "url", f"{DOCS_PROD.url}test"
+    ]
+]
+
+
+def test_batch_search_isolates_invalid_queries(client):
+    result = client.simulate_post('/search/batch',
+                                  json={
+                                      "queries": [{
+                                          "q": "cloud"
+                                      }, {
+                                          "q": "redis",
+                                          "site": "https://example.com"
+                                      }, "redis", {
+                                          "q": "redis",
+                                          "start": "first"
+                                      }, {
+                                          "q": None
+                                      }, {
+                                          "q": {"text": "redis"}
+                                      }]
+                                  })
+
+    assert result.status_code == 200
+    (cloud, bad_site, not_object, bad_start, null_q,
+     object_q) = result.json['results']
+    assert cloud['results'][0]['title'] == 'Redis Enterprise Cloud'
+    assert bad_site['error']['title'] == "Invalid site"
+    assert not_object['error']['title'] == "Invalid query"
+    assert bad_start['error']['title'] == "Invalid query"
+    assert null_q['error']['title'] == "Invalid query"
+    assert object_q['error']['title'] == "Invalid query"
+
+
+def test_batch_search_does_not_answer_get(client):
+    result = client.simulate_get('/search/batch', params={"q": "redis"})
+
+    assert result.status_code == 405
+
+
+def test_batch_search_sends_searches_in_one_pipeline(redis, client,
+                                                    app_config):
+    keys = Keys(app_config.key_prefix)
+    redis.set(keys.index_generation(keys.index_alias(DOCS_PROD.url)),
+              "generation-1")
+    search_redis = mock.MagicMock()
+    pipeline = search_redis.pipeline.return_value
+    pipeline.execute.side_effect = [[SEARCH_REPLY, ResponseError("Syntax error")],
+                                    [ResponseError("Syntax error")]]
+    batch = {"queries": [{"q": "batched"}, {"q": "batched-failure"}]}
+
+    with mock.patch('sitesearch.api.search_batch.get_shared_redis_connection',
+                    return_value=search_redis):
+        first = client.simulate_post('/search/batch', json=batch)
+        second = client.simulate_post('/search/batch', json=batch)
+
+    assert pipeline.execute_command.call_count == 3
+    assert pipeline.execute_command.call_args[0][2] == "batched-failure"
+    found, failed = first.json['results']
+    assert found['results'][0]['title'] == "Test"
+    assert failed == {"total": 0, "results": []}
+    assert second.json == first.json
+
+
+def test_batch_search_limits_batch_size(client):
+    result = client.simulate_post(
+        '/search/batch',
+        json={"queries": [{
+            "q": "redis"
+        }] * (MAX_BATCH_SIZE + 1)})
+
+    assert result.status_code == 400
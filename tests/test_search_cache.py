@@ -0,0 +1,49 @@
+from sitesearch.keys import Keys
+from sitesearch.search_cache import LRUCache, SearchCache, generation_index
+from sitesearch.sites.redis_labs import DOCS_PROD
+
+PARAMS = (DOCS_PROD.url, "redis", "", 0, 30)
+
+
+def test_lru_cache_evicts_least_recently_used_item():
+    cache = LRUCache(2)
+    cache.set("a", "1")
+    cache.set("b", "2")
+    cache.get("a")
+    cache.set("c", "3")
+
+    assert cache.get("a") == "1"
+    assert cache.get("b") is None
+    assert cache.get("c") == "3"
+
+
+def test_search_cache_shares_results_through_redis(redis, app_config):
+    keys = Keys(app_config.key_prefix)
+    index_alias = keys.index_alias(DOCS_PROD.url)
+    SearchCache(redis, keys, 10).set(index_alias, "gen-1", PARAMS, "{}")
+
+    other_process = SearchCache(redis, keys, 10)
+
+    assert other_process.get(index_alias, "gen-1", PARAMS) == "{}"
+    assert other_process.get(index_alias, "gen-2", PARAMS) is None
+
+
+def test_new_generation_deletes_cached_results(redis, app_config,
+                                               make_indexer):
+    keys = Keys(app_config.key_prefix)
+    cache = SearchCache(redis, keys, 10)
+    old_indexer = make_indexer()
+    old_indexer.start_generation()
+    cache.set(old_indexer.index_alias, old_indexer.index_name, PARAMS, "{}")
+
+    new_indexer = make_indexer()
+    new_indexer.start_generation()
+
+    assert cache.generation(new_indexer.index_alias) == new_indexer.index_name
+    assert not redis.exists(
+        keys.search_cache(old_indexer.index_alias, old_indexer.index_name))
+
+
+def test_generation_index_names_the_index_a_generation_came_from():
+    assert generation_index("site-1") == "site-1"
+    assert generation_index("site-1@1620000000.0") == "site-1"
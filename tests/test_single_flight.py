@@ -0,0 +1,56 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from threading import Event
+from unittest import mock
+
+import pytest
+
+from sitesearch.single_flight import AsyncSingleFlight, SingleFlight
+
+
+def test_concurrent_callers_share_one_call():
+    in_flight = SingleFlight()
+    release = Event()
+    fn = mock.MagicMock(side_effect=lambda: release.wait() and "results")
+
+    with ThreadPoolExecutor(max_workers=5) as pool:
+        futures = [pool.submit(in_flight.do, "key", fn) for _ in range(5)]
+        # Give every caller time to arrive while the first call runs.
+        time.sleep(0.1)
+        release.set()
+        results = [f.result() for f in futures]
+
+    assert fn.call_count == 1
+    assert sorted(results) == [("results", False)] + [("results", True)] * 4
+    assert in_flight.calls == {}
+
+
+def test_callers_share_errors_and_then_call_again():
+    in_flight = SingleFlight()
+    fn = mock.MagicMock(side_effect=[ValueError("failed"), "results"])
+
+    with pytest.raises(ValueError):
+        in_flight.do("key", fn)
+
+    assert in_flight.do("key", fn) == ("results", False)
+
+
+def test_async_callers_share_one_call():
+    in_flight = AsyncSingleFlight()
+    calls = []
+
+    async def search():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return "results"
+
+    async def run():
+        return await asyncio.gather(
+            *(in_flight.do("key", search) for _ in range(3)))
+
+    results = asyncio.run(run())
+
+    assert len(calls) == 1
+    assert results == [("results", False), ("results", True), ("results", True)]
+    assert in_flight.calls == {}
@@ -0,0 +1,42 @@
+from unittest import mock
+
+from redisearch import Suggestion
+
+from sitesearch.keys import Keys
+from sitesearch.sites.redis_labs import DOCS_PROD
+
+
+def test_suggest_completes_from_current_generation(redis, client, app_config):
+    keys = Keys(app_config.key_prefix)
+    index_alias = keys.index_alias(DOCS_PROD.url)
+    redis.set(keys.index_generation(index_alias), "generation-1")
+    url = f"{DOCS_PROD.url}rs/concepts/data-access/persistence/"
+
+    with mock.patch('sitesearch.api.suggest.AutoCompleter') as completer:
+        completer.return_value.get_suggestions.return_value = [
+            Suggestion("Persistence", payload=url)
+        ]
+        result = client.simulate_get('/suggest?q=pers&num=5')
+
+    assert completer.call_args[0][0] == keys.suggestions(
+        index_alias, "generation-1")
+    completer.return_value.get_suggestions.assert_called_once_with(
+        "pers", num=5, with_payloads=True)
+    assert result.json == {
+        "suggestions": [{
+            "text": "Persistence",
+            "url": url
+        }]
+    }
+
+
+def test_suggest_returns_nothing_before_first_index(client):
+    result = client.simulate_get('/suggest?q=pers')
+
+    assert result.json == {"suggestions": []}
+
+
+def test_suggest_rejects_invalid_site(client):
+    result = client.simulate_get('/suggest?q=pers&site=https://example.com')
+
+    assert result.status_code == 400